@@ -0,0 +1,105 @@
+# pylint: disable=line-too-long
+""" Transcribes existing recordings without recording anything, an interrupted run picks up where it stopped when run again """
+
+import os
+import sys
+import argparse
+import configparser
+
+sys.path.append('.\\src\\')
+import batch
+import outputs
+import archive_index
+import keywords
+
+# Modify the following constants as desired
+MODEL_DIRECTORY = 'vosk-model-small-en-us-0.15'
+# Timestamps in the produced .txt log are added every TRANSCRIPTION_TIMESTAMP_FREQUENCY seconds (default 10 seconds)
+TRANSCRIPTION_TIMESTAMP_FREQUENCY = 10
+# Finished transcripts are added to this index for search_archive.py ('' to not index them)
+TRANSCRIPT_INDEX = archive_index.INDEX_FILENAME
+
+
+def parse_time(p_text):
+    """ Turns a time given as seconds, MM:SS or HH:MM:SS into seconds, for the --start and --end options """
+
+    try:
+        seconds = 0.0
+        for x in p_text.split(':'):
+            seconds = seconds * 60 + float(x)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time '{p_text}', use seconds, MM:SS or HH:MM:SS")
+    if p_text.count(':') > 2 or seconds < 0:
+        raise argparse.ArgumentTypeError(f"invalid time '{p_text}', use seconds, MM:SS or HH:MM:SS")
+    return seconds
+
+if __name__ == '__main__':
+    """ da main function """
+
+
+    # Parsing config defaults from default_values.ini into variables
+    config_parser = configparser.ConfigParser()
+    config_parser.read('default_values.ini')
+    defaults = config_parser['DEFAULT_VALUES']
+
+    MODEL_DIRECTORY = defaults['MODEL_DIRECTORY']
+    try:
+        TRANSCRIPTION_TIMESTAMP_FREQUENCY = int(defaults['TRANSCRIPTION_TIMESTAMP_FREQUENCY'])
+    except ValueError:
+        print(f'\nInvalid value for TRANSCRIPTION_TIMESTAMP_FREQUENCY in default_values.ini.\n\nPlease make sure TRANSCRIPTION_TIMESTAMP_FREQUENCY in default_values.ini is a number.\nCurrent value: {defaults['TRANSCRIPTION_TIMESTAMP_FREQUENCY']}\n', file=sys.stderr)
+        quit()
+    TRANSCRIPT_INDEX = defaults.get('TRANSCRIPT_INDEX', TRANSCRIPT_INDEX)
+    if TRANSCRIPT_INDEX:
+        archive_index.configure(TRANSCRIPT_INDEX)
+
+    # Parsing CLI arguments and updating config defaults
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("sources", nargs='+',   help="Directories (searched recursively for .wav files), glob patterns, or manifest files listing one .wav path per line")
+    arg_parser.add_argument("-O","--output_dir",   help="Set the directory transcriptions and the job ledger are written to (default is next to each recording, with the ledger in the current directory)")
+    arg_parser.add_argument("-t","--output_type", action='append', choices=[x for x in outputs.type_outputs],   help="Set the transcription output file type, can be used more than once to write several file types from one transcription (default is txt)")
+    arg_parser.add_argument("-w","--workers", type=int, default=os.cpu_count(),   help=f"Set the number of worker processes, each loads the recognition model once and reuses it for all of its recordings (default is {os.cpu_count()})")
+    arg_parser.add_argument("--start", type=parse_time, default=0.0,   help="Only transcribe from this far into each recording, in seconds, MM:SS or HH:MM:SS (default is the start)")
+    arg_parser.add_argument("--end", type=parse_time,   help="Only transcribe up to this far into each recording, in seconds, MM:SS or HH:MM:SS (default is the end)")
+    arg_parser.add_argument("-K","--keywords",   help="Only find when these phrases were said instead of transcribing everything (several times faster), a file with one phrase per line or a comma separated list (ex. 'action item,decision'). Hits are written with their confidence to files ending in _keywords (default file type is json)")
+    arg_parser.add_argument("--resume", action='store_true',   help="Carry on recordings whose transcription was interrupted part way through from their last checkpoint instead of starting them over")
+    arg_parser.add_argument("-s","--set_model_dir",   help=f"Set the name of the desired speech recognition model directory to use for transcription. The input will searched from the names of available directories inside the models directory, input is case insensitive (default is '{MODEL_DIRECTORY}')")
+
+    args = arg_parser.parse_args()
+
+    if args.end is not None and args.end <= args.start:
+        print(f"\n--end must be after --start\n", file=sys.stderr)
+        quit()
+
+    phrases = None
+    if args.keywords:
+        phrases = keywords.load_phrases(args.keywords)
+        if not phrases:
+            print(f"\nNo phrases to spot were found in '{args.keywords}'\n", file=sys.stderr)
+            quit()
+
+    if args.set_model_dir:
+        MODEL_DIRECTORY = args.set_model_dir
+
+    # Searching for user's recognition model name among the directories in .\models\
+    model_name = -1
+    for x in os.listdir('.\\models\\'):
+
+        if os.path.isdir('.\\models\\' + x) \
+          and MODEL_DIRECTORY.upper() in x.upper():
+            model_name = x
+            break
+
+    if model_name == -1:
+        print(f"\nUnable to find a recognition model in the models directory with '{MODEL_DIRECTORY}' in the name.\n\nPlease make sure your models directory looks like this:\nex.  models/recognition_model_name/(model contents)\n", file=sys.stderr)
+        quit()
+
+    print(f"\nThe following recognition model is being used for transcription:")
+    print(f"{model_name}")
+    print()
+
+
+    num_jobs, num_failed, throughput = batch.run(args.sources, '.\\models\\' + model_name, output_dir=args.output_dir, output_types=args.output_type or (['json'] if phrases else ['txt']), workers=args.workers, timestamp_duration=TRANSCRIPTION_TIMESTAMP_FREQUENCY, start=args.start, end=args.end, resume=args.resume, phrases=phrases)
+
+    if num_jobs:
+        print(f"\n{num_jobs - num_failed} of {num_jobs} recordings transcribed, {num_failed} failed")
+        print(f"Throughput: {throughput:.2f} audio hours per wall-clock hour")
@@ -0,0 +1,79 @@
+# pylint: disable=line-too-long
+""" Micro-benchmark of mixer.Mixer against the downmix and mix prepare_audio() did before it, for an increasing number of inputs """
+# Run from the repository root with `python benchmarks/bench_mixer.py`
+# Throughput is mixed samples per second (downmix of every input + mix), allocated is the most memory held by
+# temporary arrays at once while mixing, measured with tracemalloc after a warm up block (numpy reports its buffers to it).
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import mixer
+
+BLOCK_FRAMES = 1024
+SECONDS_OF_AUDIO = 10
+SAMPLE_RATE = 16000
+CHANNELS = 2
+INPUT_COUNTS = (1, 2, 4, 8, 16, 32)
+
+
+def legacy_downmix(p_interleaved, p_channels):
+    """ The channel downmix prepare_audio() did before mixer.Mixer, kept here for comparison """
+
+    working_data = p_interleaved[0::p_channels].astype(numpy.int32)
+    for y in range(1, p_channels):
+        working_data = working_data + p_interleaved[y::p_channels]
+    return working_data // p_channels
+
+
+def legacy_mix(p_frame):
+    """ The mix prepare_audio() did before mixer.Mixer, kept here for comparison """
+
+    mixed_data = p_frame[0]
+    for x in p_frame[1:]:
+        mixed_data = mixed_data + x
+    mixed_data = mixed_data // len(p_frame)
+    return numpy.clip(mixed_data, -32768, 32767).astype(numpy.int16)
+
+
+def run_blocks(p_downmix, p_mix, p_blocks):
+    """ Downmixes and mixes every block (one interleaved array per input), returns (mixed samples per second, peak temporary bytes) """
+
+    # One block first so buffers the mixer keeps for good aren't counted
+    p_mix([p_downmix(x, y) for x, y in enumerate(p_blocks[0])])
+
+    start = time.perf_counter()
+    for block in p_blocks:
+        p_mix([p_downmix(x, y) for x, y in enumerate(block)])
+    elapsed = time.perf_counter() - start
+
+    # tracemalloc slows everything down, so allocations are measured in a second pass
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for block in p_blocks:
+        p_mix([p_downmix(x, y) for x, y in enumerate(block)])
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    return (len(p_blocks) * BLOCK_FRAMES / elapsed, peak)
+
+
+if __name__ == '__main__':
+
+    generator = numpy.random.default_rng(0)
+    num_blocks = SAMPLE_RATE * SECONDS_OF_AUDIO // BLOCK_FRAMES
+
+    print(f"{'inputs':>6}  {'Mixer (samples/s)':>18}  {'legacy (samples/s)':>19}  {'speedup':>8}  {'Mixer allocated':>16}  {'legacy allocated':>17}")
+    for count in INPUT_COUNTS:
+        blocks = [[generator.integers(-32768, 32767, BLOCK_FRAMES * CHANNELS, dtype=numpy.int16) for _ in range(count)] for _ in range(num_blocks)]
+
+        audio_mixer = mixer.Mixer(count)
+        # The mixer's downmix buffers are only good until the next downmix of the same input, which is after the mix here the same as in prepare_audio()
+        new_rate, new_peak = run_blocks(lambda x, y: audio_mixer.downmix(x, y, CHANNELS), audio_mixer.mix, blocks)
+        legacy_rate, legacy_peak = run_blocks(lambda x, y: legacy_downmix(y, CHANNELS), legacy_mix, blocks)
+
+        print(f"{count:>6}  {new_rate:>18,.0f}  {legacy_rate:>19,.0f}  {new_rate / legacy_rate:>7.1f}x  {new_peak / 1024:>13,.1f} KB  {legacy_peak / 1024:>14,.1f} KB")
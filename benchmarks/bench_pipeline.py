@@ -0,0 +1,248 @@
+# pylint: disable=line-too-long
+""" Headless benchmarks of the recording and transcription pipeline, results are saved as JSON so runs can be compared over time """
+# Run from the repository root with `python benchmarks/bench_pipeline.py`, no sound card, keyboard hook or key presses needed:
+#
+#       prepare     record_audio.prepare_audio() throughput (x real time) for each device mix, fed as fast as it can read
+#       record      record_audio.record() end to end with fake devices running in real time, reports dropped audio
+#       from_wav    transcriber.from_wav() real time factor for every model in models/
+#       outputs     time per entry for every writer in outputs.type_outputs
+#
+# Use --compare with an earlier results file to print the change in each number, the exit code is 1 if anything
+# got slower by more than --tolerance.
+
+import os
+import io
+import sys
+import json
+import time
+import wave
+import argparse
+import datetime
+import platform
+import tempfile
+import multiprocessing
+
+import numpy
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BENCHMARK_DIR)
+sys.path.append(os.path.join(BENCHMARK_DIR, '..', 'src'))
+import fake_devices
+# Installed at import time so prepare_audio() processes started with spawn get the fakes too
+fake_devices.install()
+import record_audio
+import ring_buffer
+import transcriber
+import outputs
+
+MODELS_DIR = os.path.join(BENCHMARK_DIR, '..', 'models')
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+BENCHMARKS = ('prepare', 'record', 'from_wav', 'outputs')
+# (channels, sample rate) of each device in a mix
+DEVICE_MIXES = {'mono 16k': ((1, 16000),),
+                'mic + stereo mix': ((1, 44100), (2, 48000)),
+                'four devices': ((2, 48000), (2, 44100), (1, 16000), (2, 96000))}
+OUTPUT_ENTRIES = 10000
+# Numbers compared by --compare, they are "higher is better" unless listed in LOWER_IS_BETTER
+COMPARED = ('x_real_time', 'real_time_factor', 'microseconds_per_entry', 'dropped_chunks', 'input_overflows')
+LOWER_IS_BETTER = ('real_time_factor', 'microseconds_per_entry', 'dropped_chunks', 'input_overflows')
+
+
+def bench_prepare(p_mix, p_seconds, p_wav_path=None):
+    """ Feeds p_seconds of audio per device into prepare_audio() as fast as it reads it, returns its throughput """
+
+    rings = [ring_buffer.RingBuffer.create(record_audio.CHUNK_SIZE * record_audio.RING_CHUNKS, x, y) for x, y in p_mix]
+    sources = [fake_devices.AudioSource(y, x, p_wav_path, frequency=220 * (z + 1)) for z, (x, y) in enumerate(p_mix)]
+    # Chunks are made up front so generating them isn't timed
+    chunks = [[x.read(record_audio.CHUNK_SIZE) for _ in range(p_seconds * x.sample_rate // record_audio.CHUNK_SIZE)] for x in sources]
+
+    start_time = time.monotonic_ns()
+    for x in rings:
+        x.header[ring_buffer.HEADER_START_TIME] = start_time
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        process = multiprocessing.Process(target=record_audio.prepare_audio, args=(os.path.join(temp_dir, 'bench.wav'), [x.name for x in rings]))
+
+        start = time.perf_counter()
+        process.start()
+
+        # Devices are written round robin, waiting whenever a ring doesn't have room for the next chunk
+        position = [0] * len(rings)
+        while any(x < len(y) for x, y in zip(position, chunks)):
+            for x, ring in enumerate(rings):
+                if position[x] < len(chunks[x]) and ring.capacity - ring.available() >= record_audio.CHUNK_SIZE:
+                    ring.write(chunks[x][position[x]])
+                    position[x] += 1
+            time.sleep(0)
+        for x in rings:
+            x.close()
+
+        process.join()
+        wall_seconds = time.perf_counter() - start
+
+    for x in rings:
+        x.release()
+
+    audio_seconds = min(len(x) * record_audio.CHUNK_SIZE / y.sample_rate for x, y in zip(chunks, sources))
+    return {'audio_seconds': audio_seconds,
+            'wall_seconds': wall_seconds,
+            'x_real_time': audio_seconds / wall_seconds}
+
+
+def bench_record(p_mix, p_seconds, p_wav_path=None):
+    """ Records p_seconds from fake devices running in real time, returns how much audio was written and lost """
+
+    fake_devices.configure([fake_devices.make_device(f"Device {z}", x, y, p_wav_path) for z, (x, y) in enumerate(p_mix)], record_seconds=p_seconds)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        wav_path = os.path.join(temp_dir, 'bench.wav')
+
+        start = time.perf_counter()
+        report = record_audio.record(wav_path, tuple(range(len(p_mix))))
+        wall_seconds = time.perf_counter() - start
+
+        with wave.open(wav_path, 'rb') as wf:
+            audio_seconds = wf.getnframes() / wf.getframerate()
+
+    return {'audio_seconds': audio_seconds,
+            'wall_seconds': wall_seconds,
+            'input_overflows': sum(x[0] for x in report.values()),
+            'dropped_chunks': sum(x[1] for x in report.values())}
+
+
+def make_wav(p_path, p_seconds, p_wav_path=None):
+    """ Writes p_seconds of 16 kHz mono audio (a tone with noise, or p_wav_path looped) to p_path """
+
+    source = fake_devices.AudioSource(16000, 1, p_wav_path)
+    with wave.open(p_path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes(source.read(p_seconds * 16000))
+
+
+def bench_from_wav(p_model_path, p_wav_path, p_workers=1):
+    """ Transcribes p_wav_path with the model at p_model_path, returns the real time factor (seconds of decoding per second of audio, model loading included) """
+
+    with wave.open(p_wav_path, 'rb') as wf:
+        audio_seconds = wf.getnframes() / wf.getframerate()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        start = time.perf_counter()
+        result = transcriber.from_wav(p_wav_path, os.path.join(temp_dir, 'bench.txt'), p_model_path, workers=p_workers)
+        wall_seconds = time.perf_counter() - start
+
+    if result != 1:
+        return {'error': f"from_wav() returned {result}"}
+    return {'audio_seconds': audio_seconds,
+            'wall_seconds': wall_seconds,
+            'real_time_factor': wall_seconds / audio_seconds}
+
+
+def bench_outputs(p_entries=OUTPUT_ENTRIES):
+    """ Returns {file type: microseconds per entry} for writing p_entries entries (header and footer included) with each writer """
+
+    timestamp = datetime.datetime(2024, 1, 1)
+    rel_timestamp = datetime.datetime(1, 1, 1)
+    delta = datetime.timedelta(seconds=10)
+    text = 'the quick brown fox jumps over the lazy dog ' * 4
+
+    results = {}
+    for file_type, writer_class in outputs.type_outputs.items():
+        file_pointer = io.StringIO()
+        start = time.perf_counter()
+        writer = writer_class(file_pointer, {'audio_file_name': 'bench.wav', 'creation_timestamp': timestamp})
+        for x in range(p_entries):
+            writer.write(timestamp + x * delta, rel_timestamp + x * delta, 10, text)
+        writer.finish()
+        results[file_type] = {'microseconds_per_entry': (time.perf_counter() - start) / p_entries * 1_000_000}
+    return results
+
+
+def compare(p_results, p_previous, p_tolerance, p_path=''):
+    """ Prints the change of every number in p_results from p_previous, returns the names of the ones that regressed by more than p_tolerance """
+
+    regressions = []
+    for key, value in p_results.items():
+        name = f"{p_path}/{key}" if p_path else key
+        if key not in p_previous:
+            continue
+        if isinstance(value, dict):
+            regressions.extend(compare(value, p_previous[key], p_tolerance, name))
+        elif isinstance(value, (int, float)) and key in COMPARED:
+            # Going up from 0 (ex. dropped chunks) counts as an infinite change
+            change = (value - p_previous[key]) / p_previous[key] if p_previous[key] else float(value > 0) * float('inf')
+            worse = change > p_tolerance if key in LOWER_IS_BETTER else change < -p_tolerance
+            print(f"{name:<60} {p_previous[key]:>12.4g} -> {value:>12.4g}  ({100 * change:+.1f}%){'  REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-b","--bench", action='append', choices=BENCHMARKS,   help=f"Run only this benchmark, can be used more than once (default is all of {list(BENCHMARKS)})")
+    arg_parser.add_argument("-t","--seconds", type=int, default=30,   help="Set the seconds of audio per device for the prepare benchmark and of the wav file for the from_wav benchmark (default is 30)")
+    arg_parser.add_argument("-R","--record_seconds", type=int, default=5,   help="Set the seconds recorded in real time by the record benchmark (default is 5)")
+    arg_parser.add_argument("-a","--audio",   help="Stream this wav file from every fake device and transcribe it instead of a generated tone (its frames are used as they are)")
+    arg_parser.add_argument("-w","--workers", type=int, default=1,   help="Set the number of processes from_wav() transcribes with (default is 1)")
+    arg_parser.add_argument("-o","--output",   help="Set the results file (default is benchmarks/results/pipeline-<date>-<time>.json)")
+    arg_parser.add_argument("-c","--compare",   help="Compare the results with an earlier results file")
+    arg_parser.add_argument("--tolerance", type=float, default=0.2,   help="Set the fraction a number can get worse by before --compare counts it as a regression (default is 0.2)")
+    args = arg_parser.parse_args()
+
+    selected = args.bench or BENCHMARKS
+    results = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'numpy': numpy.__version__,
+               'seconds': args.seconds,
+               'audio': args.audio}
+
+    if 'prepare' in selected:
+        results['prepare'] = {}
+        for name, mix in DEVICE_MIXES.items():
+            results['prepare'][name] = bench_prepare(mix, args.seconds, args.audio)
+            print(f"prepare_audio() {name:<20} {results['prepare'][name]['x_real_time']:>10.1f} x real time")
+
+    if 'record' in selected:
+        results['record'] = {}
+        for name, mix in DEVICE_MIXES.items():
+            results['record'][name] = bench_record(mix, args.record_seconds, args.audio)
+            print(f"record() {name:<20} {results['record'][name]['audio_seconds']:.2f} s recorded, {results['record'][name]['dropped_chunks']} chunks dropped")
+
+    if 'from_wav' in selected:
+        results['from_wav'] = {}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            wav_path = os.path.join(temp_dir, 'bench.wav')
+            make_wav(wav_path, args.seconds, args.audio)
+            for x in sorted(os.listdir(MODELS_DIR)):
+                if not os.path.isdir(os.path.join(MODELS_DIR, x)):
+                    continue
+                try:
+                    results['from_wav'][x] = bench_from_wav(os.path.join(MODELS_DIR, x), wav_path, args.workers)
+                except Exception as error:  # pylint: disable=broad-exception-caught
+                    # vosk raises a plain Exception for models it can't load
+                    results['from_wav'][x] = {'error': str(error)}
+                print(f"from_wav() {x:<40} {results['from_wav'][x].get('real_time_factor', results['from_wav'][x].get('error'))}")
+
+    if 'outputs' in selected:
+        results['outputs'] = bench_outputs()
+        for x, y in results['outputs'].items():
+            print(f"outputs {x:<6} {y['microseconds_per_entry']:>8.2f} us per entry")
+
+    output_path = args.output or os.path.join(RESULTS_DIR, f"pipeline-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'wt') as results_file:
+        json.dump(results, results_file, indent=4)
+    print(f"\nResults saved to {output_path}")
+
+    if args.compare:
+        with open(args.compare, 'rt') as previous_file:
+            previous = json.load(previous_file)
+        print()
+        regressions = compare(results, previous, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions over {100 * args.tolerance:.0f}%")
+            sys.exit(1)
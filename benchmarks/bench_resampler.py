@@ -0,0 +1,85 @@
+# pylint: disable=line-too-long
+""" Micro-benchmark of resampler.Resampler against the numpy.append loop prepare_audio() used before it, reported in input samples per second """
+# Run from the repository root with `python benchmarks/bench_resampler.py`
+# Also checks the anti-aliasing filter: tones from STOPBAND_START up to each input rate's Nyquist frequency would fold back into
+# the 16 kHz output's band, they have to come out at least STOPBAND_MIN_ATTENUATION dB quieter. Exits with 1 if any don't.
+
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import resampler
+
+CHUNK_SIZE = 1024
+SECONDS_OF_AUDIO = 10
+INPUT_RATES = (44100, 48000, 96000)
+# Hz, a little above the output's 8 kHz Nyquist frequency (the filter's transition band is below it)
+STOPBAND_START = 9000
+STOPBAND_STEP = 500
+STOPBAND_MIN_ATTENUATION = 70
+
+
+def legacy_decimate(p_samples, p_in_rate):
+    """ The resampling prepare_audio() did before resampler.Resampler, kept here for comparison """
+
+    downsample_factor = p_in_rate / 16000
+    if downsample_factor % 1 == 0:
+        return p_samples[0::int(downsample_factor)]
+
+    temp = numpy.ndarray((1,), dtype=numpy.int32)
+    for x in numpy.arange(0, len(p_samples), downsample_factor):
+        temp = numpy.append(temp, p_samples[int(x)])
+    return temp
+
+
+def time_chunks(p_func, p_chunks):
+    """ Returns input samples per second for calling p_func on every chunk in p_chunks """
+
+    start = time.perf_counter()
+    for x in p_chunks:
+        p_func(x)
+    elapsed = time.perf_counter() - start
+    return sum(len(x) for x in p_chunks) / elapsed
+
+
+def stopband_attenuation(p_in_rate):
+    """ Returns the lowest attenuation in dB of the tones from STOPBAND_START up to p_in_rate's Nyquist frequency, resampled in CHUNK_SIZE chunks """
+
+    amplitude = 30000
+    t = numpy.arange(p_in_rate) / p_in_rate
+    attenuations = []
+    for frequency in range(STOPBAND_START, p_in_rate // 2, STOPBAND_STEP):
+        tone = amplitude * numpy.sin(2 * numpy.pi * frequency * t)
+        audio_resampler = resampler.Resampler(p_in_rate)
+        out = numpy.concatenate([audio_resampler.process(tone[x:x + CHUNK_SIZE]) for x in range(0, len(tone), CHUNK_SIZE)])
+        # The start and end are left out, the filter is still filling up there
+        rms = numpy.sqrt(numpy.mean(out[len(out) // 4:-len(out) // 4].astype(numpy.float64) ** 2))
+        # Rounding to whole samples puts a floor of about -100 dB on what can be measured
+        attenuations.append(-20 * numpy.log10(max(rms, 0.5) / (amplitude / numpy.sqrt(2))))
+    return min(attenuations)
+
+
+if __name__ == '__main__':
+
+    generator = numpy.random.default_rng(0)
+
+    failed = False
+    print(f"{'input rate':>10}  {'Resampler (samples/s)':>22}  {'legacy loop (samples/s)':>24}  {'real time x':>12}  {'stopband (dB)':>14}")
+    for rate in INPUT_RATES:
+        samples = generator.integers(-32768, 32767, rate * SECONDS_OF_AUDIO, dtype=numpy.int32)
+        chunks = [samples[x:x + CHUNK_SIZE] for x in range(0, len(samples), CHUNK_SIZE)]
+
+        new_rate = time_chunks(resampler.Resampler(rate).process, chunks)
+        legacy_rate = time_chunks(lambda x, r=rate: legacy_decimate(x, r), chunks)
+
+        attenuation = stopband_attenuation(rate)
+        failed = failed or attenuation < STOPBAND_MIN_ATTENUATION
+
+        print(f"{rate:>10}  {new_rate:>22,.0f}  {legacy_rate:>24,.0f}  {new_rate / rate:>12,.1f}  {attenuation:>14,.1f}")
+
+    if failed:
+        sys.stderr.write(f"\nStopband attenuation below {STOPBAND_MIN_ATTENUATION} dB, audio above 8 kHz will alias into the 16 kHz output\n")
+        sys.exit(1)
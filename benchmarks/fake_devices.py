@@ -0,0 +1,200 @@
+# pylint: disable=line-too-long
+""" Stand-ins for the pyaudio and keyboard modules so the recording pipeline can run headless, without a sound card or anyone pressing the start/stop key """
+# install() puts the fakes in sys.modules, so it has to be called before record_audio (or anything else that
+# imports pyaudio or keyboard) is imported. Devices are dicts the same as pyaudio.PyAudio.get_device_info_by_index()
+# returns, plus an optional 'wav_path' to stream a recording (looped) instead of a generated tone with noise.
+
+import sys
+import time
+import wave
+import types
+import threading
+
+import numpy
+
+# (name, channels, sample rate) of the devices the fake PyAudio reports unless configure() is given others
+DEFAULT_DEVICES = (('Microphone', 1, 44100), ('Stereo Mix', 2, 48000))
+HOST_API_NAME = 'Windows WASAPI'
+# Seconds after the first hotkey is added that the fake start key is pressed
+KEY_PRESS_DELAY = 0.05
+
+# Set by configure()
+_devices = []
+_speed = 1.0
+_keyboard = None
+
+
+def make_device(p_name, p_channels, p_sample_rate, p_wav_path=None):
+    """ Returns a device info dict for the fake PyAudio """
+
+    return {'name': p_name,
+            'maxInputChannels': p_channels,
+            'defaultSampleRate': float(p_sample_rate),
+            'hostApi': 0,
+            'wav_path': p_wav_path}
+
+
+class AudioSource:
+    """ Endless interleaved 16 bit audio at any rate and # of channels, a tone with some noise or a wav file played on loop
+        The wav file's frames are used as they are, its own rate and # of channels are ignored
+    """
+
+    def __init__(self, p_sample_rate, p_channels, p_wav_path=None, *, frequency=440.0, seed=0):
+
+        self.sample_rate = p_sample_rate
+        self.channels = p_channels
+        self.position = 0
+
+        if p_wav_path is not None:
+            with wave.open(p_wav_path, 'rb') as wf:
+                looped = numpy.frombuffer(wf.readframes(wf.getnframes()), dtype=numpy.int16)
+        else:
+            # One second of tone is enough, it loops seamlessly since the frequency is a whole number of Hz
+            t = numpy.arange(p_sample_rate) / p_sample_rate
+            noise = numpy.random.default_rng(seed).normal(0, 500, p_sample_rate)
+            looped = (6000 * numpy.sin(2 * numpy.pi * int(frequency) * t) + noise).astype(numpy.int16).repeat(p_channels)
+
+        # Trimmed to whole frames
+        self.looped = looped[:len(looped) - len(looped) % p_channels]
+
+    def read(self, p_num_frames):
+        """ Returns the next p_num_frames frames as bytes """
+
+        num_samples = p_num_frames * self.channels
+        indices = (numpy.arange(num_samples) + self.position) % len(self.looped)
+        self.position = (self.position + num_samples) % len(self.looped)
+        return self.looped[indices].tobytes()
+
+
+class FakeStream:
+    """ Callback mode input stream, a thread calls the stream callback every frames_per_buffer frames at the device's rate (times the configured speed) """
+
+    def __init__(self, p_source, p_frames_per_buffer, p_callback, p_speed):
+
+        self.source = p_source
+        self.frames_per_buffer = p_frames_per_buffer
+        self.callback = p_callback
+        self.speed = p_speed
+        self.running = False
+        self.thread = None
+
+    def start_stream(self):
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+
+        interval = self.frames_per_buffer / self.source.sample_rate / self.speed
+        next_time = time.perf_counter()
+        while self.running:
+            self.callback(self.source.read(self.frames_per_buffer), self.frames_per_buffer, {}, 0)
+
+            # Paced against a fixed schedule so the fake device's clock doesn't drift from the time spent in the callback
+            next_time += interval
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def stop_stream(self):
+
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def close(self):
+        pass
+
+
+class FakePyAudio:
+    """ The parts of pyaudio.PyAudio the recording pipeline and device selection use """
+
+    def get_device_count(self):
+        return len(_devices)
+
+    def get_device_info_by_index(self, p_index):
+        return dict(_devices[p_index], index=p_index)
+
+    def get_host_api_count(self):
+        return 1
+
+    def get_host_api_info_by_index(self, p_index):
+        return {'index': p_index, 'name': HOST_API_NAME, 'deviceCount': len(_devices), 'defaultInputDevice': 0}
+
+    def get_sample_size(self, p_format):
+        return 2
+
+    def open(self, *, channels, rate, input_device_index, frames_per_buffer, stream_callback, **kwargs):
+        source = AudioSource(rate, channels, _devices[input_device_index]['wav_path'], frequency=220 * (input_device_index + 1))
+        return FakeStream(source, frames_per_buffer, stream_callback, _speed)
+
+    def terminate(self):
+        pass
+
+
+class FakeKeyboard:
+    """ The parts of the keyboard module record() uses, presses start_key right after the hotkeys are added and stop_key record_seconds later """
+
+    def __init__(self, p_start_key, p_stop_key, p_record_seconds):
+
+        self.start_key = p_start_key
+        self.stop_key = p_stop_key
+        self.record_seconds = p_record_seconds
+        self.hotkeys = {}
+        self.presser = None
+
+    def add_hotkey(self, p_key, p_callback, args=()):
+
+        self.hotkeys[len(self.hotkeys)] = (p_key, p_callback, args)
+        if self.presser is None:
+            self.presser = threading.Thread(target=self._press_keys, daemon=True)
+            self.presser.start()
+        return len(self.hotkeys) - 1
+
+    def remove_hotkey(self, p_handle):
+
+        self.hotkeys.pop(p_handle, None)
+
+    def _press(self, p_key):
+
+        for key, callback, args in list(self.hotkeys.values()):
+            if key == p_key:
+                callback(*args)
+
+    def _press_keys(self):
+
+        # Every hotkey is added before record() waits, the delay lets the rest of them be added first
+        time.sleep(KEY_PRESS_DELAY)
+        self._press(self.start_key)
+        time.sleep(self.record_seconds)
+        self._press(self.stop_key)
+
+
+def configure(p_devices=None, *, speed=1.0, record_seconds=5.0, start_key='`', stop_key='`'):
+    """ Sets the devices the fake PyAudio reports (default DEFAULT_DEVICES), how much faster than real time they run, and when the fake keyboard presses the start and stop keys """
+
+    global _devices, _speed, _keyboard
+    _devices = list(p_devices) if p_devices is not None else [make_device(*x) for x in DEFAULT_DEVICES]
+    _speed = speed
+    # A new keyboard so the next recording gets its own start press
+    _keyboard = FakeKeyboard(start_key, stop_key, record_seconds)
+
+
+def install():
+    """ Replaces the pyaudio and keyboard modules with the fakes, configure() can still be called afterwards """
+
+    pyaudio_module = types.ModuleType('pyaudio')
+    pyaudio_module.paInt16 = 8
+    pyaudio_module.paContinue = 0
+    pyaudio_module.paInputOverflow = 2
+    pyaudio_module.PyAudio = FakePyAudio
+    sys.modules['pyaudio'] = pyaudio_module
+
+    keyboard_module = types.ModuleType('keyboard')
+    keyboard_module.add_hotkey = lambda p_key, p_callback, args=(): _keyboard.add_hotkey(p_key, p_callback, args=args)
+    keyboard_module.remove_hotkey = lambda p_handle: _keyboard.remove_hotkey(p_handle)
+    sys.modules['keyboard'] = keyboard_module
+
+
+configure()
@@ -3,8 +3,14 @@
 
 import os
 import sys
+import time
+# Taken before the rest of the imports so the startup time reported by -T includes them
+STARTUP_TIME = time.perf_counter()
+import atexit
 import argparse
+import tempfile
 import configparser
+import multiprocessing
 
 import pyaudio
 
@@ -12,21 +18,70 @@ sys.path.append('.\\src\\')
 import record_audio
 import transcriber
 import outputs
+import daemon
+import control
+import devices
+import vad
+import telemetry
+import segments
+import archive_index
+import keywords
 
 # Modify the following constants as desired
 START_RECORDING = '`'
 STOP_RECORDING = '`'
+# Optional hotkeys to pause/resume and to mark the current point of the recording ('' for none)
+PAUSE_RECORDING = ''
+MARK_RECORDING = ''
 WAV_FILENAME = 'a.wav'
 TRANSCRIPTION_FILENAME = 'a.txt'
 MODEL_DIRECTORY = 'vosk-model-small-en-us-0.15'
+# Larger model that improves the transcript in the background after the quick one is written ('' for none), see the -R CLI option
+REFINE_MODEL_DIRECTORY = ''
 # xxx_DEVICE_NAME_INCLUDES is a string that is searched for in the input device name when choosing recording devices
 MICROPHONE_DEVICE_NAME_INCLUDES = 'Microphone'
 STEREO_MIX_DEVICE_NAME_INCLUDES = 'Stereo Mix'
 # DESIRED_xxx_AUDIO_BACKEND is a string that is matched EXACTLY to the audio backend of the input device
 DESIRED_MICROPHONE_AUDIO_BACKEND = 'Windows WASAPI'
 DESIRED_STEREO_MIX_AUDIO_BACKEND = 'Windows WASAPI'
+# xxx_LABEL is what text heard on that device is labelled with when each device is transcribed on its own (see the -P CLI option)
+MICROPHONE_LABEL = 'Local'
+STEREO_MIX_LABEL = 'Remote'
+# xxx_GAIN scales that device's audio in the mixed recording (ex. 2 for twice as loud, 0.5 for half), louder parts are soft limited instead of clipped
+MICROPHONE_GAIN = 1.0
+STEREO_MIX_GAIN = 1.0
 # Timestamps in the produced .txt log are added every TRANSCRIPTION_TIMESTAMP_FREQUENCY seconds (default 10 seconds)
 TRANSCRIPTION_TIMESTAMP_FREQUENCY = 10
+# Localhost port of transcription_daemon.py, used with the -S CLI option
+DAEMON_PORT = 8765
+# Localhost port the recording listens on for recording_control.py commands, used with the -c and -H CLI options
+CONTROL_PORT = control.DEFAULT_CONTROL_PORT
+# The recording is split into a new .wav file every SEGMENT_MINUTES minutes (0 for one .wav file), see the -G CLI option
+SEGMENT_MINUTES = 0
+# Finished transcripts are added to this index for search_archive.py ('' to not index them)
+TRANSCRIPT_INDEX = archive_index.INDEX_FILENAME
+
+
+def print_timings(p_timings):
+    """ Prints the startup and transcription latencies from the time.perf_counter() times in p_timings (see the -T CLI option) """
+
+    print(f"\nStartup (command to waiting for the start key):  {p_timings['ready'] - STARTUP_TIME:.3f} s" if 'ready' in p_timings else "\nStartup:  not finished")
+    if 'recording' in p_timings:
+        print(f"Start key to recording:  {p_timings['recording'] - p_timings['start']:.3f} s")
+    if 'model_loaded' in p_timings:
+        print(f"Model loaded in the background:  {p_timings['model_loaded'] - STARTUP_TIME:.3f} s after the command")
+        if 'stop' in p_timings and p_timings['model_loaded'] > p_timings['stop']:
+            print(f"Transcription waited {p_timings['model_loaded'] - p_timings['stop']:.3f} s after the stop key for the model to finish loading")
+    if 'first_line' in p_timings:
+        print(f"Stop key to first transcript line:  {p_timings['first_line'] - p_timings['stop']:.3f} s")
+    if 'transcribed' in p_timings and 'stop' in p_timings:
+        print(f"Stop key to finished transcript:  {p_timings['transcribed'] - p_timings['stop']:.3f} s")
+
+
+def recording_path(p_wav_filename, p_segment_seconds):
+    """ Returns the path transcriber.from_wav() reads the recording from, the manifest for a segmented recording (see the -G CLI option) """
+
+    return segments.manifest_path(p_wav_filename) if p_segment_seconds else p_wav_filename
 
 
 if __name__ == '__main__':
@@ -40,31 +95,80 @@ if __name__ == '__main__':
 
     START_RECORDING = defaults['START_RECORDING']
     STOP_RECORDING = defaults['STOP_RECORDING']
+    PAUSE_RECORDING = defaults.get('PAUSE_RECORDING', PAUSE_RECORDING)
+    MARK_RECORDING = defaults.get('MARK_RECORDING', MARK_RECORDING)
     WAV_FILENAME = defaults['WAV_FILENAME']
     TRANSCRIPTION_FILENAME = defaults['TRANSCRIPTION_FILENAME']
     MODEL_DIRECTORY = defaults['MODEL_DIRECTORY']
+    REFINE_MODEL_DIRECTORY = defaults.get('REFINE_MODEL_DIRECTORY', REFINE_MODEL_DIRECTORY)
     MICROPHONE_DEVICE_NAME_INCLUDES = defaults['MICROPHONE_DEVICE_NAME_INCLUDES']
     STEREO_MIX_DEVICE_NAME_INCLUDES = defaults['STEREO_MIX_DEVICE_NAME_INCLUDES']
     DESIRED_MICROPHONE_AUDIO_BACKEND = defaults['DESIRED_MICROPHONE_AUDIO_BACKEND']
     DESIRED_STEREO_MIX_AUDIO_BACKEND = defaults['DESIRED_STEREO_MIX_AUDIO_BACKEND']
+    MICROPHONE_LABEL = defaults.get('MICROPHONE_LABEL', MICROPHONE_LABEL)
+    STEREO_MIX_LABEL = defaults.get('STEREO_MIX_LABEL', STEREO_MIX_LABEL)
+    try:
+        MICROPHONE_GAIN = float(defaults.get('MICROPHONE_GAIN', MICROPHONE_GAIN))
+    except ValueError:
+        print(f'\nInvalid value for MICROPHONE_GAIN in default_values.ini.\n\nPlease make sure MICROPHONE_GAIN in default_values.ini is a number.\nCurrent value: {defaults['MICROPHONE_GAIN']}\n', file=sys.stderr)
+        quit()
+    try:
+        STEREO_MIX_GAIN = float(defaults.get('STEREO_MIX_GAIN', STEREO_MIX_GAIN))
+    except ValueError:
+        print(f'\nInvalid value for STEREO_MIX_GAIN in default_values.ini.\n\nPlease make sure STEREO_MIX_GAIN in default_values.ini is a number.\nCurrent value: {defaults['STEREO_MIX_GAIN']}\n', file=sys.stderr)
+        quit()
     try:
         TRANSCRIPTION_TIMESTAMP_FREQUENCY = int(defaults['TRANSCRIPTION_TIMESTAMP_FREQUENCY'])
     except ValueError:
         print(f'\nInvalid value for TRANSCRIPTION_TIMESTAMP_FREQUENCY in default_values.ini.\n\nPlease make sure TRANSCRIPTION_TIMESTAMP_FREQUENCY in default_values.ini is a number.\nCurrent value: {defaults['TRANSCRIPTION_TIMESTAMP_FREQUENCY']}\n', file=sys.stderr)
         quit()
+    try:
+        DAEMON_PORT = int(defaults.get('DAEMON_PORT', DAEMON_PORT))
+    except ValueError:
+        print(f'\nInvalid value for DAEMON_PORT in default_values.ini.\n\nPlease make sure DAEMON_PORT in default_values.ini is a number.\nCurrent value: {defaults['DAEMON_PORT']}\n', file=sys.stderr)
+        quit()
+    try:
+        CONTROL_PORT = int(defaults.get('CONTROL_PORT', CONTROL_PORT))
+    except ValueError:
+        print(f'\nInvalid value for CONTROL_PORT in default_values.ini.\n\nPlease make sure CONTROL_PORT in default_values.ini is a number.\nCurrent value: {defaults['CONTROL_PORT']}\n', file=sys.stderr)
+        quit()
+    try:
+        SEGMENT_MINUTES = float(defaults.get('SEGMENT_MINUTES', SEGMENT_MINUTES))
+    except ValueError:
+        print(f'\nInvalid value for SEGMENT_MINUTES in default_values.ini.\n\nPlease make sure SEGMENT_MINUTES in default_values.ini is a number.\nCurrent value: {defaults['SEGMENT_MINUTES']}\n', file=sys.stderr)
+        quit()
+    TRANSCRIPT_INDEX = defaults.get('TRANSCRIPT_INDEX', TRANSCRIPT_INDEX)
+    if TRANSCRIPT_INDEX:
+        archive_index.configure(TRANSCRIPT_INDEX)
 
     # Parsing CLI arguments and updating config defaults
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument("-M","--no_mic", action='store_true',   help='Do not include microphone audio input in recording')
     arg_parser.add_argument("-D","--no_desktop", action='store_true',   help='Do not include desktop audio input in recording')
+    arg_parser.add_argument("-c","--control", action='store_true',   help=f"Also accept start, stop, pause and mark commands from recording_control.py (or any program) on localhost port {CONTROL_PORT}")
+    arg_parser.add_argument("-H","--headless", action='store_true',   help="Don't hook the keyboard, the recording is only controlled through the control port (see -c) and signals (SIGUSR1 starts, SIGUSR2 pauses/resumes, Ctrl+C stops)")
+    arg_parser.add_argument("-l","--live", action='store_true',   help='Transcribe the audio while it is being recorded instead of after the recording is stopped')
     
     arg_parser.add_argument("-r","--set_recording_name",   help=f"Set the desired name of the audio recording output file (default is {WAV_FILENAME} supported file types are {['wav']})")
-    arg_parser.add_argument("-o","--set_output_name",   help=f"Set the desired name of the transcription output file (default is {TRANSCRIPTION_FILENAME} supported file types are {[x for x in outputs.type_outputs]})")
+    arg_parser.add_argument("-o","--set_output_name", action='append',   help=f"Set the desired name of the transcription output file, can be used more than once to write several files (ex. -o a.txt -o a.srt) from one transcription (default is {TRANSCRIPTION_FILENAME} supported file types are {[x for x in outputs.type_outputs]})")
     
     arg_parser.add_argument("-m","--set_mic",   help=f"Set the desired microphone audio device by inputting a string that will be searched for from the names of your available input devices. input is case insensitive (default is '{MICROPHONE_DEVICE_NAME_INCLUDES}')")
     arg_parser.add_argument("-d","--set_desktop",   help=f"Set the desired desktop audio device by inputting a string that will be searched for from the names of your available input devices, input is case insensitive (default is '{STEREO_MIX_DEVICE_NAME_INCLUDES}')")
+    arg_parser.add_argument("-i","--add_input", action='append',   help="Record an additional input device, found by inputting a string that will be searched for from the names of your available input devices, optionally followed by a comma and its audio backend (ex. 'USB Audio,MME'). Can be used more than once, input is case insensitive (default backend is the microphone backend)")
     arg_parser.add_argument("-mb","--set_mic_backend",   help=f"Set the desired microphone audio backend by inputting a string that will be searched for from the names of your available input devices, input is case insensitive (default is '{DESIRED_MICROPHONE_AUDIO_BACKEND}')")
     arg_parser.add_argument("-md","--set_desktop_backend",   help=f"Set the desired desktop audio backend by inputting a string that will be searched for from the audio backends of your available input devices, input is case insensitive (default is '{DESIRED_STEREO_MIX_AUDIO_BACKEND}')")
+    arg_parser.add_argument("-G","--segment_minutes", type=float, default=SEGMENT_MINUTES,   help=f"Split the recording into a new .wav file every this many minutes, listed in a _manifest.jsonl file next to them. Each file is transcribed as soon as it is finished (default is {SEGMENT_MINUTES:g}, one .wav file)")
+    arg_parser.add_argument("-P","--per_source", action='store_true',   help=f"Transcribe each input device on its own (in its own process) instead of the mixed audio, the text is labelled with the device it was heard on ('{MICROPHONE_LABEL}' for the microphone, '{STEREO_MIX_LABEL}' for desktop audio). Each device is also saved to its own .wav file")
+    arg_parser.add_argument("-S","--use_daemon", action='store_true',   help=f"Hand the transcription to a running transcription_daemon.py (on port {DAEMON_PORT}) instead of loading the recognition model here, falls back to transcribing here if no daemon is running")
+    arg_parser.add_argument("-w","--workers", type=int, default=1,   help="Set the number of processes used to transcribe the recording after it is stopped, each process loads its own copy of the recognition model (default is 1)")
+    arg_parser.add_argument("-V","--vad", action='store_true',   help='Skip silence with voice activity detection instead of passing it to the recognition model, timestamps are unchanged')
+    arg_parser.add_argument("-vt","--vad_threshold", type=float, default=vad.ENERGY_THRESHOLD_DB,   help=f"Set the loudness (in dB relative to full scale) below which audio counts as silence when using --vad (default is {vad.ENERGY_THRESHOLD_DB})")
+    arg_parser.add_argument("--metrics",   help="Append per-stage timings, counters and backlogs of the recording and transcription to this JSON lines file every few seconds")
+    arg_parser.add_argument("--prometheus_port", type=int,   help="Serve the --metrics numbers in the Prometheus text format on this localhost port (at /metrics)")
+    arg_parser.add_argument("-T","--timing", action='store_true',   help="Print how long it took from running the command to being ready to record, from the start key to recording, and from the stop key to the first transcript line")
+    arg_parser.add_argument("--profile", action='store_true',   help="Print a summary of the time spent in each stage of the recording and transcription at exit")
+    arg_parser.add_argument("-K","--keywords",   help="Only find when these phrases were said instead of transcribing everything (several times faster), a file with one phrase per line or a comma separated list (ex. 'action item,decision'). Each hit is written with its time and confidence, works with -l")
+    arg_parser.add_argument("-R","--refine_model",   help="Set the name of a larger speech recognition model directory (searched for the same as -s) that transcribes the recording again in the background at low priority once the quick transcription is written, replacing its text as each part is finished (default is none)")
     arg_parser.add_argument("-s","--set_model_dir",   help=f"Set the name of the desired speech recognition model directory to use for transcription. The input will searched from the names of available directories inside the models directory, input is case insensitive (default is '{MODEL_DIRECTORY}')")
 
     args = arg_parser.parse_args()
@@ -73,8 +177,7 @@ if __name__ == '__main__':
     # Update the config variables with the user's CLI arguments
     if args.set_recording_name:
         WAV_FILENAME = args.set_recording_name
-    if args.set_output_name:
-        TRANSCRIPTION_FILENAME = args.set_output_name
+    TRANSCRIPTION_FILENAMES = args.set_output_name or [TRANSCRIPTION_FILENAME]
     if args.set_mic:
         MICROPHONE_DEVICE_NAME_INCLUDES = args.set_mic
     if args.set_desktop:
@@ -85,6 +188,43 @@ if __name__ == '__main__':
         DESIRED_STEREO_MIX_AUDIO_BACKEND = args.set_desktop_backend
     if args.set_model_dir:
         MODEL_DIRECTORY = args.set_model_dir
+    if args.refine_model:
+        REFINE_MODEL_DIRECTORY = args.refine_model
+    vad_settings = {'energy_threshold': args.vad_threshold} if args.vad else None
+    phrases = None
+    if args.keywords:
+        phrases = keywords.load_phrases(args.keywords)
+        if not phrases:
+            print(f"\nNo phrases to spot were found in '{args.keywords}'\n", file=sys.stderr)
+            quit()
+    # A segmented recording is transcribed through its manifest, which lists the segment files in order
+    segment_seconds = args.segment_minutes * 60 if args.segment_minutes > 0 else None
+    # Segments are transcribed while the rest is still being recorded unless the transcription happens elsewhere or is split between workers
+    follow_segments = segment_seconds is not None and not args.live and not args.use_daemon and args.workers == 1 and not args.per_source and not REFINE_MODEL_DIRECTORY and not phrases
+
+    if args.per_source and args.live:
+        print(f"\nThe -P and -l CLI options can't be used together, live transcription only transcribes the mixed audio\n", file=sys.stderr)
+        quit()
+    # The refining pass improves the transcription written by transcriber.from_wav() here, it needs the text of that transcription
+    if REFINE_MODEL_DIRECTORY and (args.live or args.use_daemon or args.per_source):
+        print(f"\nRefining with a larger model (-R or REFINE_MODEL_DIRECTORY) can't be used with the -l, -S or -P CLI options\n", file=sys.stderr)
+        quit()
+    # Keyword spotting writes hits instead of windows, which only the mixed audio transcribers here know how to do
+    if phrases and (REFINE_MODEL_DIRECTORY or args.use_daemon or args.per_source):
+        print(f"\nKeyword spotting (-K) can't be used with the -R, -S or -P CLI options\n", file=sys.stderr)
+        quit()
+
+    # Telemetry is only on if asked for, --profile and --prometheus_port without --metrics use a temporary metrics file
+    if args.metrics or args.profile or args.prometheus_port:
+        metrics_path = args.metrics
+        if metrics_path is None:
+            file_descriptor, metrics_path = tempfile.mkstemp(suffix='.jsonl')
+            os.close(file_descriptor)
+            atexit.register(os.remove, metrics_path)
+        telemetry.configure(metrics_path, prometheus_port=args.prometheus_port)
+        if args.profile:
+            # Registered after the removal above so it runs first
+            atexit.register(lambda: print(f"\n{telemetry.summary()}"))
     
     # Searching for user's recognition model name among the directories in .\models\
     # NOTE: This happens so early because this error checking should happen before user does anything
@@ -100,37 +240,73 @@ if __name__ == '__main__':
         print(f"\nUnable to find a recognition model in the models directory with '{MODEL_DIRECTORY}' in the name.\n\nPlease make sure your models directory looks like this:\nex.  models/recognition_model_name/(model contents)\n", file=sys.stderr)
         quit()
 
+    # Same search for the refining model
+    refine_model_name = None
+    if REFINE_MODEL_DIRECTORY:
+        for x in os.listdir('.\\models\\'):
 
+            if os.path.isdir('.\\models\\' + x) \
+              and REFINE_MODEL_DIRECTORY in x:
+                refine_model_name = x
+                break
 
+        if refine_model_name is None:
+            print(f"\nUnable to find a recognition model in the models directory with '{REFINE_MODEL_DIRECTORY}' in the name to refine the transcription with.\n", file=sys.stderr)
+            quit()
+
+    # time.perf_counter() times of each step, reported with -T
+    timings = {}
+    if args.timing:
+        atexit.register(print_timings, timings)
+
+    # The model loads on a background thread while devices are found and the user gets ready to press the start key, so the transcription can begin as soon as the recording stops
+    # NOTE: Not needed when the live transcriber (loads its own), the daemon (already loaded) or worker processes (one each) do the transcription
+    # With -P the per-device processes share it (unless they have to be spawned instead of forked, then it goes unused)
+    model_future = None
+    if args.per_source or (not args.live and not args.use_daemon and (args.workers == 1 or phrases) and not follow_segments):
+        model_future = transcriber.load_model_in_background('.\\models\\' + model_name)
+        model_future.add_done_callback(lambda p_future: timings.__setitem__('model_loaded', time.perf_counter()))
+
+
+
+    # Each entry is a (name includes, audio backend, label, gain) tuple describing one device to record, any number of devices can be recorded
+    device_searches = []
+    if args.no_desktop is not True:
+        device_searches.append((STEREO_MIX_DEVICE_NAME_INCLUDES, DESIRED_STEREO_MIX_AUDIO_BACKEND, STEREO_MIX_LABEL, STEREO_MIX_GAIN))
+    if args.no_mic is not True:
+        device_searches.append((MICROPHONE_DEVICE_NAME_INCLUDES, DESIRED_MICROPHONE_AUDIO_BACKEND, MICROPHONE_LABEL, MICROPHONE_GAIN))
+    for x in args.add_input or []:
+        # ex. 'USB Audio' or 'USB Audio,MME', labelled with the name searched for
+        name_includes, _, backend = x.partition(',')
+        device_searches.append((name_includes, backend or DESIRED_MICROPHONE_AUDIO_BACKEND, name_includes, 1.0))
+
+
+    # a is handed to record_audio.record() afterwards instead of initializing PortAudio a second time
     a = pyaudio.PyAudio()
     input_devices = []
     
     
     # Get the input devices that will be recorded from and fill input_devices list with device indices
-    
-    for x in range(a.get_device_count()):
-        b = a.get_device_info_by_index(x)
-
-        #TODO when I get around to implementing recording of user determined # of devices turn these 2 flags into a list of flags or something
-        desktop_found = False
-        mic_found = False
-        if args.no_desktop is not True \
-          and desktop_found is False \
-          and b['maxInputChannels'] == 2\
-          and STEREO_MIX_DEVICE_NAME_INCLUDES.upper() in b['name'].upper() \
-          and a.get_host_api_info_by_index(b['hostApi'])['name'].upper() == DESIRED_STEREO_MIX_AUDIO_BACKEND.upper():
-            
-            input_devices.append(b['index'])
-            desktop_found = True
-
-        elif args.no_mic is not True \
-          and mic_found is False \
-          and b['maxInputChannels'] == 2 \
-          and MICROPHONE_DEVICE_NAME_INCLUDES.upper() in b['name'].upper() \
-          and DESIRED_MICROPHONE_AUDIO_BACKEND.upper() in a.get_host_api_info_by_index(b['hostApi'])['name'].upper():
-            
+    # The first device that matches a search and hasn't already been chosen is used for that search
+    # Device info comes from device_cache.json unless the devices have changed since it was written
+    available_devices = devices.list_input_devices(a)
+    found_devices = devices.find_devices(available_devices, [(x[0], x[1]) for x in device_searches])
+    # A device swapped for another of the same kind doesn't change the cache's fingerprint, so the chosen ones are checked with PortAudio
+    # and a search that found nothing tries again without the cache (the device may have been swapped in)
+    if not all(x is not None and devices.is_current(a, x) for x in found_devices):
+        available_devices = devices.list_input_devices(a, refresh=True)
+        found_devices = devices.find_devices(available_devices, [(x[0], x[1]) for x in device_searches])
+    chosen_devices = []
+    source_labels = []
+    source_gains = []
+    for (name_includes, backend, label, gain), b in zip(device_searches, found_devices):
+        if b is None:
+            sys.stderr.write(f"No input device with '{name_includes}' in the name was found for the '{backend}' audio backend\n")
+        else:
             input_devices.append(b['index'])
-            mic_found = True
+            chosen_devices.append(b)
+            source_labels.append(label)
+            source_gains.append(gain)
     
 
     # Tell the user the recognition model being used
@@ -142,54 +318,131 @@ if __name__ == '__main__':
     # Tell the user the list of devices being recorded
     # TODO When verbose is included, add backend to the output string, f"{name}, {backend}"
     print(f"The following devices are being recorded:")
-    for x in input_devices:
-        b = a.get_device_info_by_index(x)
-        name = b['name']
-        backend = a.get_host_api_info_by_index(b['hostApi'])['name']
+    for x in chosen_devices:
+        name = x['name']
+        backend = x['backend']
         print(f"{name}")
         #print(f"{name}, {backend}")
     print()
 
-    a.terminate()
-
 
 
     # If WAV_FILENAME already exists, will lead to inaccurate timekeeping in transcriber.from_wav()
-    if os.path.exists(WAV_FILENAME):
-        sys.stderr.write(f"The file '{WAV_FILENAME}' already exists\n")
+    # A segmented recording is looked for by its manifest, its segments are overwritten along with it
+    if os.path.exists(recording_path(WAV_FILENAME, segment_seconds)):
+        sys.stderr.write(f"The file '{recording_path(WAV_FILENAME, segment_seconds)}' already exists\n")
         response = input("Overwrite?  Y/N ").rstrip("\n").lower()
         if response == 'y':
             print("Overwriting...\n")
             # WAV_FILENAME will be recreated in record_audio.record()
-            os.remove(WAV_FILENAME)
+            if segment_seconds:
+                # The old segments go too, a longer old recording would leave segments past the end of the new one
+                segments.remove_recording(recording_path(WAV_FILENAME, segment_seconds))
+            else:
+                os.remove(recording_path(WAV_FILENAME, segment_seconds))
 
         else:
             # This will add '_copy' until a unique wav filename is created in directory
-            while os.path.exists(WAV_FILENAME):
+            while os.path.exists(recording_path(WAV_FILENAME, segment_seconds)):
                 WAV_FILENAME = WAV_FILENAME[:-4] + '_copy' + WAV_FILENAME[-4:]
             print(f"Not overwriting, new file name will be '{WAV_FILENAME}\n")
 
 
-    # Now doing the same for TRANSCRIPTION_FILENAME
-    if os.path.exists(TRANSCRIPTION_FILENAME):
-        sys.stderr.write(f"The file '{TRANSCRIPTION_FILENAME}' already exists\n")
-        response = input("Overwrite?  Y/N ").rstrip("\n").lower()
-        if response == 'y':
-            print("Overwriting...\n")
-            # TRANSCRIPTION_FILENAME will be recreated in transcriber.from_wav()
-            os.remove(TRANSCRIPTION_FILENAME)
+    # Now doing the same for each of TRANSCRIPTION_FILENAMES
+    for x in range(len(TRANSCRIPTION_FILENAMES)):
+        if os.path.exists(TRANSCRIPTION_FILENAMES[x]):
+            sys.stderr.write(f"The file '{TRANSCRIPTION_FILENAMES[x]}' already exists\n")
+            response = input("Overwrite?  Y/N ").rstrip("\n").lower()
+            if response == 'y':
+                print("Overwriting...\n")
+                # TRANSCRIPTION_FILENAMES will be recreated in transcriber.from_wav()
+                os.remove(TRANSCRIPTION_FILENAMES[x])
 
-        else:
-            # This will add '_copy' until a unique transcription filename is created in directory
-            while os.path.exists(TRANSCRIPTION_FILENAME):
-                TRANSCRIPTION_FILENAME = TRANSCRIPTION_FILENAME[:-4] + '_copy' + TRANSCRIPTION_FILENAME[-4:]
-            print(f"Not overwriting, new file name will be '{TRANSCRIPTION_FILENAME}\n")
+            else:
+                # This will add '_copy' until a unique transcription filename is created in directory
+                name, extension = os.path.splitext(TRANSCRIPTION_FILENAMES[x])
+                while os.path.exists(name + extension):
+                    name = name + '_copy'
+                TRANSCRIPTION_FILENAMES[x] = name + extension
+                print(f"Not overwriting, new file name will be '{TRANSCRIPTION_FILENAMES[x]}\n")
     
 
 
-    record_audio.record(WAV_FILENAME, tuple(input_devices), start_button=START_RECORDING, stop_button=STOP_RECORDING)
+    # Hotkeys (unless headless), signals and the control port (with -c or -H) can all control the recording
+    recording_controls = {'start_button': None if args.headless else START_RECORDING,
+                          'stop_button': STOP_RECORDING,
+                          'pause_button': PAUSE_RECORDING or None,
+                          'mark_button': MARK_RECORDING or None,
+                          'control_port': CONTROL_PORT if args.control or args.headless else None}
+
+    if args.live:
+        # Transcription happens alongside the recording, the transcript is finished once record() returns
+        record_audio.record(WAV_FILENAME, tuple(input_devices), **recording_controls, audio=a, timings=timings, segment_seconds=segment_seconds, source_gains=source_gains,
+                            live_output_path=TRANSCRIPTION_FILENAMES, live_model_path='.\\models\\' + model_name, timestamp_duration=TRANSCRIPTION_TIMESTAMP_FREQUENCY, live_vad_settings=vad_settings, live_phrases=phrases)
+        timings['transcribed'] = time.perf_counter()
+        quit()
+
+    if follow_segments:
+        # Each segment is transcribed once it is closed, by the time the recording is stopped only the last one is left
+        # NOTE: daemon so it doesn't outlive this process if the recording is never started, and Ctrl+C is ignored so stopping the recording with it doesn't cut the transcript short
+        follow_process = multiprocessing.Process(target=control.ignore_interrupts, args=(transcriber.from_wav, recording_path(WAV_FILENAME, segment_seconds), TRANSCRIPTION_FILENAMES, '.\\models\\' + model_name), daemon=True,
+                                                 kwargs={'timestamp_duration': TRANSCRIPTION_TIMESTAMP_FREQUENCY, 'vad_settings': vad_settings, 'follow': True})
+        follow_process.start()
+        if record_audio.record(WAV_FILENAME, tuple(input_devices), **recording_controls, audio=a, timings=timings, segment_seconds=segment_seconds, source_gains=source_gains) is None:
+            # Cancelled before it started, the follow process goes with this one
+            quit()
+        print(f"Finishing transcription of the last segment...")
+        follow_process.join()
+        timings['transcribed'] = time.perf_counter()
+        quit()
+
+    # With -P each device also gets its own .wav file, named after the recording and the device's label (ex. a_Local.wav)
+    source_paths = None
+    if args.per_source:
+        source_paths = []
+        for x in source_labels:
+            name = os.path.splitext(WAV_FILENAME)[0] + '_' + ''.join(y if y.isalnum() else '_' for y in x)
+            # Two devices with the same label would otherwise write to the same file
+            while name + '.wav' in source_paths:
+                name = name + '_copy'
+            source_paths.append(name + '.wav')
+
+    if record_audio.record(WAV_FILENAME, tuple(input_devices), **recording_controls, audio=a, timings=timings, segment_seconds=segment_seconds, source_paths=source_paths, source_gains=source_gains) is None:
+        # Cancelled before it started, there is nothing to transcribe
+        quit()
     print("------------------------------------------------------")
     print("------------  Beginning transcription...  ------------")
     print("------------------------------------------------------")
-    transcriber.from_wav(WAV_FILENAME, TRANSCRIPTION_FILENAME, '.\\models\\' + model_name, timestamp_duration=TRANSCRIPTION_TIMESTAMP_FREQUENCY)
+    if args.per_source:
+        transcriber.from_sources(list(zip(source_labels, source_paths)), TRANSCRIPTION_FILENAMES, '.\\models\\' + model_name, audio_file_name=recording_path(WAV_FILENAME, segment_seconds),
+                                 timestamp_duration=TRANSCRIPTION_TIMESTAMP_FREQUENCY, vad_settings=vad_settings, model=model_future, timings=timings)
+        timings['transcribed'] = time.perf_counter()
+        quit()
+    if args.use_daemon:
+        reply = daemon.submit_job(recording_path(WAV_FILENAME, segment_seconds), TRANSCRIPTION_FILENAMES, '.\\models\\' + model_name, timestamp_duration=TRANSCRIPTION_TIMESTAMP_FREQUENCY, port=DAEMON_PORT, vad_settings=vad_settings)
+        if reply is not None and reply['status'] == 'done':
+            timings['transcribed'] = time.perf_counter()
+            quit()
+        sys.stderr.write(f"Transcription daemon could not take the job ({reply['status'] if reply else 'not running'}), transcribing here instead\n")
+    if phrases:
+        transcriber.spot_keywords(recording_path(WAV_FILENAME, segment_seconds), TRANSCRIPTION_FILENAMES, '.\\models\\' + model_name, phrases, vad_settings=vad_settings, model=model_future, timings=timings)
+        timings['transcribed'] = time.perf_counter()
+        quit()
+    # The text of each window is kept for the refining pass
+    window_texts = []
+    transcriber.from_wav(recording_path(WAV_FILENAME, segment_seconds), TRANSCRIPTION_FILENAMES, '.\\models\\' + model_name, timestamp_duration=TRANSCRIPTION_TIMESTAMP_FREQUENCY, workers=args.workers, vad_settings=vad_settings,
+                         model=model_future, timings=timings, texts=window_texts)
+    timings['transcribed'] = time.perf_counter()
+
+    if refine_model_name is not None:
+        print(f"\nThe transcription is done, it is now being improved with {refine_model_name} in the background (Ctrl+C keeps it as it is)")
+        # Its own process so it can lower its priority without slowing anything else down
+        refine_process = multiprocessing.Process(target=transcriber.refine, args=(recording_path(WAV_FILENAME, segment_seconds), TRANSCRIPTION_FILENAMES, '.\\models\\' + refine_model_name, window_texts),
+                                                 kwargs={'timestamp_duration': TRANSCRIPTION_TIMESTAMP_FREQUENCY, 'vad_settings': vad_settings})
+        refine_process.start()
+        try:
+            refine_process.join()
+        except KeyboardInterrupt:
+            # Ctrl+C reaches the refining process too, it saves what it has improved so far before ending
+            refine_process.join()
     
\ No newline at end of file
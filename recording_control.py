@@ -0,0 +1,46 @@
+# pylint: disable=line-too-long
+""" Starts, stops, pauses, resumes or marks a recording made with the -c or -H option of digital_meeting_audio_transcriber.py, ex. from a scheduler """
+
+import sys
+import argparse
+import configparser
+
+sys.path.append('.\\src\\')
+import control
+
+# Modify the following constants as desired
+CONTROL_PORT = control.DEFAULT_CONTROL_PORT
+
+
+if __name__ == '__main__':
+    """ da main function """
+
+
+    # Parsing config defaults from default_values.ini into variables
+    config_parser = configparser.ConfigParser()
+    config_parser.read('default_values.ini')
+    defaults = config_parser['DEFAULT_VALUES']
+
+    try:
+        CONTROL_PORT = int(defaults.get('CONTROL_PORT', CONTROL_PORT))
+    except ValueError:
+        print(f'\nInvalid value for CONTROL_PORT in default_values.ini.\n\nPlease make sure CONTROL_PORT in default_values.ini is a number.\nCurrent value: {defaults['CONTROL_PORT']}\n', file=sys.stderr)
+        quit()
+
+    # Parsing CLI arguments and updating config defaults
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("command", choices=('start', 'stop', 'pause', 'resume', 'mark', 'status'),   help="The command to send to the recording")
+    arg_parser.add_argument("label", nargs='?',   help="Optional label saved with a mark")
+    arg_parser.add_argument("-p","--port", type=int, default=CONTROL_PORT,   help=f"Set the localhost port the recording listens on (default is {CONTROL_PORT})")
+
+    args = arg_parser.parse_args()
+
+
+    reply = control.send_command(args.command, args.label, port=args.port)
+    if reply is None:
+        print(f"No recording is listening on port {args.port}", file=sys.stderr)
+        sys.exit(1)
+    if reply['status'] != 'ok':
+        print(f"{reply.get('message', reply['status'])}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Recording is {reply['state']}")
@@ -0,0 +1,80 @@
+# pylint: disable=line-too-long
+""" Finds words and phrases in the transcript archive, with the time they were said and how far into the recording """
+
+import sys
+import time
+import argparse
+import datetime
+import configparser
+
+sys.path.append('.\\src\\')
+import archive_index
+
+# Modify the following constants as desired
+# Index of every transcript (also updated when a transcription finishes), see archive_index.py
+TRANSCRIPT_INDEX = archive_index.INDEX_FILENAME
+
+
+def parse_datetime(p_text):
+    """ Turns a date or date and time (ex. 2025-10-05 or '2025-10-05 13:45') into a datetime.datetime, for the --after and --before options """
+
+    try:
+        return datetime.datetime.fromisoformat(p_text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{p_text}', use YYYY-MM-DD or 'YYYY-MM-DD HH:MM'")
+
+
+def print_matches(p_matches):
+    """ Prints one line per entry from archive_index.query() """
+
+    for time_stamp, offset, _, source, text, path, _ in p_matches:
+        when = datetime.datetime.fromtimestamp(time_stamp).strftime(archive_index.TIMESTAMP_FORMAT)
+        into = time.strftime('%H:%M:%S', time.gmtime(offset))
+        label = f"{source}: " if source else ''
+        print(f"{when} ({into} into the audio) {path} - {label}{text}")
+
+
+if __name__ == '__main__':
+    """ da main function """
+
+
+    # Parsing config defaults from default_values.ini into variables
+    config_parser = configparser.ConfigParser()
+    config_parser.read('default_values.ini')
+    defaults = config_parser['DEFAULT_VALUES']
+
+    TRANSCRIPT_INDEX = defaults.get('TRANSCRIPT_INDEX', TRANSCRIPT_INDEX) or archive_index.INDEX_FILENAME
+
+    # Parsing CLI arguments and updating config defaults
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-i","--index", default=TRANSCRIPT_INDEX,   help=f"Set the index file (default is '{TRANSCRIPT_INDEX}')")
+    sub_parsers = arg_parser.add_subparsers(dest='command', required=True)
+
+    index_parser = sub_parsers.add_parser('index',   help="Add transcripts to the index, transcripts that haven't changed since they were added are skipped")
+    index_parser.add_argument("sources", nargs='+',   help="Directories (searched recursively for .json and .txt transcripts) or glob patterns")
+
+    query_parser = sub_parsers.add_parser('query',   help="Find the entries of indexed transcripts that have a phrase")
+    query_parser.add_argument("text",   help="The phrase to search for, case insensitive")
+    query_parser.add_argument("-a","--all_words", action='store_true',   help="Find entries with all of the words anywhere in them instead of the exact phrase")
+    query_parser.add_argument("--after", type=parse_datetime,   help="Only find entries said on or after this date/time (ex. 2025-10-05 or '2025-10-05 13:45')")
+    query_parser.add_argument("--before", type=parse_datetime,   help="Only find entries said before this date/time (ex. 2025-10-06)")
+    query_parser.add_argument("-n","--limit", type=int, default=100,   help="Set the most entries printed (default is 100)")
+
+    args = arg_parser.parse_args()
+
+
+    if args.command == 'index':
+        paths = [y for x in args.sources for y in archive_index.find_transcripts(x)]
+        if not paths:
+            print(f"\nNo .json or .txt transcripts found in {' '.join(args.sources)}\n", file=sys.stderr)
+            quit()
+        added, skipped = archive_index.add(paths, args.index)
+        dropped = archive_index.prune(args.index)
+        print(f"{added} transcripts indexed, {skipped} unchanged, {dropped} removed transcripts dropped from {args.index}")
+
+    else:
+        start_time = time.perf_counter()
+        matches = archive_index.query(args.text, args.index, phrase=not args.all_words, after=args.after, before=args.before, limit=args.limit)
+        elapsed = time.perf_counter() - start_time
+        print_matches(matches)
+        print(f"\n{len(matches)} matches in {elapsed * 1000:.1f} ms")
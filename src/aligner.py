@@ -0,0 +1,104 @@
+# pylint: disable=line-too-long
+""" Lines up the 16 kHz streams of several input devices into equal-length frames for mixing """
+# Devices start a few milliseconds apart and their clocks drift (a mic and Stereo Mix can be off by ~0.01%,
+# which is a third of a second an hour). The first device is used as the reference clock: a frame is emitted
+# every ALIGN_FRAME_SIZE reference samples, and every other device has one sample dropped or repeated per
+# frame while its smoothed backlog relative to the reference is outside DRIFT_TOLERANCE.
+
+import numpy
+
+ALIGN_FRAME_SIZE = 1024
+# Samples the reference device has to be ahead by before a frame is emitted, gives the other devices' callbacks time to arrive
+ALIGN_LATENCY = 2048
+# Samples of smoothed backlog difference that are tolerated before drift correction kicks in
+DRIFT_TOLERANCE = 160
+# Weight of the newest backlog measurement in the smoothed backlog (per frame)
+DRIFT_SMOOTHING = 1 / 64
+
+
+class Aligner:
+    """ Collects resampled audio per source with push() and hands out equal-length frames with frames() """
+
+    def __init__(self, p_num_sources, p_sample_rate=16000):
+
+        self.num_sources = p_num_sources
+        self.sample_rate = p_sample_rate
+        self.pending = [numpy.zeros(0, dtype=numpy.int32) for x in range(p_num_sources)]
+        self.start_times = [None] * p_num_sources
+        self.started = False
+        self.backlog = [0.0] * p_num_sources
+
+        # Reported at the end of the recording
+        self.underruns = [0] * p_num_sources
+        self.dropped = [0] * p_num_sources
+        self.inserted = [0] * p_num_sources
+
+    def push(self, p_source, p_samples, p_start_time=None):
+        """ Adds resampled samples from source p_source, p_start_time (seconds, any shared clock) is the time of the source's first sample """
+
+        if self.start_times[p_source] is None and p_start_time is not None:
+            self.start_times[p_source] = p_start_time
+        self.pending[p_source] = numpy.concatenate((self.pending[p_source], p_samples))
+
+    def _line_up_starts(self):
+        """ Trims the beginning of every source that started before the last one to start """
+
+        latest = max(self.start_times)
+        for x in range(self.num_sources):
+            trim = int(round((latest - self.start_times[x]) * self.sample_rate))
+            self.pending[x] = self.pending[x][trim:]
+
+    def frames(self, p_final=False):
+        """ Generator of lists with one equal-length int32 array per source
+            With p_final the remaining audio is flushed too, missing samples are filled with silence
+        """
+
+        if not self.started:
+            if None in self.start_times and not p_final:
+                return
+            if None not in self.start_times:
+                self._line_up_starts()
+            self.started = True
+
+        while len(self.pending[0]) >= ALIGN_FRAME_SIZE + ALIGN_LATENCY or (p_final and len(self.pending[0]) > 0):
+
+            frame_size = min(ALIGN_FRAME_SIZE, len(self.pending[0]))
+            reference_length = len(self.pending[0])
+            frame = []
+
+            for x in range(self.num_sources):
+                take = frame_size
+
+                if x != 0 and not p_final:
+                    # Smoothed backlog of this source compared to the reference, positive means this source's clock runs fast
+                    self.backlog[x] += DRIFT_SMOOTHING * ((len(self.pending[x]) - reference_length) - self.backlog[x])
+                    if self.backlog[x] > DRIFT_TOLERANCE:
+                        take = frame_size + 1
+                        self.dropped[x] += 1
+                    elif self.backlog[x] < -DRIFT_TOLERANCE:
+                        take = frame_size - 1
+                        self.inserted[x] += 1
+
+                samples = self.pending[x][:take]
+                self.pending[x] = self.pending[x][take:]
+
+                if len(samples) < min(take, frame_size):
+                    # The source ran dry, fill with silence
+                    if not p_final:
+                        self.underruns[x] += 1
+                    samples = numpy.concatenate((samples, numpy.zeros(frame_size - len(samples), dtype=numpy.int32)))
+                elif len(samples) > frame_size:
+                    # Drop the last sample of the frame
+                    samples = samples[:frame_size]
+                elif len(samples) < frame_size:
+                    # Repeat the last sample of the frame
+                    samples = numpy.concatenate((samples, samples[-1:]))
+
+                frame.append(samples)
+
+            yield frame
+
+    def report(self):
+        """ Returns {source: (underruns, dropped samples, repeated samples)} """
+
+        return {x: (self.underruns[x], self.dropped[x], self.inserted[x]) for x in range(self.num_sources)}
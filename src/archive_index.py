@@ -0,0 +1,233 @@
+# pylint: disable=line-too-long
+""" Inverted index over an archive of .json and .txt transcripts, so a word or phrase can be found without reading every transcript """
+# The index is an SQLite database (sqlite3 ships with Python) with three tables:
+#
+#       files       one row per transcript: path, [size, mtime] fingerprint, audio file name
+#       windows     one row per transcript entry: absolute time (seconds since the epoch), seconds into the recording, duration, source label, text
+#       postings    (term, window, position of the word in the window), the primary key so looking up a term is one index seek
+#
+# A transcript is only read again when its fingerprint changes, its old rows are replaced in one transaction.
+# Phrases are matched with one self join of postings per word on consecutive positions, they don't match across entries.
+#
+# configure() turns on updating the index from transcriber (every finished transcript is added), the setting is passed to
+# child processes through an environment variable the same as telemetry's.
+
+import os
+import re
+import sys
+import json
+import glob
+import sqlite3
+import datetime
+import contextlib
+
+ENV_VARIABLE = 'DMAT_INDEX'
+INDEX_FILENAME = 'transcript_index.db'
+# Seconds to wait for another process (ex. a batch worker) that is writing to the index
+LOCK_TIMEOUT = 30.0
+
+# Header of the .txt and .json writers in outputs.py and the timestamps of their entries
+TIMESTAMP_FORMAT = '%m/%d/%y %H:%M:%S'
+TXT_HEADER = re.compile(r'^Transcription of (.*)\. Created on (\d\d/\d\d/\d\d \d\d:\d\d:\d\d)\.$')
+TXT_ENTRY = re.compile(r'^(\d\d):(\d\d):(\d\d), (\d\d):(\d\d):(\d\d) - (.*)$')
+WORD = re.compile(r"[\w']+")
+
+_index_path = os.environ.get(ENV_VARIABLE) or None
+
+
+def configure(p_index_path=INDEX_FILENAME):
+    """ Has every transcript transcriber finishes from now on (in this process and its children) added to the index at p_index_path """
+
+    global _index_path
+    _index_path = os.path.abspath(p_index_path)
+    os.environ[ENV_VARIABLE] = _index_path
+
+
+def words(p_text):
+    """ Lowercase words of p_text, the terms of the index """
+
+    return WORD.findall(p_text.lower())
+
+
+def _seconds(p_hms):
+    """ Seconds in an HH:MM:SS string """
+
+    hours, minutes, seconds = p_hms.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def parse_transcript(p_path):
+    """ Reads the .json or .txt transcript at p_path into (audio file name, [(absolute time, seconds into the recording, duration, source, text)])
+        Returns None for other file types and files that aren't transcripts (ex. other .json files), raises ValueError if the transcript is damaged
+    """
+
+    extension = os.path.splitext(p_path)[1].lower()
+    entries = []
+
+    if extension == '.json':
+        with open(p_path, 'rt') as transcript_file:
+            items = json.load(transcript_file)
+        # Keyword hits (see keywords.py) aren't transcripts, their phrases would show up twice
+        if not isinstance(items, list) or not items or not isinstance(items[0], dict) or 'audio_file_name' not in items[0] or 'keywords' in items[0]:
+            return None
+        audio_file_name = items[0].get('audio_file_name')
+        for x in items[1:]:
+            entries.append((datetime.datetime.strptime(x['time_stamp'], TIMESTAMP_FORMAT).timestamp(), _seconds(x['rel_timestamp']), x['duration'], x.get('source'), x['text']))
+        return (audio_file_name, entries)
+
+    if extension == '.txt':
+        with open(p_path, 'rt') as transcript_file:
+            header = TXT_HEADER.match(transcript_file.readline().rstrip('\n'))
+            if header is None:
+                return None
+            # The header has the date, entries only have the time of day, so entries are placed by their time into the recording
+            created = datetime.datetime.strptime(header.group(2), TIMESTAMP_FORMAT).timestamp()
+            for line in transcript_file:
+                entry = TXT_ENTRY.match(line.rstrip('\n'))
+                if entry is not None:
+                    offset = int(entry.group(4)) * 3600 + int(entry.group(5)) * 60 + int(entry.group(6))
+                    entries.append((created + offset, offset, None, None, entry.group(7)))
+        # Every entry but the last one lasts until the next one starts
+        entries = [(x[0], x[1], y[1] - x[1], x[3], x[4]) for x, y in zip(entries, entries[1:])] + entries[-1:]
+        return (header.group(1), entries)
+
+    return None
+
+
+def _connect(p_index_path):
+    """ Opens (and creates if needed) the index at p_index_path """
+
+    connection = sqlite3.connect(p_index_path, timeout=LOCK_TIMEOUT)
+    connection.executescript('''
+        CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, fingerprint TEXT NOT NULL, audio_file_name TEXT);
+        CREATE TABLE IF NOT EXISTS windows (id INTEGER PRIMARY KEY, file INTEGER NOT NULL, time REAL NOT NULL, offset INTEGER NOT NULL, duration INTEGER, source TEXT, text TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS windows_file ON windows (file);
+        CREATE INDEX IF NOT EXISTS windows_time ON windows (time);
+        CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, window INTEGER NOT NULL, position INTEGER NOT NULL, PRIMARY KEY (term, window, position)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS postings_window ON postings (window);
+    ''')
+    return connection
+
+
+def _fingerprint(p_path):
+    """ Size and modification time of p_path, a transcript is indexed again if either changes """
+
+    stat = os.stat(p_path)
+    return json.dumps([stat.st_size, stat.st_mtime_ns])
+
+
+def _remove_file(p_connection, p_file_id):
+
+    p_connection.execute('DELETE FROM postings WHERE window IN (SELECT id FROM windows WHERE file = ?)', (p_file_id,))
+    p_connection.execute('DELETE FROM windows WHERE file = ?', (p_file_id,))
+    p_connection.execute('DELETE FROM files WHERE id = ?', (p_file_id,))
+
+
+def add(p_paths, p_index_path=None):
+    """ Adds the transcripts at p_paths to the index at p_index_path (default is the one set by configure()), transcripts that haven't changed since they were added are skipped
+        Returns (transcripts added, transcripts skipped)
+    """
+
+    index_path = p_index_path or _index_path
+    added = 0
+    skipped = 0
+    with contextlib.closing(_connect(index_path)) as connection:
+        for x in p_paths:
+            path = os.path.abspath(x)
+            try:
+                fingerprint = _fingerprint(path)
+                row = connection.execute('SELECT id, fingerprint FROM files WHERE path = ?', (path,)).fetchone()
+                if row is not None and row[1] == fingerprint:
+                    skipped += 1
+                    continue
+                transcript = parse_transcript(path)
+            except (OSError, ValueError, KeyError) as error:
+                sys.stderr.write(f"Unable to index {path} (in archive_index.add()):  {error}\n")
+                continue
+            if transcript is None:
+                continue
+
+            audio_file_name, entries = transcript
+            # The with block is one transaction, a transcript is never half indexed
+            with connection:
+                if row is not None:
+                    _remove_file(connection, row[0])
+                file_id = connection.execute('INSERT INTO files (path, fingerprint, audio_file_name) VALUES (?, ?, ?)', (path, fingerprint, audio_file_name)).lastrowid
+                for time_stamp, offset, duration, source, text in entries:
+                    window_id = connection.execute('INSERT INTO windows (file, time, offset, duration, source, text) VALUES (?, ?, ?, ?, ?, ?)',
+                                                   (file_id, time_stamp, offset, duration, source, text)).lastrowid
+                    connection.executemany('INSERT OR IGNORE INTO postings (term, window, position) VALUES (?, ?, ?)', [(y, window_id, z) for z, y in enumerate(words(text))])
+            added += 1
+
+    return (added, skipped)
+
+
+def update(p_paths):
+    """ Called by transcriber with the outputs of every finished transcript, adds the .json and .txt ones if configure() was called """
+
+    if _index_path is None:
+        return
+    paths = [x for x in p_paths if os.path.splitext(x)[1].lower() in ('.json', '.txt')]
+    if paths:
+        # A locked, read-only or damaged index only costs the search, the transcript itself is already written
+        try:
+            add(paths)
+        except sqlite3.Error as error:
+            sys.stderr.write(f"Unable to update the transcript index {_index_path} (in archive_index.update()):  {error}\n")
+
+
+def prune(p_index_path=None):
+    """ Drops transcripts that no longer exist from the index, returns how many were dropped """
+
+    dropped = 0
+    with contextlib.closing(_connect(p_index_path or _index_path)) as connection:
+        for file_id, path in connection.execute('SELECT id, path FROM files').fetchall():
+            if not os.path.exists(path):
+                with connection:
+                    _remove_file(connection, file_id)
+                dropped += 1
+    return dropped
+
+
+def query(p_text, p_index_path=None, *, phrase=True, after=None, before=None, limit=100):
+    """ Returns (absolute time, seconds into the recording, duration, source, text, transcript path, audio file name) of every entry that has the words of p_text, in time order
+        With phrase=True the words have to be next to each other in that order, otherwise anywhere in the entry
+        after and before (datetime.datetime) only keep entries from that time range
+    """
+
+    terms = words(p_text)
+    if not terms:
+        return []
+
+    # One join per extra word, each one a primary key seek on (term, window[, position])
+    joins = []
+    for x in range(1, len(terms)):
+        position = f" AND p{x}.position = p0.position + {x}" if phrase else ''
+        joins.append(f"JOIN postings p{x} ON p{x}.term = ? AND p{x}.window = p0.window{position}")
+    filters = ''
+    parameters = terms[1:] + terms[:1]
+    if after is not None:
+        filters += ' AND w.time >= ?'
+        parameters.append(after.timestamp())
+    if before is not None:
+        filters += ' AND w.time < ?'
+        parameters.append(before.timestamp())
+    parameters.append(limit)
+
+    statement = f'''SELECT w.time, w.offset, w.duration, w.source, w.text, f.path, f.audio_file_name
+                    FROM windows w JOIN files f ON f.id = w.file
+                    WHERE w.id IN (SELECT p0.window FROM postings p0 {' '.join(joins)} WHERE p0.term = ?){filters}
+                    ORDER BY w.time LIMIT ?'''
+
+    with contextlib.closing(_connect(p_index_path or _index_path)) as connection:
+        return connection.execute(statement, parameters).fetchall()
+
+
+def find_transcripts(p_source):
+    """ Returns the .json and .txt transcripts in directory p_source (searched recursively) or matching glob pattern p_source """
+
+    if os.path.isdir(p_source):
+        paths = glob.glob(os.path.join(p_source, '**', '*.json'), recursive=True) + glob.glob(os.path.join(p_source, '**', '*.txt'), recursive=True)
+    else:
+        paths = [x for x in glob.glob(p_source, recursive=True) if os.path.splitext(x)[1].lower() in ('.json', '.txt')]
+    return sorted(paths)
@@ -0,0 +1,179 @@
+# pylint: disable=line-too-long
+""" Headless transcription of many existing recordings, with an on-disk job ledger so interrupted runs resume where they stopped """
+# The ledger is a JSON lines file with one entry per finished job. Only the main process writes to it, so an
+# interrupted run leaves at most a partial last line behind, which is ignored when the ledger is read back.
+
+import os
+import sys
+import json
+import glob
+import time
+import multiprocessing
+
+import transcriber
+import segments
+
+LEDGER_FILENAME = 'batch_ledger.jsonl'
+
+# Model loaded once per worker process by _init_worker() and reused for every file that worker transcribes
+_worker_model = None
+
+
+def find_recordings(p_source):
+    """ Returns the wav paths described by p_source, which can be a directory, a glob pattern, or a manifest file listing one wav path per line
+        Segmented recordings (see segments.py) are returned as the path of their manifest instead of their segments
+    """
+
+    if os.path.isdir(p_source):
+        manifests = sorted(glob.glob(os.path.join(p_source, '**', '*' + segments.MANIFEST_SUFFIX), recursive=True))
+        # Segments are transcribed through their manifest, not one by one
+        segment_names = set()
+        for x in manifests:
+            segment_names.update(glob.glob(glob.escape(x[:-len(segments.MANIFEST_SUFFIX)]) + '_[0-9][0-9][0-9][0-9].wav'))
+        return sorted([x for x in glob.glob(os.path.join(p_source, '**', '*.wav'), recursive=True) if x not in segment_names] + manifests)
+
+    if segments.is_manifest(p_source):
+        return [p_source]
+
+    if os.path.isfile(p_source) and not p_source.lower().endswith('.wav'):
+        # Manifest paths are relative to the manifest itself, blank lines and # comments are skipped
+        manifest_dir = os.path.dirname(os.path.abspath(p_source))
+        with open(p_source, 'rt') as manifest:
+            lines = [x.strip() for x in manifest]
+        return [os.path.join(manifest_dir, x) for x in lines if x and not x.startswith('#')]
+
+    return sorted(glob.glob(p_source, recursive=True))
+
+
+def read_ledger(p_ledger_path):
+    """ Returns {wav path: ledger entry} of the latest entry per recording in the ledger at p_ledger_path """
+
+    entries = {}
+    if not os.path.exists(p_ledger_path):
+        return entries
+
+    with open(p_ledger_path, 'rt') as ledger:
+        for line in ledger:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Partial line from an interrupted run
+                continue
+            entries[entry['wav_path']] = entry
+    return entries
+
+
+def _fingerprint(p_wav_path):
+    """ Size and modification time of p_wav_path, a finished job is redone if either changes """
+
+    stat = os.stat(p_wav_path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def _init_worker(p_vosk_model_path):
+    """ Pool initializer, each worker process loads the model once """
+
+    global _worker_model
+    _worker_model = transcriber.load_model(p_vosk_model_path)
+
+
+def _run_job(p_job):
+    """ Transcribes one (wav path, output paths, model path, timestamp duration, [start, end], resume, phrases) job in a worker process and returns its ledger entry
+        Jobs with a list of phrases only spot those keywords (see transcriber.spot_keywords())
+    """
+
+    wav_path, output_paths, model_path, timestamp_duration, time_range, resume, phrases = p_job
+
+    start = time.perf_counter()
+    error_message = None
+    try:
+        with transcriber.open_recording(wav_path, start=time_range[0], end=time_range[1]) as wf:
+            audio_seconds = wf.getnframes() / wf.getframerate()
+        if phrases:
+            result = transcriber.spot_keywords(wav_path, output_paths, model_path, phrases, model=_worker_model, start=time_range[0], end=time_range[1])
+        else:
+            result = transcriber.from_wav(wav_path, output_paths, model_path, timestamp_duration=timestamp_duration, model=_worker_model, start=time_range[0], end=time_range[1], resume=resume)
+        status = 'done' if result == 1 else 'failed'
+    # Anything a damaged recording raises (ex. a bad manifest line) only fails this job, the rest of the batch carries on
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        sys.stderr.write(f"Unable to transcribe {wav_path} (in batch._run_job()):  {error}\n")
+        error_message = f"{type(error).__name__}: {error}"
+        audio_seconds = 0
+        status = 'failed'
+
+    return {'wav_path': wav_path,
+            'output_paths': output_paths,
+            'range': time_range,
+            'keywords': phrases,
+            'status': status,
+            'error': error_message,
+            'fingerprint': _fingerprint(wav_path) if os.path.exists(wav_path) else None,
+            'audio_seconds': audio_seconds,
+            'decode_seconds': time.perf_counter() - start}
+
+
+def run(p_sources, p_vosk_model_path, *, output_dir=None, output_types=('txt',), workers=1, timestamp_duration=10, start=0.0, end=None, resume=False, phrases=None):
+    """ Transcribes every recording found in p_sources (see find_recordings()) using a pool of workers processes
+        Outputs are written next to each recording, or into output_dir, one per extension in output_types (all from one recognition pass)
+        Only start seconds up to end seconds (None for the end) of each recording are transcribed, the range is added to the output names
+        Recordings already transcribed according to the ledger (with the same range, and unchanged since) are skipped
+        With resume=True recordings that were interrupted part way through carry on from their last checkpoint (see transcriber.from_wav()) instead of starting over
+        If a list of phrases is passed only those keywords are spotted (see transcriber.spot_keywords()), the outputs get a _keywords suffix so they don't replace transcriptions
+        Returns (jobs run, jobs failed, audio hours per wall-clock hour)
+    """
+
+    wav_paths = []
+    for x in p_sources:
+        wav_paths.extend(os.path.abspath(y) for y in find_recordings(x))
+    # Duplicates (ex. overlapping globs) would be transcribed twice at the same time
+    wav_paths = list(dict.fromkeys(wav_paths))
+
+    ledger_dir = output_dir if output_dir is not None else os.getcwd()
+    os.makedirs(ledger_dir, exist_ok=True)
+    ledger_path = os.path.join(ledger_dir, LEDGER_FILENAME)
+    finished = read_ledger(ledger_path)
+
+    time_range = [start, end]
+    name_suffix = ''
+    if start or end is not None:
+        name_suffix = f"_{start:g}-{end:g}s" if end is not None else f"_{start:g}s-end"
+    if phrases:
+        name_suffix = name_suffix + '_keywords'
+
+    jobs = []
+    used_outputs = set()
+    for x in wav_paths:
+        entry = finished.get(x)
+        # Entries from before ranges (or keywords) were supported are whole file transcriptions
+        if entry is not None and entry['status'] == 'done' and entry['fingerprint'] == _fingerprint(x) and entry.get('range', [0.0, None]) == time_range and entry.get('keywords') == phrases:
+            continue
+        # A segmented recording's outputs are named after the recording, not its manifest
+        base_name = os.path.basename(x)[:-len(segments.MANIFEST_SUFFIX)] if segments.is_manifest(x) else os.path.splitext(os.path.basename(x))[0]
+        name = os.path.join(output_dir if output_dir is not None else os.path.dirname(x), base_name + name_suffix)
+        # Recordings with the same name from different directories would otherwise write to the same output files, add '_copy' until it is unique
+        while name in used_outputs:
+            name = name + '_copy'
+        used_outputs.add(name)
+        jobs.append((x, [name + '.' + y for y in output_types], p_vosk_model_path, timestamp_duration, time_range, resume, phrases))
+
+    print(f"{len(wav_paths)} recordings found, {len(wav_paths) - len(jobs)} already transcribed, {len(jobs)} to go")
+    if not jobs:
+        return (0, 0, 0)
+
+    start = time.perf_counter()
+    audio_seconds = 0
+    failed = 0
+
+    with multiprocessing.Pool(min(workers, len(jobs)), initializer=_init_worker, initargs=(p_vosk_model_path,)) as pool:
+        with open(ledger_path, 'at') as ledger:
+            for count, entry in enumerate(pool.imap_unordered(_run_job, jobs), start=1):
+                ledger.write(json.dumps(entry) + '\n')
+                ledger.flush()
+
+                audio_seconds += entry['audio_seconds']
+                if entry['status'] != 'done':
+                    failed += 1
+                print(f"[{count}/{len(jobs)}] {entry['status']}: {entry['wav_path']}")
+
+    wall_seconds = time.perf_counter() - start
+    return (len(jobs), failed, audio_seconds / wall_seconds)
@@ -0,0 +1,117 @@
+# pylint: disable=line-too-long
+""" Concurrent capture of any number of input devices using PyAudio's non-blocking callback mode """
+# PortAudio calls each device's callback from its own thread as soon as a buffer is ready, so a slow device
+# never holds up the others. The callback only copies the buffer into the device's ring buffer and counts
+# input overflows, everything else happens in record_audio.prepare_audio().
+
+import time
+
+import pyaudio
+
+import ring_buffer
+import telemetry
+
+
+class CaptureEngine:
+    """ Opens a callback stream and a ring_buffer.RingBuffer for every pyaudio device index in p_device_list """
+
+    def __init__(self, p_audio, p_device_list, p_chunk_size, p_ring_chunks):
+
+        self.device_list = tuple(p_device_list)
+        self.rings = {}
+        self.streams = {}
+        # While paused the callbacks throw buffers away instead of writing them, the streams keep running so devices stay in step
+        self.paused = False
+
+        for x in self.device_list:
+            device = p_audio.get_device_info_by_index(x)
+            channels = device['maxInputChannels']
+            rate = int(device['defaultSampleRate'])
+
+            # Sample rate and # of channels are stored in each ring's header to ensure data can be resampled to 16000 properly
+            self.rings[x] = ring_buffer.RingBuffer.create(p_chunk_size * p_ring_chunks, channels, rate)
+            self.streams[x] = p_audio.open(format=pyaudio.paInt16,
+                                           channels=channels,
+                                           rate=rate,
+                                           input=True,
+                                           input_device_index=x,
+                                           frames_per_buffer=p_chunk_size,
+                                           stream_callback=self._make_callback(self.rings[x], rate, telemetry.stage(f"capture.callback.{x}")),
+                                           start=False,
+                                           )
+
+    def _make_callback(self, p_ring, p_rate, p_timer):
+        """ Returns a PyAudio stream callback that writes into p_ring, timed by the telemetry stage p_timer """
+
+        header = p_ring.header
+
+        def callback(in_data, frame_count, time_info, status):
+            if self.paused:
+                return (None, pyaudio.paContinue)
+            with p_timer:
+                # The first buffer's capture time lets prepare_audio() line up devices that started at slightly different times
+                if header[ring_buffer.HEADER_START_TIME] == 0:
+                    header[ring_buffer.HEADER_START_TIME] = time.monotonic_ns() - frame_count * 1_000_000_000 // p_rate
+                if status & pyaudio.paInputOverflow:
+                    header[ring_buffer.HEADER_INPUT_OVERFLOWS] += 1
+                p_ring.write(in_data)
+            return (None, pyaudio.paContinue)
+
+        return callback
+
+    def ring_names(self):
+        """ Names of the ring buffers in device order, for attaching from prepare_audio() """
+
+        return [self.rings[x].name for x in self.device_list]
+
+    def start(self):
+        """ Starts every stream, each one begins calling its callback independently """
+
+        for x in self.device_list:
+            self.streams[x].start_stream()
+
+    def pause(self):
+        """ Stops writing captured audio until resume() """
+
+        self.paused = True
+
+    def resume(self):
+
+        self.paused = False
+
+    def recorded_seconds(self):
+        """ Seconds of audio written by the first device so far (paused time not included) """
+
+        ring = self.rings[self.device_list[0]]
+        return int(ring.header[ring_buffer.HEADER_WRITE]) / ring.sample_rate
+
+    def stop(self):
+        """ Stops every stream and tells the reader no more frames are coming """
+
+        for x in self.device_list:
+            self.streams[x].stop_stream()
+            self.streams[x].close()
+        for x in self.device_list:
+            self.rings[x].close()
+
+    def report(self):
+        """ Returns {device index: (input overflows, dropped chunks)}
+            Input overflows are PortAudio buffers lost before the callback ran, dropped chunks were lost because prepare_audio() fell a full ring behind
+        """
+
+        return {x: (int(self.rings[x].header[ring_buffer.HEADER_INPUT_OVERFLOWS]), int(self.rings[x].header[ring_buffer.HEADER_OVERFLOWS])) for x in self.device_list}
+
+    def update_gauges(self):
+        """ Sets telemetry gauges for each device's ring buffer backlog (seconds), input overflows and dropped chunks """
+
+        for x in self.device_list:
+            header = self.rings[x].header
+            telemetry.gauge(f"capture.backlog_seconds.{x}", self.rings[x].available() / self.rings[x].sample_rate)
+            telemetry.gauge(f"capture.input_overflows.{x}", int(header[ring_buffer.HEADER_INPUT_OVERFLOWS]))
+            telemetry.gauge(f"capture.dropped_chunks.{x}", int(header[ring_buffer.HEADER_OVERFLOWS]))
+
+    def release(self):
+        """ Frees the ring buffers, call after the reading process has finished """
+
+        for x in self.device_list:
+            self.rings[x].release()
@@ -0,0 +1,178 @@
+# pylint: disable=line-too-long
+""" Event driven start/stop/pause/mark control of a recording from hotkeys, POSIX signals and a localhost control socket """
+# Every source calls RecordingControl.command(), which checks the command against the current state and queues it
+# for record_audio.record(). record() blocks on the queue, so waiting for the start key costs no CPU.
+#
+#       hotkeys     keyboard hook callbacks, the start and stop key can be the same key (it toggles)
+#       signals     SIGUSR1 starts, SIGUSR2 pauses/resumes, SIGINT and SIGTERM stop (SIGUSR1/2 don't exist on Windows)
+#
+# A stop while still waiting cancels the recording before it starts, so Ctrl+C or a scheduler's SIGTERM always ends it.
+# Ctrl+C in a terminal reaches every process of the recording, the ones that should finish on their own once the
+# recording stops (ex. the live transcriber) are started through ignore_interrupts() so it doesn't kill them half way.
+#       socket      one JSON object per line on a localhost TCP port, the same as the transcription daemon:
+#                       {"command": "start" | "stop" | "pause" | "resume" | "mark" | "status", "label": ...}
+#                   each request gets one JSON line back: {"status": "ok" | "error", "state": ..., "message": ...}
+
+import sys
+import json
+import queue
+import signal
+import socket
+import threading
+import socketserver
+
+import keyboard
+
+DEFAULT_CONTROL_PORT = 8766
+# Seconds between wakeups while blocked waiting for a command, only so Ctrl+C is noticed on Windows
+WAKE_INTERVAL = 0.5
+
+# Commands allowed in each state, and the state each command leads to
+TRANSITIONS = {'waiting': {'start': 'recording', 'stop': 'stopped'},
+               'recording': {'stop': 'stopped', 'pause': 'paused', 'mark': 'recording'},
+               'paused': {'stop': 'stopped', 'resume': 'recording', 'mark': 'paused'},
+               'stopped': {}}
+
+
+def ignore_interrupts(p_target, *p_args, **p_kwargs):
+    """ multiprocessing.Process target that calls p_target(*p_args, **p_kwargs) with SIGINT (Ctrl+C) ignored """
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    return p_target(*p_args, **p_kwargs)
+
+
+class RecordingControl:
+    """ State of one recording ('waiting', 'recording', 'paused' or 'stopped') and the queue of commands for record() to act on """
+
+    def __init__(self):
+
+        self.state = 'waiting'
+        self.commands = queue.Queue()
+        self.lock = threading.Lock()
+        self.hotkeys = []
+        self.previous_signals = {}
+        self.server = None
+
+    def command(self, p_command, p_label=None):
+        """ Queues p_command if the current state allows it, returns (accepted, state after the command)
+            'toggle' starts or stops, 'toggle_pause' pauses or resumes
+        """
+
+        with self.lock:
+            if p_command == 'toggle':
+                p_command = 'start' if self.state == 'waiting' else 'stop'
+            elif p_command == 'toggle_pause':
+                p_command = 'resume' if self.state == 'paused' else 'pause'
+
+            next_state = TRANSITIONS[self.state].get(p_command)
+            if next_state is None:
+                return (False, self.state)
+            self.state = next_state
+            self.commands.put((p_command, p_label))
+            return (True, self.state)
+
+    def next_command(self, p_timeout=None):
+        """ Blocks until a command is queued and returns it as (command, label), or returns None after p_timeout seconds """
+
+        waited = 0.0
+        while p_timeout is None or waited < p_timeout:
+            interval = WAKE_INTERVAL if p_timeout is None else min(WAKE_INTERVAL, p_timeout - waited)
+            try:
+                return self.commands.get(timeout=interval)
+            except queue.Empty:
+                waited += interval
+        return None
+
+    def attach_hotkeys(self, p_start_button, p_stop_button, p_pause_button=None, p_mark_button=None):
+        """ Hooks the hotkeys, returns False if the keyboard hook can't be installed (ex. not running as root on Linux) """
+
+        try:
+            if p_start_button == p_stop_button:
+                self.hotkeys.append(keyboard.add_hotkey(p_start_button, self.command, args=('toggle',)))
+            else:
+                self.hotkeys.append(keyboard.add_hotkey(p_start_button, self.command, args=('start',)))
+                self.hotkeys.append(keyboard.add_hotkey(p_stop_button, self.command, args=('stop',)))
+            if p_pause_button:
+                self.hotkeys.append(keyboard.add_hotkey(p_pause_button, self.command, args=('toggle_pause',)))
+            if p_mark_button:
+                self.hotkeys.append(keyboard.add_hotkey(p_mark_button, self.command, args=('mark',)))
+        except (ImportError, OSError, ValueError) as error:
+            sys.stderr.write(f"Unable to hook the start/stop keys (in control.RecordingControl.attach_hotkeys()):  {error}\n")
+            return False
+        return True
+
+    def attach_signals(self):
+        """ Installs the signal handlers, only works from the main thread """
+
+        handlers = {'SIGUSR1': 'start', 'SIGUSR2': 'toggle_pause', 'SIGINT': 'stop', 'SIGTERM': 'stop'}
+        for name, command in handlers.items():
+            signal_number = getattr(signal, name, None)
+            if signal_number is not None:
+                self.previous_signals[signal_number] = signal.signal(signal_number, lambda p_signal, p_frame, p_command=command: self.command(p_command))
+
+    def serve(self, p_port=DEFAULT_CONTROL_PORT):
+        """ Starts answering control socket requests on p_port in a background thread """
+
+        self.server = ControlServer(p_port, self)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def detach(self):
+        """ Removes the hotkeys, restores the previous signal handlers and closes the control socket """
+
+        for x in self.hotkeys:
+            keyboard.remove_hotkey(x)
+        self.hotkeys.clear()
+        for signal_number, handler in self.previous_signals.items():
+            signal.signal(signal_number, handler)
+        self.previous_signals.clear()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    """ Localhost control socket of a RecordingControl """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, p_port, p_control):
+
+        super().__init__(('127.0.0.1', p_port), _RequestHandler)
+        self.control = p_control
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """ Handles one client connection, one JSON request per line """
+
+    def handle(self):
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request['command'] == 'status':
+                    reply = {'status': 'ok', 'state': self.server.control.state}
+                elif request['command'] not in ('start', 'stop', 'pause', 'resume', 'mark'):
+                    reply = {'status': 'error', 'message': f"unknown command {request['command']}"}
+                else:
+                    accepted, state = self.server.control.command(request['command'], request.get('label'))
+                    reply = {'status': 'ok' if accepted else 'error', 'state': state}
+                    if not accepted:
+                        reply['message'] = f"can't {request['command']} while {state}"
+            except (ValueError, KeyError) as error:
+                reply = {'status': 'error', 'message': str(error)}
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+            self.wfile.flush()
+
+
+def send_command(p_command, p_label=None, *, port=DEFAULT_CONTROL_PORT):
+    """ Sends p_command to a recording's control socket, returns the reply or None if nothing is listening on port """
+
+    try:
+        with socket.create_connection(('127.0.0.1', port)) as connection:
+            connection.sendall(json.dumps({'command': p_command, 'label': p_label}).encode() + b'\n')
+            with connection.makefile('rb') as reply:
+                return json.loads(reply.readline())
+    except ConnectionRefusedError:
+        return None
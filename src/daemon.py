@@ -0,0 +1,244 @@
+# pylint: disable=line-too-long
+""" Long running transcription service that keeps vosk models loaded between jobs """
+# Clients connect to a localhost TCP port and send one JSON object per line, each request gets one JSON line back:
+#
+#       {"action": "transcribe", "wav_path": ..., "output_path": ..., "model_path": ..., "timestamp_duration": 10, "vad_settings": null, "wait": true}
+#               Queues a transcription job, with "wait" the reply is only sent once the job has finished
+#               "vad_settings" is an optional dict of vad.SpeechGate keyword arguments, silence is skipped when it is set
+#               "output_path" can also be a list of paths, all of them are written from one recognition pass
+#       {"action": "status", "job_id": ...}
+#               Returns the state of a job ("queued", "running", "done" or "failed", or "unknown" once FINISHED_JOBS_KEPT jobs have finished after it)
+#       {"action": "stats"}
+#               Returns the queue depth and the models currently loaded
+#
+# Jobs with a missing wav file, output directory or model, or an unsupported output type, are rejected before they are queued.
+#
+# Loaded models are kept in an LRU cache with a memory budget, models that haven't been used recently are
+# dropped once loading another model would go over the budget.
+
+import os
+import sys
+import json
+import queue
+import socket
+import threading
+import itertools
+import socketserver
+import collections
+
+import transcriber
+import outputs
+
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_MEMORY_BUDGET_MB = 4096
+# Loaded models use about as much memory as their files take on disk, this is used to estimate a model's size before loading it
+MODEL_MEMORY_FACTOR = 1.0
+# States of this many finished jobs are kept for status requests, older ones are forgotten so a long running daemon doesn't keep growing
+FINISHED_JOBS_KEPT = 1000
+
+
+def estimate_model_size(p_model_path):
+    """ Returns the estimated memory (in bytes) p_model_path will use once loaded """
+
+    total = 0
+    for root, _, files in os.walk(p_model_path):
+        for x in files:
+            total += os.path.getsize(os.path.join(root, x))
+    return int(total * MODEL_MEMORY_FACTOR)
+
+
+def check_job(p_job):
+    """ Raises ValueError if p_job can't be transcribed, so a bad request never gets as far as loading a model """
+
+    if not os.path.isfile(p_job['wav_path']):
+        raise ValueError(f"wav file not found: {p_job['wav_path']}")
+    for x in [p_job['output_path']] if isinstance(p_job['output_path'], str) else p_job['output_path']:
+        if outputs.get_writer(x) is None:
+            raise ValueError(f"invalid transcription file type: .{x.split('.')[-1]}")
+        if not os.path.isdir(os.path.dirname(x) or '.'):
+            raise ValueError(f"transcription directory not found: {os.path.dirname(x)}")
+    if not os.path.isdir(p_job['model_path']):
+        raise ValueError(f"recognition model not found: {p_job['model_path']}")
+
+
+class ModelCache:
+    """ LRU cache of loaded vosk models keyed by the model directory's real path """
+
+    def __init__(self, p_memory_budget):
+
+        self.memory_budget = p_memory_budget
+        self.models = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # One lock per model directory so two workers don't load the same model at the same time
+        self.load_locks = collections.defaultdict(threading.Lock)
+
+    def get(self, p_model_path):
+        """ Returns the loaded model for p_model_path, loading it (and evicting least recently used models) if needed """
+
+        key = os.path.realpath(p_model_path)
+
+        with self.load_locks[key]:
+            with self.lock:
+                if key in self.models:
+                    self.models.move_to_end(key)
+                    return self.models[key][0]
+
+            size = estimate_model_size(key)
+            with self.lock:
+                # Evict until the new model fits, a model still in use by a running job stays alive until that job drops it
+                while self.models and sum(x[1] for x in self.models.values()) + size > self.memory_budget:
+                    evicted, _ = self.models.popitem(last=False)
+                    print(f"Evicted model {evicted}")
+
+            model = transcriber.load_model(key)
+            with self.lock:
+                self.models[key] = (model, size)
+            print(f"Loaded model {key} (~{size // 1_000_000} MB)")
+            return model
+
+    def loaded(self):
+        """ Returns {model path: estimated size in bytes} for every loaded model, least recently used first """
+
+        with self.lock:
+            return {x: y[1] for x, y in self.models.items()}
+
+
+class TranscriptionDaemon(socketserver.ThreadingTCPServer):
+    """ Accepts jobs on a localhost port and runs them on a pool of worker threads sharing one ModelCache
+        vosk releases the GIL while decoding, so worker threads decode in parallel without each loading its own model
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, p_port=DEFAULT_PORT, *, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+
+        super().__init__(('127.0.0.1', p_port), _RequestHandler)
+
+        self.cache = ModelCache(memory_budget_mb * 1_000_000)
+        self.jobs = queue.Queue(maxsize=queue_size)
+        # States of queued and running jobs and the last FINISHED_JOBS_KEPT finished ones, oldest finished first in finished_jobs
+        self.job_states = {}
+        self.finished_jobs = collections.deque()
+        # Set when the job finishes, only kept until then
+        self.job_done = {}
+        self.job_ids = itertools.count(1)
+        self.state_lock = threading.Lock()
+
+        self.workers = [threading.Thread(target=self._work, daemon=True) for x in range(workers)]
+        for x in self.workers:
+            x.start()
+
+    def submit(self, p_job):
+        """ Queues p_job, returns its job id or None if the queue is full
+            Raises ValueError if the job can't be transcribed (see check_job())
+        """
+
+        check_job(p_job)
+        with self.state_lock:
+            job_id = next(self.job_ids)
+            self.job_states[job_id] = 'queued'
+            self.job_done[job_id] = threading.Event()
+        try:
+            self.jobs.put_nowait((job_id, p_job))
+        except queue.Full:
+            with self.state_lock:
+                del self.job_states[job_id]
+                del self.job_done[job_id]
+            return None
+        return job_id
+
+    def _work(self):
+        """ Worker thread, runs queued jobs forever """
+
+        while True:
+            job_id, job = self.jobs.get()
+            with self.state_lock:
+                self.job_states[job_id] = 'running'
+
+            try:
+                model = self.cache.get(job['model_path'])
+                result = transcriber.from_wav(job['wav_path'], job['output_path'], job['model_path'], timestamp_duration=job.get('timestamp_duration', 10), model=model, vad_settings=job.get('vad_settings'))
+                state = 'done' if result == 1 else 'failed'
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                sys.stderr.write(f"Job {job_id} failed (in daemon.TranscriptionDaemon._work()):  {error}\n")
+                state = 'failed'
+
+            with self.state_lock:
+                self.job_states[job_id] = state
+                self.job_done.pop(job_id).set()
+                self.finished_jobs.append(job_id)
+                while len(self.finished_jobs) > FINISHED_JOBS_KEPT:
+                    del self.job_states[self.finished_jobs.popleft()]
+            self.jobs.task_done()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """ Handles one client connection, one JSON request per line """
+
+    def handle(self):
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                reply = self._dispatch(request)
+            except (ValueError, KeyError) as error:
+                reply = {'status': 'error', 'message': str(error)}
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+            self.wfile.flush()
+
+    def _dispatch(self, p_request):
+        """ Returns the reply for one request """
+
+        server = self.server
+        match p_request['action']:
+            case 'transcribe':
+                job = {x: p_request[x] for x in ('wav_path', 'output_path', 'model_path')}
+                job['timestamp_duration'] = int(p_request.get('timestamp_duration', 10))
+                job['vad_settings'] = p_request.get('vad_settings')
+                job_id = server.submit(job)
+                if job_id is None:
+                    return {'status': 'busy', 'message': 'job queue is full'}
+                if p_request.get('wait'):
+                    # No event means the job has already finished
+                    with server.state_lock:
+                        done = server.job_done.get(job_id)
+                    if done is not None:
+                        done.wait()
+                with server.state_lock:
+                    return {'status': server.job_states.get(job_id, 'unknown'), 'job_id': job_id}
+
+            case 'status':
+                with server.state_lock:
+                    return {'status': server.job_states.get(int(p_request['job_id']), 'unknown'), 'job_id': p_request['job_id']}
+
+            case 'stats':
+                return {'status': 'ok', 'queued': server.jobs.qsize(), 'models': server.cache.loaded()}
+
+            case _:
+                return {'status': 'error', 'message': f"unknown action {p_request['action']}"}
+
+
+def submit_job(p_wav_path, p_output_path, p_vosk_model_path, *, timestamp_duration=10, port=DEFAULT_PORT, wait=True, vad_settings=None):
+    """ Hands a transcription job to a running daemon, returns the daemon's reply or None if no daemon is listening on port
+        p_output_path can be a list of output paths, the same as transcriber.from_wav()
+        Paths are made absolute since the daemon may be running from a different directory
+    """
+
+    request = {'action': 'transcribe',
+               'wav_path': os.path.abspath(p_wav_path),
+               'output_path': os.path.abspath(p_output_path) if isinstance(p_output_path, str) else [os.path.abspath(x) for x in p_output_path],
+               'model_path': os.path.abspath(p_vosk_model_path),
+               'timestamp_duration': timestamp_duration,
+               'vad_settings': vad_settings,
+               'wait': wait}
+
+    try:
+        with socket.create_connection(('127.0.0.1', port)) as connection:
+            connection.sendall(json.dumps(request).encode() + b'\n')
+            with connection.makefile('rb') as reply:
+                return json.loads(reply.readline())
+    except ConnectionRefusedError:
+        return None
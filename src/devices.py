@@ -0,0 +1,92 @@
+# pylint: disable=line-too-long
+""" Input device enumeration with an on-disk cache, so device selection asks PortAudio about each device once instead of once per search """
+# The cache is keyed by a fingerprint of the host APIs (their names, device counts and default inputs) and the total
+# device count, which only takes one call per host API. Plugging in or removing a device changes the fingerprint and
+# the devices are enumerated again.
+#
+# Swapping a device for another of the same kind (ex. one USB mic for another) leaves the fingerprint as it was, so the
+# devices picked from the cache are checked against PortAudio with is_current() before they are used.
+
+import os
+import json
+
+DEVICE_CACHE_FILENAME = 'device_cache.json'
+
+
+def _fingerprint(p_audio):
+    """ Cheap summary of the devices p_audio (a pyaudio.PyAudio) sees, changes whenever a device is added or removed """
+
+    host_apis = [p_audio.get_host_api_info_by_index(x) for x in range(p_audio.get_host_api_count())]
+    return [p_audio.get_device_count()] + [[x['name'], x['deviceCount'], x['defaultInputDevice']] for x in host_apis]
+
+
+def list_input_devices(p_audio, p_cache_path=DEVICE_CACHE_FILENAME, *, refresh=False):
+    """ Returns a list of {'index', 'name', 'backend', 'channels', 'rate'} dicts for every input device p_audio sees
+        The list is read from p_cache_path if the devices haven't changed since it was written, p_cache_path of None skips the cache
+        refresh=True enumerates the devices again and rewrites the cache even if the fingerprint hasn't changed
+    """
+
+    fingerprint = _fingerprint(p_audio)
+    if p_cache_path is not None and not refresh and os.path.exists(p_cache_path):
+        try:
+            with open(p_cache_path, 'rt') as cache_file:
+                cache = json.load(cache_file)
+            if cache['fingerprint'] == fingerprint:
+                return cache['devices']
+        except (ValueError, KeyError, OSError):
+            # A damaged cache is just rebuilt
+            pass
+
+    backends = {}
+    devices = []
+    for x in range(p_audio.get_device_count()):
+        b = p_audio.get_device_info_by_index(x)
+        if b['maxInputChannels'] <= 0:
+            continue
+        if b['hostApi'] not in backends:
+            backends[b['hostApi']] = p_audio.get_host_api_info_by_index(b['hostApi'])['name']
+        devices.append({'index': b['index'],
+                        'name': b['name'],
+                        'backend': backends[b['hostApi']],
+                        'channels': b['maxInputChannels'],
+                        'rate': int(b['defaultSampleRate'])})
+
+    if p_cache_path is not None:
+        try:
+            with open(p_cache_path, 'wt') as cache_file:
+                json.dump({'fingerprint': fingerprint, 'devices': devices}, cache_file, indent=4)
+        except OSError:
+            pass
+    return devices
+
+
+def find_device(p_devices, p_name_includes, p_backend, p_exclude=()):
+    """ Returns the first device in p_devices with p_name_includes in its name (case insensitive) on exactly the p_backend audio backend, that isn't in p_exclude (device indices), or None """
+
+    for x in p_devices:
+        if x['index'] not in p_exclude \
+          and p_name_includes.upper() in x['name'].upper() \
+          and x['backend'].upper() == p_backend.upper():
+            return x
+    return None
+
+
+def find_devices(p_devices, p_searches):
+    """ Returns the device (or None) for each (name includes, backend) search in p_searches, the first match a previous search hasn't already taken (see find_device()) """
+
+    found = []
+    for name_includes, backend in p_searches:
+        found.append(find_device(p_devices, name_includes, backend, [x['index'] for x in found if x is not None]))
+    return found
+
+
+def is_current(p_audio, p_device):
+    """ Returns True if PortAudio still has p_device (from list_input_devices()) at its index """
+
+    try:
+        b = p_audio.get_device_info_by_index(p_device['index'])
+        backend = p_audio.get_host_api_info_by_index(b['hostApi'])['name']
+    except (OSError, ValueError):
+        # pyaudio raises OSError (IOError) for an index that no longer exists
+        return False
+    return b['name'] == p_device['name'] and backend == p_device['backend'] and b['maxInputChannels'] == p_device['channels'] and int(b['defaultSampleRate']) == p_device['rate']
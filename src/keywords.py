@@ -0,0 +1,112 @@
+# pylint: disable=line-too-long
+""" Keyword spotting, finds when phrases from a list were said without transcribing everything else """
+# The recognizer is given a grammar of just the phrases plus UNKNOWN, so it only has to choose between a handful of
+# words instead of the model's whole vocabulary, which decodes several times faster than a full transcription.
+# Everything that isn't one of the phrases comes out as UNKNOWN and is dropped.
+#
+# Word times from the recognizer count the audio it was given. Audio that was skipped (ex. silence skipped by the VAD)
+# is recorded with skip() so hit times are still relative to the start of the recording.
+
+import os
+import json
+import bisect
+
+UNKNOWN = '[unk]'
+# Hits the recognizer is less sure of than this (0 to 1, the lowest confidence of the phrase's words) are dropped
+MIN_CONFIDENCE = 0.5
+
+
+def normalize(p_phrase):
+    """ Lowercase words of p_phrase separated by single spaces, the form the recognizer gives words back in """
+
+    return ' '.join(p_phrase.lower().split())
+
+
+def load_phrases(p_source):
+    """ Returns the phrases in p_source, either a file with one phrase per line (blank lines and # comments are skipped) or a comma separated list of phrases """
+
+    if os.path.isfile(p_source):
+        with open(p_source, 'rt') as phrase_file:
+            phrases = [x.strip() for x in phrase_file if not x.strip().startswith('#')]
+    else:
+        phrases = p_source.split(',')
+    # Duplicates (ex. different capitalization) are only searched for once
+    return list(dict.fromkeys(normalize(x) for x in phrases if normalize(x)))
+
+
+def grammar(p_phrases):
+    """ The grammar (JSON list of phrases) to make a vosk.KaldiRecognizer with so it only recognizes p_phrases """
+
+    return json.dumps([normalize(x) for x in p_phrases] + [UNKNOWN])
+
+
+class Spotter:
+    """ Finds the phrases in p_phrases in the audio (16 bit mono at p_sample_rate) fed to p_recognizer
+        p_recognizer has to have been made with grammar(p_phrases) (see transcriber._make_recognizer())
+        Hits are (phrase, start seconds, end seconds, confidence) tuples, times count from the first audio fed or skipped
+    """
+
+    def __init__(self, p_recognizer, p_phrases, p_sample_rate, *, min_confidence=MIN_CONFIDENCE):
+
+        self.recognizer = p_recognizer
+        # Word times and confidences are only in the results with SetWords
+        self.recognizer.SetWords(True)
+        # Longest phrases are matched first so 'action item' wins over 'action'
+        self.phrases = sorted({tuple(normalize(x).split()) for x in p_phrases}, key=len, reverse=True)
+        self.bytes_per_second = p_sample_rate * 2
+        self.min_confidence = min_confidence
+        self.hits = 0
+
+        # Seconds of audio given to the recognizer, and (given seconds, skipped seconds so far) at each skip
+        self.accepted_seconds = 0.0
+        self.skip_points = []
+        self.skip_totals = []
+
+    def feed(self, p_data):
+        """ Decodes p_data (anything vosk's AcceptWaveform() takes), returns the hits in the utterances it finished """
+
+        self.accepted_seconds += len(p_data) / self.bytes_per_second
+        if self.recognizer.AcceptWaveform(p_data):
+            return self._hits(self.recognizer.Result())
+        return []
+
+    def skip(self, p_num_samples):
+        """ Moves the hit times of everything fed after this along by p_num_samples samples that weren't fed """
+
+        total = (self.skip_totals[-1] if self.skip_totals else 0.0) + p_num_samples * 2 / self.bytes_per_second
+        if self.skip_points and self.skip_points[-1] == self.accepted_seconds:
+            self.skip_totals[-1] = total
+        else:
+            self.skip_points.append(self.accepted_seconds)
+            self.skip_totals.append(total)
+
+    def finish(self):
+        """ Returns the hits in whatever was fed since the last finished utterance """
+
+        return self._hits(self.recognizer.FinalResult())
+
+    def _recording_seconds(self, p_seconds):
+        """ Turns a time in the audio given to the recognizer into a time in the recording """
+
+        index = bisect.bisect_right(self.skip_points, p_seconds)
+        return p_seconds + (self.skip_totals[index - 1] if index else 0.0)
+
+    def _hits(self, p_result):
+
+        found = json.loads(p_result).get('result', [])
+        found_words = [x['word'] for x in found]
+        hits = []
+        x = 0
+        while x < len(found):
+            for phrase in self.phrases:
+                if tuple(found_words[x:x + len(phrase)]) == phrase:
+                    phrase_words = found[x:x + len(phrase)]
+                    confidence = min(y['conf'] for y in phrase_words)
+                    if confidence >= self.min_confidence:
+                        hits.append((' '.join(phrase), self._recording_seconds(phrase_words[0]['start']), self._recording_seconds(phrase_words[-1]['end']), confidence))
+                    x += len(phrase)
+                    break
+            else:
+                x += 1
+        self.hits += len(hits)
+        return hits
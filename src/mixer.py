@@ -0,0 +1,144 @@
+# pylint: disable=line-too-long
+""" N-way mixer for prepare_audio(), downmixes, gains, mixes and limits inputs into 16 bit audio without allocating per frame """
+# Every buffer (the per input downmix buffers, the accumulator and the int16 output) is allocated once and only
+# reallocated when a longer block than any before it comes in, so after the first few blocks mixing allocates nothing.
+#
+# Gains are fixed point (GAIN_BITS fractional bits) so the accumulator stays integer. It is int32 unless the inputs
+# and their gains could add up past the int32 range, then int64. With every gain at 1 the inputs are just added up and
+# the mix is exactly the old average of the inputs (sum // number of inputs).
+#
+# Averaging, clipping and the soft limiter are one lookup table: samples below LIMITER_THRESHOLD of full scale pass
+# through untouched, louder ones are bent smoothly (tanh) towards full scale instead of being clipped flat.
+
+import numpy
+
+# Fractional bits of the fixed point gains, 1 / 256 steps
+GAIN_BITS = 8
+# Fraction of full scale the soft limiter starts bending at
+LIMITER_THRESHOLD = 0.9
+# Mixed samples beyond this many times full scale are clipped before the lookup, the limiter is at full scale long before then
+LIMITER_RANGE = 4
+# Largest input sample the accumulator has to hold, resampler overshoot can take a full scale input a bit past 16 bits
+INPUT_PEAK = 2 * 32768
+
+_limiter_tables = {}
+
+
+def get_limiter_table(p_threshold=LIMITER_THRESHOLD):
+    """ Returns the int16 lookup table that limits mixed samples into 16 bits, indexed by sample + LIMITER_RANGE * 32768
+        p_threshold of None gives a table that hard clips instead
+    """
+
+    if p_threshold in _limiter_tables:
+        return _limiter_tables[p_threshold]
+
+    samples = numpy.arange(-LIMITER_RANGE * 32768, LIMITER_RANGE * 32768 + 1, dtype=numpy.float64)
+    if p_threshold is None:
+        table = samples
+    else:
+        knee = int(p_threshold * 32767)
+        magnitude = numpy.abs(samples)
+        # Past the knee the remaining headroom is filled in a tanh curve, it reaches full scale without a corner
+        bent = knee + (32767 - knee) * numpy.tanh((magnitude - knee) / max(1, 32767 - knee))
+        table = numpy.rint(numpy.sign(samples) * numpy.where(magnitude > knee, bent, magnitude))
+    table = numpy.clip(table, -32768, 32767).astype(numpy.int16)
+
+    _limiter_tables[p_threshold] = table
+    return table
+
+
+def _grow(p_buffer, p_length, p_dtype):
+    """ Returns p_buffer if it holds p_length samples, otherwise a new buffer of at least twice its size """
+
+    if p_buffer is not None and len(p_buffer) >= p_length:
+        return p_buffer
+    return numpy.empty(max(p_length, 2 * (len(p_buffer) if p_buffer is not None else 0)), dtype=p_dtype)
+
+
+class Mixer:
+    """ Mixes p_num_sources inputs into one 16 bit mono stream
+        gains is one gain per input (default 1 for all of them), applied before the inputs are averaged
+        limit=False hard clips the mix to 16 bits instead of soft limiting it (see LIMITER_THRESHOLD)
+        Arrays returned by downmix() and mix() are views of reused buffers, they are only good until the next call
+    """
+
+    def __init__(self, p_num_sources, *, gains=None, limit=True, limiter_threshold=LIMITER_THRESHOLD):
+
+        self.num_sources = p_num_sources
+        if gains is not None and len(gains) != p_num_sources:
+            raise ValueError(f"{len(gains)} gains given for {p_num_sources} inputs")
+
+        if gains is None or all(x == 1 for x in gains):
+            # Unity gains skip the multiplies, the inputs are only added up
+            self.gains = None
+            self.divisor = p_num_sources
+            largest_sum = p_num_sources * INPUT_PEAK
+        else:
+            self.gains = [round(x * (1 << GAIN_BITS)) for x in gains]
+            self.divisor = p_num_sources << GAIN_BITS
+            largest_sum = sum(abs(x) for x in self.gains) * INPUT_PEAK
+        # Floor division by a power of 2 is a shift
+        self.shift = self.divisor.bit_length() - 1 if self.divisor & (self.divisor - 1) == 0 else None
+
+        # The table's offset is added to the first input before dividing, so the division lands straight on table indices
+        self.table = get_limiter_table(limiter_threshold if limit else None)
+        self.bias = self.divisor * LIMITER_RANGE * 32768
+        self.dtype = numpy.int32 if largest_sum + self.bias < 2**31 else numpy.int64
+
+        self.downmix_buffers = [None] * p_num_sources
+        self.accumulator = None
+        self.scratch = None
+        self.output = None
+
+    def downmix(self, p_index, p_interleaved, p_channels):
+        """ Averages the channels of input p_index's interleaved int16 frames into mono int32 samples """
+
+        num_frames = len(p_interleaved) // p_channels
+        self.downmix_buffers[p_index] = _grow(self.downmix_buffers[p_index], num_frames, numpy.int32)
+        out = self.downmix_buffers[p_index][:num_frames]
+
+        if p_channels == 1:
+            numpy.copyto(out, p_interleaved[:num_frames])
+            return out
+
+        # Each column of the reshaped frames is one channel, adding whole columns is much faster than summing along the rows
+        frames = p_interleaved[:num_frames * p_channels].reshape(num_frames, p_channels)
+        numpy.add(frames[:, 0], frames[:, 1], out=out, dtype=numpy.int32)
+        for x in range(2, p_channels):
+            numpy.add(out, frames[:, x], out=out)
+        if p_channels & (p_channels - 1) == 0:
+            numpy.right_shift(out, p_channels.bit_length() - 1, out=out)
+        else:
+            numpy.floor_divide(out, p_channels, out=out)
+        return out
+
+    def mix(self, p_frame):
+        """ Mixes p_frame (one equal-length int32 array per input, ex. from aligner.Aligner.frames()) and returns the int16 mix """
+
+        length = len(p_frame[0])
+        self.accumulator = _grow(self.accumulator, length, self.dtype)
+        self.output = _grow(self.output, length, numpy.int16)
+        accumulator = self.accumulator[:length]
+        output = self.output[:length]
+
+        if self.gains is None:
+            numpy.add(p_frame[0], self.bias, out=accumulator, dtype=self.dtype)
+            for x in p_frame[1:]:
+                numpy.add(accumulator, x, out=accumulator)
+        else:
+            self.scratch = _grow(self.scratch, length, self.dtype)
+            scratch = self.scratch[:length]
+            # dtype makes the multiply itself happen in the accumulator's type, not just its result
+            numpy.multiply(p_frame[0], self.gains[0], out=accumulator, dtype=self.dtype)
+            numpy.add(accumulator, self.bias, out=accumulator)
+            for x, gain in zip(p_frame[1:], self.gains[1:]):
+                numpy.multiply(x, gain, out=scratch, dtype=self.dtype)
+                numpy.add(accumulator, scratch, out=accumulator)
+
+        if self.shift is not None:
+            numpy.right_shift(accumulator, self.shift, out=accumulator)
+        else:
+            numpy.floor_divide(accumulator, self.divisor, out=accumulator)
+        # mode='clip' clamps indices past either end of the table, which is the rest of the clipping
+        numpy.take(self.table, accumulator, out=output, mode='clip')
+        return output
@@ -1,109 +1,199 @@
 # pylint: disable=line-too-long
 """ Python Script to convert a timestamp and associated string into a log for a txt, json, srt, or vtt file """
-# To add output support to a new file type, write a function with the 
-# following parameters, then add the filetype and the function name 
+# To add output support to a new file type, write a subclass of TranscriptWriter that
+# overrides the following methods, then add the filetype and the class name
 # into type_outputs dict at the bottom of this file.:
-#      
-#       p_file_pointer: An open file object (file pointer)
-#       p_timestamp: The timestamp for the transcribed text (datetime.datetime)
-#       p_rel_timestamp: The timestamp to write (timestamp (from python's datetime module))
-#       p_duration: The duration (in seconds) of the transcription window (int)
-#       p_text: The text to write (string)
-#       header_string: A string of header information to write on first write to the file
-#       footer_string: A string of footer information to write on final write to the file
 #
-#       static_count can be used if you need an incrementing count included in your writes.
-#       
-# You can implement behavior for only the first write and final write by checking if
-# p_header_string or p_footer_string are anything other than False
+#       _header(self): Returns the string written once at the start of the file
+#                      (self.metadata holds 'audio_file_name' (string) and 'creation_timestamp' (datetime.datetime))
+#       _entry(self, p_timestamp, p_rel_timestamp, p_duration, p_text, p_source, p_confidence): Returns the string for one transcription window
+#                      p_timestamp: The timestamp for the transcribed text (datetime.datetime)
+#                      p_rel_timestamp: The time since the start of the recording (datetime.datetime counting from 1/1/1)
+#                      p_duration: The duration (in seconds) of the transcription window (int, or float for a keyword hit)
+#                      p_text: The text to write (string)
+#                      p_source: Label of the input the text was heard on (ex. 'Local' or 'Remote'), None when the inputs were mixed together
+#                      p_confidence: How sure the recognizer is of a keyword hit (0 to 1), None for transcription windows
+#       _footer(self): Returns the string written once at the end of the file
+#
+#       _entry() is abstract, _header() and _footer() default to writing nothing
+#
+#       self.metadata has 'keywords' (list of phrases) when the entries are keyword hits (see keywords.py) instead of windows
+#
+#       self.count can be used if you need an incrementing count included in your writes, it is
+#       incremented before each _entry() call. Subclasses need an empty __slots__ unless they add attributes.
+#
+# Entries are buffered and written to the file in batches, call flush() to write them out right away.
+# Entries are only ever added to the end of the file (the footer aside), so a file cut back to the end of any entry
+# can be carried on with resume().
 #
 
+import abc
 import json
 import datetime
 
-static_count = 0
+# Number of entries buffered before they are written to the file
+FLUSH_ENTRIES = 64
 
 
-def to_txt(p_file_pointer, p_timestamp, p_rel_timestamp, p_duration, p_text_string, *, header_string = False, footer_string = False):
-    """ Convert a timestamp and associated string into a log for a txt file """
+def _hms(p_datetime):
+    """ HH:MM:SS of p_datetime without going through strftime """
 
-    if header_string:
-        p_file_pointer.write(header_string + "\n------------------------------------------------------\n")
+    return f"{p_datetime.hour:02}:{p_datetime.minute:02}:{p_datetime.second:02}"
 
-    if footer_string:
-        return
 
-    timestamp_string = f"\n{p_timestamp.strftime("%H:%M:%S")}, {p_rel_timestamp.strftime("%H:%M:%S")} - "
-    p_file_pointer.write(timestamp_string)
-    p_file_pointer.write(p_text_string)
-    p_file_pointer.write('\n')
+def _ms(p_datetime):
+    """ Milliseconds part of p_datetime, always 000 for transcription windows """
 
+    return f"{p_datetime.microsecond // 1000:03}"
 
-def to_json(p_file_pointer, p_timestamp, p_rel_timestamp, p_duration, p_text_string, *, header_string = False, footer_string = False):
-    """ Convert a timestamp and associated string into a log for a json file """
 
-    if header_string:
-        p_file_pointer.write('[\n')
-        split_header = header_string.split(' ')
-        audio_file_name = split_header[2][:-1]
-        creation_timestamp = f'{split_header [-2]} {split_header [-1][:-1]}'
-        json.dump({\
-            'audio_file_name':audio_file_name, \
-            'creation_timestamp':creation_timestamp}, \
-            p_file_pointer)
-
-    elif footer_string:
-        p_file_pointer.write('\n]')
-        return
-    
-    p_file_pointer.write(',\n')
-    json.dump({\
-        'time_stamp':p_timestamp.strftime("%D %H:%M:%S"), \
-        'rel_timestamp':p_rel_timestamp.strftime("%H:%M:%S"), \
-        'duration':p_duration, \
-        'text':p_text_string}, \
-        p_file_pointer, indent=4)
-    
-
-
-def to_srt(p_file_pointer, p_timestamp, p_rel_timestamp, p_duration, p_text_string, *, header_string = False, footer_string = False):
-    """ Convert a timestamp and associated string into a log for a srt file """
+def _mdy_hms(p_datetime):
+    """ MM/DD/YY HH:MM:SS (strftime's "%D %H:%M:%S") of p_datetime """
+
+    return f"{p_datetime.month:02}/{p_datetime.day:02}/{p_datetime.year % 100:02} {_hms(p_datetime)}"
+
+
+class TranscriptWriter(abc.ABC):
+    """ Base class for transcription output writers, one instance per output file """
+
+    __slots__ = ('file_pointer', 'metadata', 'count', 'buffer')
+
+    def __init__(self, p_file_pointer, p_metadata):
+
+        self.file_pointer = p_file_pointer
+        self.metadata = p_metadata
+        self.count = 0
+        self.buffer = [self._header()]
+
+    def write(self, p_timestamp, p_rel_timestamp, p_duration, p_text, p_source=None, p_confidence=None):
+        """ Adds one transcription window to the output, labelled with p_source if the inputs were transcribed separately
+            Keyword hits pass the phrase as p_text and the recognizer's confidence in it as p_confidence
+        """
+
+        self.count += 1
+        self.buffer.append(self._entry(p_timestamp, p_rel_timestamp, p_duration, p_text, p_source, p_confidence))
+        if len(self.buffer) >= FLUSH_ENTRIES:
+            self.flush()
+
+    def flush(self):
+        """ Writes the buffered entries to the file """
+
+        self.file_pointer.write(''.join(self.buffer))
+        self.file_pointer.flush()
+        self.buffer.clear()
+
+    def resume(self, p_count):
+        """ Carries on a file that already has its header and p_count entries (ex. after an interrupted transcription), the header isn't written again """
 
-    global static_count
+        self.count = p_count
+        self.buffer.clear()
 
-    static_count += 1
+    def finish(self):
+        """ Writes the footer and everything still buffered, the file itself is closed by whoever opened it """
 
-    if header_string:
-        p_file_pointer.write("\n\n")
+        self.buffer.append(self._footer())
+        self.flush()
 
-    elif footer_string:
-        return
+    def header_string(self):
+        """ The one line description of the transcription used by the txt and vtt headers """
 
-    p_file_pointer.write(f"{str(static_count)}\n")
-    end_timestamp = p_rel_timestamp + datetime.timedelta(seconds=p_duration)
-    p_file_pointer.write(f"{p_rel_timestamp.strftime("%H:%M:%S")},000 --> {end_timestamp.strftime("%H:%M:%S")},000\n")
-    p_file_pointer.write(f"{p_text_string}")
-    
+        if 'keywords' in self.metadata:
+            return f"Keyword hits ({', '.join(self.metadata['keywords'])}) in {self.metadata['audio_file_name']}. Created on {_mdy_hms(self.metadata['creation_timestamp'])}."
+        return f"Transcription of {self.metadata['audio_file_name']}. Created on {_mdy_hms(self.metadata['creation_timestamp'])}."
 
+    def _header(self):
+        return ''
 
-def to_vtt(p_file_pointer, p_timestamp, p_rel_timestamp, p_duration, p_text_string, *, header_string = False, footer_string = False):
+    @abc.abstractmethod
+    def _entry(self, p_timestamp, p_rel_timestamp, p_duration, p_text, p_source, p_confidence):
+        """ Every writer has to override this one, a subclass without it can't be constructed """
+
+    def _footer(self):
+        return ''
+
+
+class TxtWriter(TranscriptWriter):
+    """ Convert a timestamp and associated string into a log for a txt file """
+
+    __slots__ = ()
+
+    def _header(self):
+        return self.header_string() + "\n------------------------------------------------------\n"
+
+    def _entry(self, p_timestamp, p_rel_timestamp, p_duration, p_text, p_source, p_confidence):
+        if p_confidence is not None:
+            p_text = f"{p_text} ({p_confidence:.0%})"
+        if p_source is not None:
+            return f"\n{_hms(p_timestamp)}, {_hms(p_rel_timestamp)} - {p_source}: {p_text}\n"
+        return f"\n{_hms(p_timestamp)}, {_hms(p_rel_timestamp)} - {p_text}\n"
+
+
+class JsonWriter(TranscriptWriter):
+    """ Convert a timestamp and associated string into a log for a json file """
+
+    __slots__ = ()
+
+    def _header(self):
+        header = {
+            'audio_file_name':self.metadata['audio_file_name'],
+            'creation_timestamp':_mdy_hms(self.metadata['creation_timestamp'])}
+        if 'keywords' in self.metadata:
+            header['keywords'] = self.metadata['keywords']
+        return '[\n' + json.dumps(header)
+
+    def _entry(self, p_timestamp, p_rel_timestamp, p_duration, p_text, p_source, p_confidence):
+        entry = {
+            'time_stamp':_mdy_hms(p_timestamp),
+            'rel_timestamp':_hms(p_rel_timestamp),
+            'duration':p_duration,
+            'text':p_text}
+        if p_source is not None:
+            entry['source'] = p_source
+        if p_confidence is not None:
+            entry['confidence'] = round(p_confidence, 3)
+        return ',\n' + json.dumps(entry, indent=4)
+
+    def _footer(self):
+        return '\n]'
+
+
+class SrtWriter(TranscriptWriter):
+    """ Convert a timestamp and associated string into a log for a srt file """
+
+    __slots__ = ()
+
+    def _entry(self, p_timestamp, p_rel_timestamp, p_duration, p_text, p_source, p_confidence):
+        end_timestamp = p_rel_timestamp + datetime.timedelta(seconds=p_duration)
+        if p_confidence is not None:
+            p_text = f"{p_text} ({p_confidence:.0%})"
+        if p_source is not None:
+            p_text = f"{p_source}: {p_text}"
+        return f"{self.count}\n{_hms(p_rel_timestamp)},{_ms(p_rel_timestamp)} --> {_hms(end_timestamp)},{_ms(end_timestamp)}\n{p_text}\n\n"
+
+
+class VttWriter(TranscriptWriter):
     """ Convert a timestamp and associated string into a log for a vtt file """
 
-    global static_count
+    __slots__ = ()
+
+    def _header(self):
+        return f"WEBVTT - {self.header_string()}"
 
-    static_count += 1
+    def _entry(self, p_timestamp, p_rel_timestamp, p_duration, p_text, p_source, p_confidence):
+        end_timestamp = p_rel_timestamp + datetime.timedelta(seconds=p_duration)
+        if p_confidence is not None:
+            p_text = f"{p_text} ({p_confidence:.0%})"
+        if p_source is not None:
+            # WebVTT voice span, players show it as the speaker
+            p_text = f"<v {p_source}>{p_text}"
+        return f"\n\n{_hms(p_rel_timestamp)}.{_ms(p_rel_timestamp)} --> {_hms(end_timestamp)}.{_ms(end_timestamp)}\n{p_text}"
 
-    if header_string:
-        p_file_pointer.write(f"WEBVTT - {header_string}")
 
-    elif footer_string:
-        return
+def get_writer(p_output_path):
+    """ Returns the writer class for p_output_path's file type, or None if the file type isn't supported """
 
-    p_file_pointer.write("\n\n")
-    end_timestamp = p_rel_timestamp + datetime.timedelta(seconds=p_duration)
-    p_file_pointer.write(f"{p_rel_timestamp.strftime("%H:%M:%S")}.000 --> {end_timestamp.strftime("%H:%M:%S")}.000\n")
-    p_file_pointer.write(f"{p_text_string}")
+    return type_outputs.get(p_output_path.split('.')[-1])
 
 
-# Link file types to output functions here
-type_outputs = {'txt':to_txt, 'json':to_json, 'srt':to_srt, 'vtt':to_vtt}
+# Link file types to output writers here
+type_outputs = {'txt':TxtWriter, 'json':JsonWriter, 'srt':SrtWriter, 'vtt':VttWriter}
@@ -2,147 +2,319 @@
 """ Records audio from input device pyaudio indices passed via p_device_list and prepares the audio for use with vosk and kaldi at a later point """
 # If stereo mix is too quiet or microphone in is too loud, volume mixing can be done in Windows microphone settings (I suspect the other os as well but not sure, this note is mostly intended for me)
 
+import os
+import sys
+import json
+import time
 import wave
+import datetime
+import contextlib
 import multiprocessing
 
 import pyaudio
-import keyboard
 import numpy
 
+import transcriber
+import outputs
+import resampler
+import ring_buffer
+import capture
+import aligner
+import vad
+import telemetry
+import control
+import segments
+import mixer
+
 CHUNK_SIZE = 1024
+# Each device's ring buffer holds RING_CHUNKS chunks (about 5 seconds at 48khz) before the capture callback starts dropping audio
+RING_CHUNKS = 256
+# Seconds prepare_audio() sleeps when none of the ring buffers have new frames
+RING_POLL_INTERVAL = 0.005
+# Marks are written to the recording's file name (without .wav) + MARKS_SUFFIX
+MARKS_SUFFIX = '_marks.jsonl'
+
+def _open_recording_file(p_file_name, p_segment_seconds=None):
+    """ Opens the 16 kHz mono recording p_file_name for writing, as one wav file or (if p_segment_seconds is passed) as a segmented recording (see segments.py) """
+
+    if p_segment_seconds:
+        return segments.SegmentWriter(p_file_name, p_segment_seconds)
+
+    file_pointer = wave.open(p_file_name, 'wb')
+    file_pointer.setnchannels(1)
+    file_pointer.setsampwidth(2)
+    file_pointer.setframerate(16000)
+    return file_pointer
+
 
-def prepare_audio(p_file_name, p_pipe_in, p_num_inputs):
-    """ Prepares incoming (via p_pipe_in) audio inputs for vosk in real time. 
+def prepare_audio(p_file_name, p_ring_names, p_pipe_out=None, p_vad_settings=None, p_segment_seconds=None, p_source_files=None, p_gains=None):
+    """ Prepares incoming (via the shared memory ring buffers named in p_ring_names) audio inputs for vosk in real time. 
         Does the following:
-            1)  Mix multiple audio inputs into one stream (number of inputs passed as p_num_inputs)
+            1)  Mix multiple audio inputs into one stream (one ring buffer per input), each input scaled by its gain in p_gains (default 1 for all) and soft limited (see mixer.py)
             2)  Converts stereo audio into mono (optional, will happen if p_to_mono is True)
-            3)  Write processed audio stream to a wav file (name of the file determined by p_file_name)
+            3)  Write processed audio stream to a wav file (name of the file determined by p_file_name), or a new segment file every p_segment_seconds seconds
+            4)  Forward the written 16 kHz mono frames to a live transcriber (optional, will happen if p_pipe_out is passed)
+                If p_vad_settings is a dict (of vad.SpeechGate keyword arguments) only frames with speech are forwarded, the rest are sent as a count of skipped samples
+            5)  Write each input's own 16 kHz mono audio (before mixing) to its own wav file (optional, will happen if p_source_files lists one file name per ring buffer)
     """
 
-    with wave.open(p_file_name, 'wb') as file_pointer:
-        
-        file_pointer.setnchannels(1)
-        file_pointer.setsampwidth(2)
-        file_pointer.setframerate(16000)
+    rings = [ring_buffer.RingBuffer.attach(x) for x in p_ring_names]
+    gate = vad.SpeechGate(16000, **p_vad_settings) if p_pipe_out is not None and p_vad_settings is not None else None
+    # Set to None if the live transcriber goes away, the recording carries on without it
+    live_pipe = p_pipe_out
 
-        mixed_data = numpy.ndarray((1,), dtype=numpy.int32)
+    with _open_recording_file(p_file_name, p_segment_seconds) as file_pointer, contextlib.ExitStack() as source_stack:
 
-        while p_pipe_in.poll(2):
-            # in_data format is (input_data (iterable), sample_rate)
-            in_data = p_pipe_in.recv()
-            # print(f"p_pipe_in == {in_data[0]}")
-            match in_data[0][0]:
-                case -5:
-                    # End of recording case
-                    break
+        source_pointers = [source_stack.enter_context(_open_recording_file(x)) for x in p_source_files or ()]
 
-                case -6:
-                    # End transmission of audio streams for a time instance (stop mixing and write)
-                    mixed_data = mixed_data // p_num_inputs
-                    
-                    # Clipping values down into the valid 16 bit int range and casting from int16 to bytes
-                    mixed_data = numpy.clip(mixed_data, -32768, 32767).astype(numpy.int16)
-                    file_pointer.writeframes(mixed_data.tobytes())
+        # Each device gets its own resampler so the filter state carries over between its chunks
+        # The aligner holds each device's resampled audio until it can be handed out as equal-length frames, compensating for devices starting at different times and clock drift
+        resamplers = [resampler.Resampler(x.sample_rate) for x in rings]
+        frame_aligner = aligner.Aligner(len(rings))
+        # The mixer reuses its buffers block after block, what it returns has to be used up (or copied) before its next call
+        audio_mixer = mixer.Mixer(len(rings), gains=p_gains)
 
-                    # Reset variables
-                    mixed_data = numpy.ndarray((1,), dtype=numpy.int32)
+        read_timer = telemetry.stage('prepare.read')
+        resample_timer = telemetry.stage('prepare.resample')
+        mix_timer = telemetry.stage('prepare.mix')
+        write_timer = telemetry.stage('prepare.write')
+        send_timer = telemetry.stage('prepare.send')
 
-                case _:
-                    # Take avg of each value in input streams to mix together (dividing happens in case -6)
+        # Keep reading until every device's writer has closed and everything it wrote has been read
+        finished = not rings
+        while not finished:
 
-                    # Casting to larger int size to avoid value overflow when adding
-                    working_data = numpy.frombuffer(in_data[0], dtype=numpy.int16).astype(numpy.int32)
+            # Checked before reading so frames published right before closing are still read
+            finished = all(x.header[ring_buffer.HEADER_CLOSED] for x in rings)
+            received = False
+
+            for x, ring in enumerate(rings):
+                num_frames = ring.available()
+                if num_frames == 0:
+                    continue
+                received = True
+                # Frames waiting in the ring, this growing means prepare_audio() is falling behind the capture callbacks
+                telemetry.gauge(f"prepare.backlog_seconds.{x}", num_frames / ring.sample_rate)
+
+                with read_timer:
+                    # in_data is a view straight into shared memory, the downmix into the mixer's int32 buffer for this device is the first copy made
+                    in_data = ring.peek(num_frames)
 
                     # Avg the different channels to monotize multi-channel audio (this accomodates simultaneous mono and stereo recording)
-                    temp = working_data[0::in_data[2]]
-                    for x in range(1,in_data[2]):
-                        temp = temp + working_data[x::in_data[2]]
-                    working_data = temp // in_data[2]
-
-                    # Decimate signal down to 16000 sample rate (this works well for 48khz devices and does pretty good for 41khz, anything divisable by 16khz is good)
-                    # Intentionally left downsample_factor as a float for use with numpy.arange
-                    downsample_factor = in_data[1] / 16000
-                    # If downsample_factor does not have a decimal
-                    # Then use python iterable slice format
-                    # Else use a for loop with numpy.arange() to get something close enough to 16khz be workable
-                    if downsample_factor % 1 == 0:
-                        working_data = working_data[0::int(downsample_factor)]
-                    else:
-                        temp = numpy.ndarray((1,), dtype=numpy.int32)
-                        for x in numpy.arange(0, len(working_data), downsample_factor):
-                            temp = numpy.append(temp, working_data[int(x)])
-                        working_data = temp
-
-                    # Add processed data to mixed_data pool for writing to file
-                    mixed_data = mixed_data + working_data
-
-                    # print(f"len of mixed_data:\t{len(mixed_data)}")
-
-
-def record(p_save_location, p_device_list=(), *, start_button='`', stop_button='`'):
-    """ Records audio to file at p_save_location """
-
-    audio = pyaudio.PyAudio()
-
-    streams = {}
-    devices = {}
-
-    # Setup device dict
-    for x in p_device_list:
-        device = audio.get_device_info_by_index(x)
-        streams[x] = audio.open(format=pyaudio.paInt16,
-                                channels=device['maxInputChannels'],
-                                rate=int(device['defaultSampleRate']),
-                                input=True,
-                                input_device_index=x,
-                                frames_per_buffer=CHUNK_SIZE,
-                                )
-        devices[x] = device
-
-    # Poll untill start_button key is pressed
-    # Recording starts the moment the key goes down to prevent late starts or
-    print(f"Press '{start_button}' to begin recording\n")
-    while not keyboard.is_pressed(start_button):
-        pass
-
-    # Begin recording untill stop_button key is pressed
-    for x in p_device_list:
-        # print("Starting Device #" + str(x))
-        streams[x].start_stream()
-
-    # Create pipe and prepare_audio() process for some parallelism
-    compute_sender, compute_receiver = multiprocessing.Pipe()
-    compute_process = multiprocessing.Process(target=prepare_audio, args=(
-        p_save_location, compute_receiver, len(p_device_list)))
+                    working_data = audio_mixer.downmix(x, in_data, ring.channels)
+
+                    # The frames have been copied out, hand their space back to the capture callback
+                    del in_data
+                    ring.advance(num_frames)
+
+                # Resample down to 16000 sample rate, the resampler low pass filters first so rates that are not a multiple of 16khz (ex. 44.1khz) don't alias
+                with resample_timer:
+                    working_data = resamplers[x].process(working_data)
+
+                # Add processed data to the device's pending pool for mixing
+                frame_aligner.push(x, working_data, ring.header[ring_buffer.HEADER_START_TIME] / 1_000_000_000)
+
+            for frame in frame_aligner.frames(p_final=finished):
+
+                with mix_timer:
+                    # Average of the inputs with their gains, limited into the 16 bit range
+                    mixed_data = audio_mixer.mix(frame)
+                with write_timer:
+                    file_pointer.writeframes(mixed_data)
+                    # The frames are already aligned, so every input's file lines up with the mixed one sample for sample
+                    for x, source_pointer in zip(frame, source_pointers):
+                        source_pointer.writeframes(numpy.clip(x, -32768, 32767).astype(numpy.int16).tobytes())
+                with send_timer:
+                    try:
+                        if gate is not None:
+                            # The gate can hold blocks back, so it gets its own copy of the mixer's buffer
+                            for is_speech, block in gate.feed(mixed_data.copy()):
+                                _send_live(live_pipe, is_speech, block)
+                        elif live_pipe is not None:
+                            _send_live(live_pipe, True, mixed_data)
+                    except OSError as error:
+                        # BrokenPipeError (or an OSError on Windows) once the live transcriber has exited (ex. its model failed to load)
+                        sys.stderr.write(f"Live transcription stopped, the recording continues without it (in record_audio.prepare_audio()):  {error}\n")
+                        live_pipe = None
+                        gate = None
+                telemetry.add('prepare.samples', len(mixed_data))
+
+            telemetry.tick()
+            if not received and not finished:
+                time.sleep(RING_POLL_INTERVAL)
+
+    for x, (underruns, dropped, inserted) in frame_aligner.report().items():
+        if underruns or dropped or inserted:
+            sys.stderr.write(f"Input {x}: {underruns} underruns, {dropped} samples dropped and {inserted} samples repeated to keep in sync\n")
+
+    for x in rings:
+        x.release()
+
+    # An empty message tells transcriber.from_stream() that the recording has ended
+    try:
+        if gate is not None:
+            for is_speech, block in gate.flush():
+                _send_live(live_pipe, is_speech, block)
+            print(gate.report())
+        if live_pipe is not None:
+            live_pipe.send_bytes(b'')
+    except OSError as error:
+        sys.stderr.write(f"Live transcription stopped before the end of the recording (in record_audio.prepare_audio()):  {error}\n")
+    telemetry.flush()
+
+
+def _send_live(p_pipe_out, p_is_speech, p_samples):
+    """ Sends int16 samples to transcriber.from_stream(), or just their count if the VAD found no speech in them """
+
+    if p_is_speech:
+        p_pipe_out.send_bytes(transcriber.LIVE_AUDIO + p_samples.tobytes())
+    else:
+        p_pipe_out.send_bytes(transcriber.LIVE_SILENCE + len(p_samples).to_bytes(8, 'little'))
+
+
+def record(p_save_location, p_device_list=(), *, start_button='`', stop_button='`', pause_button=None, mark_button=None, control_port=None, live_output_path=None, live_model_path=None, timestamp_duration=10, live_vad_settings=None, live_phrases=None, segment_seconds=None, source_paths=None, source_gains=None, audio=None, timings=None):
+    """ Records audio to file at p_save_location
+        If segment_seconds is passed the recording is split into segment files of that length, indexed by a manifest (see segments.py)
+        If source_paths lists one wav path per device in p_device_list, each device's audio is also saved to its own file (the mixed recording is still saved)
+        source_gains can list one gain per device in p_device_list to make some devices louder or quieter in the mixed recording (default is 1 for every device)
+        The recording is started, stopped, paused and marked by hotkeys (start_button of None turns them off), signals, and the control socket on control_port if one is passed (see control.py)
+        Marks are written to p_save_location's name + MARKS_SUFFIX, one JSON line per mark
+        If live_output_path and live_model_path are passed, the recording is also transcribed to live_output_path while it is being recorded
+        (only speech is decoded if live_vad_settings is a dict of vad.SpeechGate keyword arguments, and only keyword hits are written if live_phrases is a list of phrases)
+        An already initialized pyaudio.PyAudio can be passed as audio (it is terminated once the recording is done), initializing PortAudio again is slow on some systems
+        If a dict is passed as timings, time.perf_counter() times are put in it for 'ready' (waiting for the start command), 'start', 'recording' and 'stop'
+        Returns {device index: (input overflows, dropped chunks)} from capture.CaptureEngine.report(), None if it was stopped before it started,
+        or before recording anything -2 if a live output path has an unsupported file type and -1 if the live output directory or model isn't found
+    """
+
+    # The live transcriber only finds these in its own process, by then the recording has started
+    if live_output_path is not None and live_model_path is not None:
+        for x in [live_output_path] if isinstance(live_output_path, str) else live_output_path:
+            if outputs.get_writer(x) is None:
+                sys.stderr.write(f"Invalid transcription file type (in record_audio.record()):  .{x.split('.')[-1]}\n")
+                return -2
+            if not os.path.isdir(os.path.dirname(x) or '.'):
+                sys.stderr.write(f"Transcription directory not found (in record_audio.record()):  {os.path.dirname(x)}\n")
+                return -1
+        if not os.path.isdir(live_model_path):
+            sys.stderr.write(f"Recognition model not found (in record_audio.record()):  {live_model_path}\n")
+            return -1
+
+    if audio is None:
+        audio = pyaudio.PyAudio()
+    if timings is None:
+        timings = {}
+
+    # Open a callback stream and ring buffer for every device, each device is captured on its own PortAudio thread
+    engine = capture.CaptureEngine(audio, p_device_list, CHUNK_SIZE, RING_CHUNKS)
+
+    # Start the live transcriber before waiting on the start key so the vosk model loads while the user gets ready
+    live_sender = None
+    if live_output_path is not None and live_model_path is not None:
+        live_receiver, live_sender = multiprocessing.Pipe(duplex=False)
+        # It finishes once prepare_audio() sends the end of the recording, Ctrl+C is only for the recording itself
+        live_process = multiprocessing.Process(target=control.ignore_interrupts, args=(transcriber.from_stream,
+            live_receiver, segments.manifest_path(p_save_location) if segment_seconds else p_save_location, live_output_path, live_model_path), kwargs={'timestamp_duration': timestamp_duration, 'phrases': live_phrases})
+        live_process.start()
+        # Only the live transcriber reads the pipe, if it exits early prepare_audio() gets a BrokenPipeError instead of blocking once the pipe fills up
+        live_receiver.close()
+
+    # Hotkeys, signals and the control socket all queue commands on recording_control, nothing here polls for them
+    recording_control = control.RecordingControl()
+    if start_button is not None and recording_control.attach_hotkeys(start_button, stop_button, pause_button, mark_button):
+        print(f"Press '{start_button}' to begin recording\n")
+    recording_control.attach_signals()
+    if control_port is not None:
+        recording_control.serve(control_port)
+        print(f"Waiting for a start command on control port {control_port}\n")
+
+    # Blocks until a start command comes in, recording starts the moment the hotkey callback runs to prevent late starts
+    timings['ready'] = time.perf_counter()
+    command, _ = recording_control.next_command()
+
+    if command == 'stop':
+        # Stopped before it started (ex. Ctrl+C or SIGTERM while waiting), nothing was recorded so everything is just torn down
+        recording_control.detach()
+        engine.stop()
+        engine.release()
+        audio.terminate()
+        if live_sender is not None:
+            live_sender.close()
+            live_process.terminate()
+            live_process.join()
+            live_process.close()
+        print(f"Recording cancelled")
+        return None
+
+    timings['start'] = time.perf_counter()
+
+    # Begin recording untill a stop command
+    engine.start()
+
+    # Create the prepare_audio() process for some parallelism, it reads the ring buffers the stream callbacks write to
+    compute_process = multiprocessing.Process(target=control.ignore_interrupts, args=(prepare_audio,
+        p_save_location, engine.ring_names(), live_sender, live_vad_settings, segment_seconds, source_paths, source_gains))
     compute_process.start()
+    # Likewise only prepare_audio() writes to it, so the live transcriber sees the pipe close if prepare_audio() dies
+    if live_sender is not None:
+        live_sender.close()
 
+    timings['recording'] = time.perf_counter()
     print(f"\nNow recording... ")
-    print(f"Press '{stop_button}' to stop recording\n")
+    if start_button is not None:
+        print(f"Press '{stop_button}' to stop recording\n")
 
-    # Record untill stop_button is pressed and stop input streams
-    current_stop_key_state = True
-    prev_key_state = current_stop_key_state
+    ### Audio is captured by the stream callbacks, this loop only acts on commands ###########
+    # With telemetry on it wakes up every flush interval to update the capture gauges
+    timeout = telemetry.DEFAULT_FLUSH_INTERVAL if telemetry.enabled() else None
+    marks_path = os.path.splitext(p_save_location)[0] + MARKS_SUFFIX
+    while True:
+        next_command = recording_control.next_command(timeout)
 
-    ### Record and send inputs for procesing #################################
-    while not (current_stop_key_state and not prev_key_state):
-        for x in p_device_list:
-            # Sample rate and # of channels passed alongside input data to ensure data can be decimated to 16000 properly
-            compute_sender.send((streams[x].read(CHUNK_SIZE), int(devices[x]['defaultSampleRate']), devices[x]['maxInputChannels']))
-        # signal no more streams to be mixed for time instance
-        compute_sender.send(((-6,),))
+        if telemetry.enabled():
+            engine.update_gauges()
+            telemetry.tick()
 
-        # Updating states of the stop_recording key
-        prev_key_state = current_stop_key_state
-        current_stop_key_state = keyboard.is_pressed(stop_button)
+        if next_command is None:
+            continue
+        command, label = next_command
 
-    compute_sender.send(((-5,),))  # signal no more audio streams coming
+        if command == 'stop':
+            timings['stop'] = time.perf_counter()
+            break
+        if command == 'pause':
+            engine.pause()
+            print(f"Recording paused")
+        elif command == 'resume':
+            engine.resume()
+            print(f"Recording resumed")
+        elif command == 'mark':
+            mark = {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'offset': round(engine.recorded_seconds(), 2), 'label': label}
+            with open(marks_path, 'at') as marks_file:
+                marks_file.write(json.dumps(mark) + '\n')
+            print(f"Marked {mark['offset']:.2f} seconds into the recording")
 
-    # Recording has been stopped, Clean up closables
+    recording_control.detach()
+
+    # Recording has been stopped, Clean up closables (stopping the engine also signals no more audio streams coming)
     print(f"Stopping recording...")
-    for x in p_device_list:
-        streams[x].stop_stream()
-        streams[x].close()
+    engine.stop()
     compute_process.join()
     compute_process.close()
+    report = engine.report()
+    if telemetry.enabled():
+        engine.update_gauges()
+        telemetry.flush()
+    for x, (input_overflows, dropped) in report.items():
+        if input_overflows or dropped:
+            sys.stderr.write(f"Device {x}: {input_overflows} input overflows, {dropped} chunks dropped because audio processing fell behind\n")
+    engine.release()
     audio.terminate()
 
+    # The live transcriber only has the audio still queued in its pipe left to decode
+    if live_sender is not None:
+        print(f"Finishing live transcription...")
+        live_process.join()
+        live_process.close()
+
+    return report
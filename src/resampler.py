@@ -0,0 +1,90 @@
+# pylint: disable=line-too-long
+""" Polyphase resampler used to bring input devices down to the 16 kHz sample rate vosk expects """
+# Each (input rate -> output rate) pair gets a filter bank that is built once and shared by every Resampler using it.
+# A Resampler keeps the tail of the previous chunk and the fractional output position, so consecutive chunks
+# from the same device are resampled as one continuous signal.
+
+import math
+
+import numpy
+
+TARGET_RATE = 16000
+# Number of filter taps applied per output sample when upsampling, more taps means a sharper anti-aliasing filter
+# When decimating the filter is scaled by down / up (ex. 6x for 96 kHz -> 16 kHz) so its transition band stays the same width at the output rate
+TAPS_PER_PHASE = 24
+# Filter cutoff as a fraction of the lower of the two Nyquist frequencies
+ROLLOFF = 0.9
+KAISER_BETA = 8.0
+
+_filter_banks = {}
+
+
+def get_filter_bank(p_in_rate, p_out_rate=TARGET_RATE):
+    """ Returns (up, down, bank) for resampling p_in_rate to p_out_rate
+        bank has one row of reversed filter taps per phase (up rows, TAPS_PER_PHASE * max(1, down / up) columns), ready to be dotted with input windows
+    """
+
+    key = (p_in_rate, p_out_rate)
+    if key in _filter_banks:
+        return _filter_banks[key]
+
+    divisor = math.gcd(p_in_rate, p_out_rate)
+    up = p_out_rate // divisor
+    down = p_in_rate // divisor
+
+    # Prototype low pass filter at the upsampled rate (p_in_rate * up), cut off below the lower Nyquist frequency to prevent aliasing
+    cutoff = ROLLOFF * 0.5 * min(p_in_rate, p_out_rate) / (p_in_rate * up)
+    taps_per_phase = math.ceil(TAPS_PER_PHASE * max(1, down / up))
+    length = up * taps_per_phase
+    n = numpy.arange(length) - (length - 1) / 2
+    prototype = 2 * cutoff * numpy.sinc(2 * cutoff * n) * numpy.kaiser(length, KAISER_BETA)
+    # Zero stuffing by up divides the signal energy by up, scale back so unity gain is kept
+    prototype = prototype * (up / prototype.sum())
+
+    # Phase p uses taps p, p + up, p + 2*up...  Reversed so output samples are a plain dot product with the input window ending at the current sample
+    bank = prototype.reshape(taps_per_phase, up).T[:, ::-1].astype(numpy.float32)
+    bank = numpy.ascontiguousarray(bank)
+
+    _filter_banks[key] = (up, down, bank)
+    return _filter_banks[key]
+
+
+class Resampler:
+    """ Stateful resampler for a single mono input stream, one instance should be used per device """
+
+    def __init__(self, p_in_rate, p_out_rate=TARGET_RATE):
+
+        self.in_rate = p_in_rate
+        self.out_rate = p_out_rate
+        self.up, self.down, self.bank = get_filter_bank(p_in_rate, p_out_rate)
+
+        # history holds the last taps_per_phase - 1 input samples of the previous chunk (silence before the first chunk)
+        self.taps_per_phase = self.bank.shape[1]
+        self.history = numpy.zeros(self.taps_per_phase - 1, dtype=numpy.float32)
+        # position of the next output sample at the upsampled rate, relative to the first sample in history
+        self.position = len(self.history) * self.up
+
+    def process(self, p_samples):
+        """ Resamples the mono samples in p_samples (any numeric numpy array) and returns the output as int32 """
+
+        if self.in_rate == self.out_rate:
+            return p_samples.astype(numpy.int32)
+
+        history_length = len(self.history)
+        buffer = numpy.concatenate((self.history, p_samples.astype(numpy.float32)))
+
+        # Every output sample whose newest input sample is already in buffer can be produced
+        end = len(buffer) * self.up
+        num_out = max(0, -(-(end - self.position) // self.down))
+        positions = self.position + self.down * numpy.arange(num_out)
+        newest = positions // self.up
+
+        # windows[i] is the taps_per_phase input samples ending at the ith output sample, weighted by that sample's phase
+        windows = numpy.lib.stride_tricks.sliding_window_view(buffer, self.taps_per_phase)[newest - history_length]
+        out = numpy.einsum('ij,ij->i', windows, self.bank[positions % self.up])
+
+        # Carry the tail and fractional position over to the next chunk
+        self.position += num_out * self.down - (len(buffer) - history_length) * self.up
+        self.history = buffer[len(buffer) - history_length:]
+
+        return numpy.rint(out).astype(numpy.int32)
@@ -0,0 +1,125 @@
+# pylint: disable=line-too-long
+""" Single-producer/single-consumer ring buffer of 16 bit audio frames in shared memory """
+# One RingBuffer is made per input device. The capture loop in record_audio.record() is the only writer and
+# record_audio.prepare_audio() is the only reader, so no lock is needed:
+#       the writer only ever moves HEADER_WRITE forward, after the frames it covers have been copied in
+#       the reader only ever moves HEADER_READ forward, after it is done with the frames it covers
+# Both counters count frames since the start of the recording and never wrap, the position in the buffer is counter % capacity.
+# End of recording is signalled by the writer setting HEADER_CLOSED instead of sending a sentinel.
+
+from multiprocessing import shared_memory
+
+import numpy
+
+# Header slots (int64 each)
+HEADER_WRITE = 0
+HEADER_READ = 1
+HEADER_CLOSED = 2
+HEADER_RATE = 3
+HEADER_CHANNELS = 4
+HEADER_CAPACITY = 5
+HEADER_OVERFLOWS = 6
+# Written by capture.CaptureEngine: time.monotonic_ns() of the first frame, and PortAudio input overflows reported to the stream callback
+HEADER_START_TIME = 7
+HEADER_INPUT_OVERFLOWS = 8
+HEADER_SIZE = 16
+
+
+class RingBuffer:
+    """ Shared memory ring buffer, made with RingBuffer.create() in the writing process and RingBuffer.attach() in the reading process """
+
+    def __init__(self, p_shared_memory, p_owner):
+
+        self.shared_memory = p_shared_memory
+        self.owner = p_owner
+        self.name = p_shared_memory.name
+
+        self.header = numpy.ndarray((HEADER_SIZE,), dtype=numpy.int64, buffer=p_shared_memory.buf)
+        self.sample_rate = int(self.header[HEADER_RATE])
+        self.channels = int(self.header[HEADER_CHANNELS])
+        self.capacity = int(self.header[HEADER_CAPACITY])
+        # Interleaved samples, frame i of the recording starts at (i % capacity) * channels
+        self.data = numpy.ndarray((self.capacity * self.channels,), dtype=numpy.int16, buffer=p_shared_memory.buf, offset=HEADER_SIZE * 8)
+
+    @classmethod
+    def create(cls, p_capacity, p_channels, p_sample_rate):
+        """ Creates a new ring buffer holding p_capacity frames of p_channels channel audio """
+
+        shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE * 8 + p_capacity * p_channels * 2)
+        header = numpy.ndarray((HEADER_SIZE,), dtype=numpy.int64, buffer=shm.buf)
+        header[:] = 0
+        header[HEADER_RATE] = p_sample_rate
+        header[HEADER_CHANNELS] = p_channels
+        header[HEADER_CAPACITY] = p_capacity
+        del header
+        return cls(shm, True)
+
+    @classmethod
+    def attach(cls, p_name):
+        """ Opens the ring buffer created under p_name by another process """
+
+        # Readers are child processes of the creator and share its resource tracker, so only the creator's release() unlinks
+        shm = shared_memory.SharedMemory(name=p_name)
+        return cls(shm, False)
+
+    def write(self, p_data):
+        """ Copies the interleaved 16 bit frames in p_data (bytes from stream.read()) in and publishes them to the reader
+            If the reader has fallen a full buffer behind the frames are dropped and counted in HEADER_OVERFLOWS
+        """
+
+        samples = numpy.frombuffer(p_data, dtype=numpy.int16)
+        num_frames = len(samples) // self.channels
+        write_count = int(self.header[HEADER_WRITE])
+
+        if write_count + num_frames - int(self.header[HEADER_READ]) > self.capacity:
+            self.header[HEADER_OVERFLOWS] += 1
+            return False
+
+        start = (write_count % self.capacity) * self.channels
+        end = start + len(samples)
+        if end <= len(self.data):
+            self.data[start:end] = samples
+        else:
+            split = len(self.data) - start
+            self.data[start:] = samples[:split]
+            self.data[:end - len(self.data)] = samples[split:]
+
+        # Frames have to be in place before the counter says they are there
+        self.header[HEADER_WRITE] = write_count + num_frames
+        return True
+
+    def close(self):
+        """ Tells the reader no more frames are coming """
+
+        self.header[HEADER_CLOSED] = 1
+
+    def available(self):
+        """ Number of frames written but not yet read """
+
+        return int(self.header[HEADER_WRITE]) - int(self.header[HEADER_READ])
+
+    def peek(self, p_num_frames):
+        """ Returns the next p_num_frames interleaved frames without consuming them
+            The result is a view into shared memory unless the frames wrap around the end of the buffer (rare when
+            the capacity is a multiple of the chunk size and frames are written a chunk at a time)
+        """
+
+        start = (int(self.header[HEADER_READ]) % self.capacity) * self.channels
+        end = start + p_num_frames * self.channels
+        if end <= len(self.data):
+            return self.data[start:end]
+        return numpy.concatenate((self.data[start:], self.data[:end - len(self.data)]))
+
+    def advance(self, p_num_frames):
+        """ Marks p_num_frames frames as read so the writer can reuse their space """
+
+        self.header[HEADER_READ] += p_num_frames
+
+    def release(self):
+        """ Closes this process's mapping, the creating process also unlinks the shared memory """
+
+        del self.header
+        del self.data
+        self.shared_memory.close()
+        if self.owner:
+            self.shared_memory.unlink()
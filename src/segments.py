@@ -0,0 +1,330 @@
+# pylint: disable=line-too-long
+""" Segmented recording, a long recording is written as a series of wav files plus a manifest indexing them so it can be read back as one recording """
+# The manifest is a JSON lines file written next to the segments (the recording's file name without .wav + MANIFEST_SUFFIX):
+#
+#       first line      {"sample_rate", "channels", "sample_width", "segment_seconds", "start_time"}
+#       one per segment {"index", "path", "start_sample", "frames", "start_time", "data_offset", "data_bytes"}
+#       last line       {"end": true, "frames"}     only once the recording has been stopped
+#
+# start_sample is where the segment starts in the whole recording, start_time is wall-clock seconds since the epoch, and
+# data_offset/data_bytes are where the segment's frames are in its file. A segment is only added to the manifest once it
+# is closed and fsynced, so if the recording dies every segment in the manifest is complete and at most one segment
+# (the one being written, left on disk as is) is missing from it.
+#
+# Recording over an existing segmented recording deletes its segments first (see remove_recording()), a longer earlier
+# recording would otherwise leave segments past the new ones' end next to the new manifest.
+
+import os
+import time
+import json
+import wave
+import bisect
+
+import wav_reader
+
+MANIFEST_SUFFIX = '_manifest.jsonl'
+# Seconds a following SegmentedReader waits between checks of the manifest for new segments
+FOLLOW_POLL_INTERVAL = 1.0
+
+
+def manifest_path(p_file_name):
+    """ Returns the manifest path of a segmented recording named p_file_name (ex. a.wav -> a_manifest.jsonl) """
+
+    return os.path.splitext(p_file_name)[0] + MANIFEST_SUFFIX
+
+
+def is_manifest(p_path):
+    """ True if p_path is the manifest of a segmented recording """
+
+    return p_path.endswith(MANIFEST_SUFFIX)
+
+
+def remove_recording(p_manifest_path):
+    """ Deletes the segmented recording with the manifest at p_manifest_path: every segment it lists, the segment that was being written if the recording died, and the manifest """
+
+    directory = os.path.dirname(p_manifest_path)
+    paths = []
+    with open(p_manifest_path, 'rt') as manifest_file:
+        for line in manifest_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut off by a crash
+                continue
+            if 'path' in entry:
+                paths.append(entry['path'])
+    # Segments are added to the manifest once they are closed, one that was still open when the recording died isn't in it
+    paths.append(os.path.basename(f"{p_manifest_path[:-len(MANIFEST_SUFFIX)]}_{len(paths):04d}.wav"))
+
+    for x in paths:
+        path = os.path.join(directory, x)
+        if os.path.exists(path):
+            os.remove(path)
+    os.remove(p_manifest_path)
+
+
+def _sync(p_file):
+    """ Flushes p_file all the way to the disk """
+
+    p_file.flush()
+    os.fsync(p_file.fileno())
+
+
+class SegmentWriter:
+    """ Stand-in for a wave.Wave_write of p_file_name that starts a new segment file every p_segment_seconds seconds of audio
+        Segments are named p_file_name without .wav + _0000.wav, _0001.wav, ...
+    """
+
+    def __init__(self, p_file_name, p_segment_seconds, *, sample_rate=16000, channels=1, sample_width=2):
+
+        self.base_name = os.path.splitext(p_file_name)[0]
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.frame_size = channels * sample_width
+        self.segment_frames = max(1, int(p_segment_seconds * sample_rate))
+
+        if os.path.exists(manifest_path(p_file_name)):
+            remove_recording(manifest_path(p_file_name))
+        self.manifest = open(manifest_path(p_file_name), 'wt')
+        self.manifest.write(json.dumps({'sample_rate': sample_rate, 'channels': channels, 'sample_width': sample_width,
+                                        'segment_seconds': p_segment_seconds, 'start_time': time.time()}) + '\n')
+        _sync(self.manifest)
+
+        self.index = 0
+        self.total_frames = 0
+        self.segment = None
+
+    def _open_segment(self):
+
+        path = f"{self.base_name}_{self.index:04d}.wav"
+        segment_file = open(path, 'wb')
+        wave_file = wave.open(segment_file, 'wb')
+        wave_file.setnchannels(self.channels)
+        wave_file.setsampwidth(self.sample_width)
+        wave_file.setframerate(self.sample_rate)
+        # The block that opens the segment has just arrived, so now is (close enough to) the wall-clock time of its first frame
+        self.segment = {'file': segment_file, 'wave': wave_file, 'path': path, 'start_sample': self.total_frames, 'frames': 0, 'start_time': time.time()}
+
+    def _close_segment(self):
+        """ Finishes the current segment's header, fsyncs it, and only then adds it to the manifest """
+
+        segment = self.segment
+        self.segment = None
+        # wave doesn't close file objects it was handed, so the file is synced after the header is patched
+        segment['wave'].close()
+        _sync(segment['file'])
+        file_size = os.fstat(segment['file'].fileno()).st_size
+        segment['file'].close()
+
+        data_bytes = segment['frames'] * self.frame_size
+        self.manifest.write(json.dumps({'index': self.index,
+                                        'path': os.path.basename(segment['path']),
+                                        'start_sample': segment['start_sample'],
+                                        'frames': segment['frames'],
+                                        'start_time': segment['start_time'],
+                                        'data_offset': file_size - data_bytes - (data_bytes & 1),
+                                        'data_bytes': data_bytes}) + '\n')
+        _sync(self.manifest)
+        self.index += 1
+
+    def writeframes(self, p_data):
+        """ Writes p_data (bytes of whole frames), splitting it across segments where a segment fills up """
+
+        data = memoryview(p_data).cast('B')
+        while len(data) != 0:
+            if self.segment is None:
+                self._open_segment()
+            num_frames = min(len(data) // self.frame_size, self.segment_frames - self.segment['frames'])
+            self.segment['wave'].writeframes(data[:num_frames * self.frame_size])
+            self.segment['frames'] += num_frames
+            self.total_frames += num_frames
+            data = data[num_frames * self.frame_size:]
+            if self.segment['frames'] == self.segment_frames:
+                self._close_segment()
+
+    def close(self):
+        """ Closes the last segment and marks the manifest as finished """
+
+        if self.segment is not None:
+            self._close_segment()
+        self.manifest.write(json.dumps({'end': True, 'frames': self.total_frames}) + '\n')
+        _sync(self.manifest)
+        self.manifest.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, p_type, p_value, p_traceback):
+        self.close()
+        return False
+
+
+class SegmentedReader:
+    """ Reads the segments listed in the manifest at p_manifest_path as one recording, with the same methods as wav_reader.WavReader
+        Only start seconds up to end seconds (None for the end of the recording) are read, the same as WavReader
+        With follow=True segments are read as soon as they are added to the manifest, reading waits for the next segment until the recording is stopped
+    """
+
+    def __init__(self, p_manifest_path, *, start=0.0, end=None, follow=False):
+
+        # A followed recording may not have started yet
+        while follow and not os.path.exists(p_manifest_path):
+            time.sleep(FOLLOW_POLL_INTERVAL)
+
+        self.manifest_dir = os.path.dirname(os.path.abspath(p_manifest_path))
+        self.manifest = open(p_manifest_path, 'rt')
+        self.follow = follow
+        self.partial_line = ''
+        self.header = None
+        self.starts = []
+        self.entries = []
+        self.ended = False
+        self.reader = None
+        self.reader_index = -1
+
+        self._read_manifest()
+        while self.header is None and self.follow:
+            time.sleep(FOLLOW_POLL_INTERVAL)
+            self._read_manifest()
+        if self.header is None:
+            self.manifest.close()
+            raise wave.Error(f"{p_manifest_path} is an empty manifest")
+
+        self.sample_rate = self.header['sample_rate']
+        self.frame_size = self.header['channels'] * self.header['sample_width']
+        # Wall-clock time of the recording's first frame
+        self.start_time = self.header['start_time']
+
+        self.start_frame = max(0, round(start * self.sample_rate))
+        self.end_frame = None if end is None else max(self.start_frame, round(end * self.sample_rate))
+        self.position = 0
+
+    def _read_manifest(self):
+        """ Adds any segments written to the manifest since it was last read """
+
+        for line in self.manifest:
+            # A line that is still being written is kept until the rest of it shows up
+            line = self.partial_line + line
+            if not line.endswith('\n'):
+                self.partial_line = line
+                break
+            self.partial_line = ''
+
+            entry = json.loads(line)
+            if self.header is None:
+                self.header = entry
+            elif entry.get('end'):
+                self.ended = True
+            else:
+                self.starts.append(entry['start_sample'])
+                self.entries.append(entry)
+
+    def _known_frames(self):
+        """ Frames in the segments read from the manifest so far """
+
+        return self.entries[-1]['start_sample'] + self.entries[-1]['frames'] if self.entries else 0
+
+    def _wait_for(self, p_frame):
+        """ Waits (when following) until the manifest covers up to p_frame of the recording or the recording has ended """
+
+        while self.follow and not self.ended and self._known_frames() < p_frame:
+            time.sleep(FOLLOW_POLL_INTERVAL)
+            self._read_manifest()
+
+    def _total_frames(self):
+        """ Frames in the whole recording, when following this waits until the recording is stopped """
+
+        self._wait_for(float('inf'))
+        return self._known_frames()
+
+    def file_duration(self):
+        """ Seconds of audio in the whole recording, not just the range """
+
+        return self._total_frames() / self.sample_rate
+
+    def start_seconds(self):
+        """ Seconds from the start of the recording to the start of the range """
+
+        return self.start_frame / self.sample_rate
+
+    def getnchannels(self):
+        return self.header['channels']
+
+    def getsampwidth(self):
+        return self.header['sample_width']
+
+    def getframerate(self):
+        return self.sample_rate
+
+    def getnframes(self):
+        """ Frames in the range, when following this waits until the recording is stopped """
+
+        total_frames = self._total_frames()
+        end_frame = total_frames if self.end_frame is None else min(self.end_frame, total_frames)
+        return max(0, end_frame - min(self.start_frame, total_frames))
+
+    def tell(self):
+        return self.position
+
+    def setpos(self, p_position):
+        """ Moves to frame p_position (relative to the start of the range) """
+
+        if p_position < 0 or (not self.follow and p_position > self.getnframes()):
+            raise wave.Error('position not in range')
+        self.position = p_position
+
+    def _segment_reader(self, p_index):
+        """ Returns a WavReader of segment p_index, only one segment is kept open at a time """
+
+        if p_index != self.reader_index:
+            if self.reader is not None:
+                self.reader.close()
+            self.reader = wav_reader.WavReader(os.path.join(self.manifest_dir, self.entries[p_index]['path']))
+            self.reader_index = p_index
+        return self.reader
+
+    def readframes(self, p_num_frames):
+        """ Returns up to p_num_frames frames, a memoryview into the segment file unless the frames span two segments (then bytes)
+            An empty result means the end of the range
+        """
+
+        first = self.start_frame + self.position
+        last = first + p_num_frames
+        if self.end_frame is not None:
+            last = min(last, self.end_frame)
+        self._wait_for(last)
+        last = min(last, self._known_frames())
+        if last <= first:
+            return b''
+
+        pieces = []
+        frame = first
+        while frame < last:
+            # The index is sorted by start sample, so the segment holding frame is found with a binary search
+            index = bisect.bisect_right(self.starts, frame) - 1
+            entry = self.entries[index]
+            reader = self._segment_reader(index)
+            num_frames = min(last, entry['start_sample'] + entry['frames']) - frame
+            reader.setpos(frame - entry['start_sample'])
+            pieces.append(reader.readframes(num_frames))
+            frame += num_frames
+
+        self.position = last - self.start_frame
+        if len(pieces) == 1:
+            return pieces[0]
+        return b''.join(pieces)
+
+    def close(self):
+
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        self.manifest.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, p_type, p_value, p_traceback):
+        self.close()
+        return False
@@ -0,0 +1,294 @@
+# pylint: disable=line-too-long
+""" Low overhead per-stage timers, counters and gauges for the recording and transcription pipeline """
+# Every process keeps its own numbers and appends a snapshot of them (cumulative since the process started) as one
+# JSON line to the metrics file every flush interval:
+#
+#       {"time": ..., "process": ..., "pid": ..., "uptime": ...,
+#        "stages": {name: {"calls": ..., "seconds": ..., "max_seconds": ...}}, "counters": {name: ...}, "gauges": {name: ...}}
+#
+# configure() is called once in the main process, the settings are passed to child processes through an environment
+# variable so processes started with spawn pick them up when they import this module. With everything off (the
+# default) stage() returns a shared no-op timer and the other functions return right away.
+#
+# Stage names used by the pipeline:
+#       capture.callback.<device>   PyAudio stream callback (copying a buffer into the ring buffer)
+#       prepare.read                Reading and downmixing ring buffer frames in record_audio.prepare_audio()
+#       prepare.resample            Resampling to 16 kHz
+#       prepare.mix                 Aligning and mixing devices
+#       prepare.write               wave writeframes()
+#       prepare.send                Sending frames to the live transcriber
+#       recognize.accept            vosk AcceptWaveform()
+#       recognize.result            vosk Result() / FinalResult()
+#       output.write                Transcript writers
+
+import os
+import sys
+import json
+import time
+import threading
+import http.server
+import multiprocessing
+
+ENV_VARIABLE = 'DMAT_TELEMETRY'
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+_settings = None
+_stages = {}
+_counters = {}
+_gauges = {}
+_started = time.perf_counter()
+_next_flush = 0.0
+
+
+class _Stage:
+    """ Accumulates the calls, total and longest time of one stage, used as a context manager around the stage's code
+        Not reentrant, each stage name should only be timed from one thread at a time
+    """
+
+    __slots__ = ('calls', 'total', 'maximum', 'started')
+
+    def __init__(self):
+
+        self.calls = 0
+        self.total = 0
+        self.maximum = 0
+        self.started = 0
+
+    def __enter__(self):
+
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, p_type, p_value, p_traceback):
+
+        elapsed = time.perf_counter_ns() - self.started
+        self.calls += 1
+        self.total += elapsed
+        if elapsed > self.maximum:
+            self.maximum = elapsed
+        return False
+
+
+class _NullStage:
+    """ Stand-in for _Stage when telemetry is off """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, p_type, p_value, p_traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def configure(p_metrics_path=None, *, flush_interval=DEFAULT_FLUSH_INTERVAL, prometheus_port=None):
+    """ Turns telemetry on, snapshots are appended to p_metrics_path every flush_interval seconds
+        If prometheus_port is passed, the latest snapshot of every process in the metrics file is served in the Prometheus text format on that localhost port
+    """
+
+    global _settings
+    # Only snapshots from this run are summarized, the metrics file may already have earlier runs in it
+    _settings = {'metrics_path': os.path.abspath(p_metrics_path), 'flush_interval': flush_interval, 'since': time.time()}
+    os.environ[ENV_VARIABLE] = json.dumps(_settings)
+
+    if prometheus_port is not None:
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', prometheus_port), _PrometheusHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def enabled():
+    """ True if configure() was called in this process or its parent """
+
+    return _settings is not None
+
+
+def stage(p_name):
+    """ Returns the timer for stage p_name, use it as a context manager around the stage (look it up once outside hot loops) """
+
+    if _settings is None:
+        return _NULL_STAGE
+    timer = _stages.get(p_name)
+    if timer is None:
+        timer = _stages[p_name] = _Stage()
+    return timer
+
+
+def add(p_name, p_value=1):
+    """ Adds p_value to counter p_name """
+
+    if _settings is not None:
+        _counters[p_name] = _counters.get(p_name, 0) + p_value
+
+
+def gauge(p_name, p_value):
+    """ Sets gauge p_name to p_value """
+
+    if _settings is not None:
+        _gauges[p_name] = p_value
+
+
+def tick():
+    """ Flushes if the flush interval has passed, cheap enough to call from loops """
+
+    if _settings is not None and time.perf_counter() >= _next_flush:
+        flush()
+
+
+def snapshot():
+    """ Returns this process's numbers as a dict (the same as one line of the metrics file) """
+
+    return {'time': time.time(),
+            'process': multiprocessing.current_process().name,
+            'pid': os.getpid(),
+            'uptime': time.perf_counter() - _started,
+            'stages': {x: {'calls': y.calls, 'seconds': y.total / 1e9, 'max_seconds': y.maximum / 1e9} for x, y in list(_stages.items())},
+            'counters': dict(_counters),
+            'gauges': dict(_gauges)}
+
+
+def flush():
+    """ Appends a snapshot to the metrics file, call at the end of every process that records anything """
+
+    global _next_flush
+    if _settings is None:
+        return
+    _next_flush = time.perf_counter() + _settings['flush_interval']
+
+    # One write per line, appends from several processes don't interleave within a line
+    try:
+        with open(_settings['metrics_path'], 'at') as metrics_file:
+            metrics_file.write(json.dumps(snapshot()) + '\n')
+    except OSError as error:
+        sys.stderr.write(f"Unable to write metrics (in telemetry.flush()):  {error}\n")
+
+
+def read_latest(p_metrics_path, p_since=0):
+    """ Returns the latest snapshot of every process (by pid) in the metrics file at p_metrics_path, ignoring snapshots from before p_since (a time.time()) """
+
+    latest = {}
+    if not os.path.exists(p_metrics_path):
+        return latest
+    with open(p_metrics_path, 'rt') as metrics_file:
+        for line in metrics_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Partial line being written by another process
+                continue
+            if entry['time'] >= p_since:
+                latest[entry['pid']] = entry
+    return latest
+
+
+def _combine(p_snapshots):
+    """ Returns (stages, counters, gauges) summed over p_snapshots, stage max_seconds is the max over them """
+
+    stages, counters, gauges = {}, {}, {}
+    for x in p_snapshots:
+        for name, y in x['stages'].items():
+            total = stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            total['calls'] += y['calls']
+            total['seconds'] += y['seconds']
+            total['max_seconds'] = max(total['max_seconds'], y['max_seconds'])
+        for name, y in x['counters'].items():
+            counters[name] = counters.get(name, 0) + y
+        for name, y in x['gauges'].items():
+            gauges[name] = gauges.get(name, 0) + y
+    return (stages, counters, gauges)
+
+
+def summary(p_metrics_path=None):
+    """ Returns a per-stage table of the latest numbers of every process in the metrics file (default is the configured one, this run only) """
+
+    since = 0
+    if p_metrics_path is None:
+        if _settings is None:
+            return "Telemetry is off"
+        flush()
+        p_metrics_path = _settings['metrics_path']
+        since = _settings['since']
+
+    latest = read_latest(p_metrics_path, since)
+    stages, counters, gauges = _combine(latest.values())
+
+    lines = [f"{'stage':<28}{'calls':>10}{'total s':>11}{'mean ms':>10}{'max ms':>10}"]
+    for name, x in sorted(stages.items()):
+        lines.append(f"{name:<28}{x['calls']:>10}{x['seconds']:>11.3f}{1000 * x['seconds'] / max(1, x['calls']):>10.3f}{1000 * x['max_seconds']:>10.3f}")
+
+    lines.append('')
+    for name, x in sorted(counters.items()):
+        lines.append(f"{name:<38}{x:>14,.6g}")
+    for name, x in sorted(gauges.items()):
+        lines.append(f"{name:<38}{x:>14,.6g}")
+
+    # Derived numbers
+    prepare_uptime = max((x['uptime'] for x in latest.values() if 'prepare.samples' in x['counters']), default=0)
+    if prepare_uptime:
+        lines.append(f"{'prepare samples per second':<38}{counters['prepare.samples'] / prepare_uptime:>14,.0f}")
+    if counters.get('recognize.audio_seconds'):
+        decode_seconds = sum(stages[x]['seconds'] for x in ('recognize.accept', 'recognize.result') if x in stages)
+        lines.append(f"{'recognizer real time factor':<38}{decode_seconds / counters['recognize.audio_seconds']:>14.3f}")
+    return '\n'.join(lines)
+
+
+def prometheus_text(p_metrics_path, p_since=0):
+    """ Returns the latest snapshot of every process in the metrics file (since p_since) in the Prometheus text exposition format """
+
+    def labels(p_snapshot, **p_labels):
+        return ','.join(f'{x}="{y}"' for x, y in (('process', p_snapshot['process']), ('pid', p_snapshot['pid']), *p_labels.items()))
+
+    latest = read_latest(p_metrics_path, p_since).values()
+    lines = ['# TYPE dmat_stage_calls_total counter', '# TYPE dmat_stage_seconds_total counter', '# TYPE dmat_stage_max_seconds gauge',
+             '# TYPE dmat_counter_total counter', '# TYPE dmat_gauge gauge']
+    for x in latest:
+        for name, y in x['stages'].items():
+            lines.append(f"dmat_stage_calls_total{{{labels(x, stage=name)}}} {y['calls']}")
+            lines.append(f"dmat_stage_seconds_total{{{labels(x, stage=name)}}} {y['seconds']}")
+            lines.append(f"dmat_stage_max_seconds{{{labels(x, stage=name)}}} {y['max_seconds']}")
+        for name, y in x['counters'].items():
+            lines.append(f"dmat_counter_total{{{labels(x, name=name)}}} {y}")
+        for name, y in x['gauges'].items():
+            lines.append(f"dmat_gauge{{{labels(x, name=name)}}} {y}")
+    return '\n'.join(lines) + '\n'
+
+
+class _PrometheusHandler(http.server.BaseHTTPRequestHandler):
+    """ Serves prometheus_text() of the configured metrics file on /metrics """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        flush()
+        body = prometheus_text(_settings['metrics_path'], _settings['since']).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        # Scrapes would otherwise be printed to stderr
+        pass
+
+
+def _reset():
+    """ Forked children start with their own empty numbers instead of a copy of the parent's """
+
+    global _started, _next_flush
+    _stages.clear()
+    _counters.clear()
+    _gauges.clear()
+    _started = time.perf_counter()
+    _next_flush = 0.0
+
+
+# Processes started with spawn (or os.fork) pick up the settings of the process that called configure()
+if os.environ.get(ENV_VARIABLE):
+    _settings = json.loads(os.environ[ENV_VARIABLE])
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset)
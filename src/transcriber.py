@@ -3,87 +3,864 @@
 
 import os
 import sys
+import json
+import time
 import wave
 import datetime
+import contextlib
+import multiprocessing
+import concurrent.futures
 
-import vosk
+import numpy
 
 import outputs
+import vad
+import telemetry
+import wav_reader
+import archive_index
+import segments
+import keywords
 
 CHUNK_SIZE = 1024
+# Seconds of audio on each side of a candidate segment boundary that are checked for silence in parallel mode
+SILENCE_SEARCH_DURATION = 0.5
 
-def from_wav(p_wav_path, p_output_path, p_vosk_model_path, *, block_duration=0.25, timestamp_duration=10):
-    """ Receives a wav filepath string and use kaldi with a vosk model specified by p_vosk_model """
+# refine() rewrites the outputs with the windows improved so far at most every REFINE_REWRITE_INTERVAL seconds
+REFINE_REWRITE_INTERVAL = 5.0
+# refine() pauses while the load average of the other processes is above REFINE_MAX_LOAD per CPU, checking again every REFINE_PAUSE_INTERVAL seconds
+REFINE_MAX_LOAD = 0.75
+REFINE_PAUSE_INTERVAL = 2.0
+# Niceness refine() gives its process on POSIX, so it only gets CPU time nothing else wants
+REFINE_NICENESS = 19
+# Priority class refine() gives its process on Windows for the same reason (IDLE_PRIORITY_CLASS)
+REFINE_PRIORITY_CLASS = 0x00000040
 
-    if not os.path.exists(p_wav_path):
+# from_wav() saves how far it has got to the first output path + CHECKPOINT_SUFFIX at most every CHECKPOINT_INTERVAL seconds
+CHECKPOINT_SUFFIX = '.checkpoint.json'
+CHECKPOINT_INTERVAL = 30.0
+
+# Message tags used on the pipe from record_audio.prepare_audio() to from_stream()
+LIVE_AUDIO = b'a'
+LIVE_SILENCE = b's'
+
+# Model loaded once per worker process by _init_worker() in parallel mode
+_worker_model = None
+# cffi instance _waveform() wraps buffers with, False if cffi can't be imported
+_buffer_ffi = None
+
+
+def _waveform(p_data):
+    """ Returns p_data in a form vosk's AcceptWaveform() takes without copying
+        vosk only takes bytes or cffi buffers, so memoryview slices of a wav_reader.WavReader are wrapped in a cffi buffer instead of copied to bytes
+        The buffer is made with cffi itself (vosk is built on it) rather than vosk's private FFI instance, without cffi it is copied to bytes
+    """
+
+    global _buffer_ffi
+    if isinstance(p_data, bytes):
+        return p_data
+    if _buffer_ffi is None:
+        try:
+            import cffi
+            _buffer_ffi = cffi.FFI()
+        except ImportError:
+            _buffer_ffi = False
+    if _buffer_ffi is False:
+        return bytes(p_data)
+    return _buffer_ffi.from_buffer(p_data)
+
+
+def _decode_windows(p_wav_file, p_recognizer, p_frame_duration, p_window_blocks, *, first_window=0, last_window=None, gate=None):
+    """ Generator that feeds blocks of p_frame_duration frames to p_recognizer and yields the text of each timestamp window
+        Windows first_window up to (but not including) last_window are decoded, last_window of None decodes to the end of the file
+        If a vad.SpeechGate is passed as gate, blocks it finds no speech in are skipped (they still count towards the window they are in)
+        NOTE: Window 0 is one block longer than the rest, the block counting here must stay the same for serial and parallel transcription to line up
+    """
+
+    count = 0 if first_window == 0 else first_window * p_window_blocks + 1
+    p_wav_file.setpos(count * p_frame_duration)
+
+    accept_timer = telemetry.stage('recognize.accept')
+    result_timer = telemetry.stage('recognize.result')
+    block_seconds = p_frame_duration / p_wav_file.getframerate()
+
+    while True:
+
+        data = p_wav_file.readframes(p_frame_duration)
+        if len(data) == 0:
+            if gate is not None:
+                gate.flush()
+            # Final write of whatever is left in the last window
+            with result_timer:
+                text_string = f"{p_recognizer.Result()[14:-3]}"
+            yield text_string
+            return
+
+        with accept_timer:
+            if gate is None:
+                p_recognizer.AcceptWaveform(_waveform(data))
+            else:
+                for is_speech, block in gate.feed(data):
+                    if is_speech:
+                        p_recognizer.AcceptWaveform(_waveform(block))
+        telemetry.add('recognize.audio_seconds', block_seconds)
+
+        # If num of blocks since the last timestamp is worth timestamp_duration seconds, the window is finished
+        if count % p_window_blocks == 0 and not count == 0:
+            # Using python iterator slice functionality for better time since the returned JSON isn't complex
+            with result_timer:
+                text_string = f"{p_recognizer.Result()[14:-3]}"
+            telemetry.tick()
+            yield text_string
+            if last_window is not None and count // p_window_blocks == last_window:
+                if gate is not None:
+                    gate.flush()
+                return
+
+        count += 1
+
+
+def load_model(p_vosk_model_path):
+    """ Loads the vosk model at p_vosk_model_path
+        vosk is only imported here (and in _make_recognizer()), loading its native library is slow and processes that never transcribe (ex. prepare_audio() started with spawn) shouldn't pay for it
+    """
+
+    import vosk
+    return vosk.Model(p_vosk_model_path)
+
+
+def load_model_in_background(p_vosk_model_path):
+    """ Starts loading the vosk model at p_vosk_model_path on a background thread, returns a concurrent.futures.Future of the model
+        vosk releases the GIL while loading, so recording can start while the model is still loading
+    """
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='model_loader')
+    future = executor.submit(load_model, p_vosk_model_path)
+    executor.shutdown(wait=False)
+    return future
+
+
+def _make_recognizer(p_model, p_sample_rate, p_grammar=None):
+    """ Returns a vosk.KaldiRecognizer for p_model, only recognizing the phrases in p_grammar if one is passed (see keywords.grammar()) """
+
+    import vosk
+    if p_grammar is not None:
+        return vosk.KaldiRecognizer(p_model, p_sample_rate, p_grammar)
+    return vosk.KaldiRecognizer(p_model, p_sample_rate)
+
+
+def _init_worker(p_vosk_model_path):
+    """ Pool initializer, each worker process loads its own copy of the model once """
+
+    global _worker_model
+    _worker_model = load_model(p_vosk_model_path)
+
+
+def _decode_segment(p_segment):
+    """ Decodes one (wav path, start, end, first window, last window, frame duration, window blocks, vad settings) segment in a worker process
+        start and end are the time range (in seconds) of the file being transcribed, windows are counted from start
+        Returns (text of its windows, samples skipped by the VAD, samples checked by the VAD)
+    """
+
+    wav_path, start, end, first_window, last_window, frame_duration, window_blocks, vad_settings = p_segment
+
+    with open_recording(wav_path, start=start, end=end) as wf:
+        recognizer = _make_recognizer(_worker_model, wf.getframerate())
+        gate = vad.SpeechGate(wf.getframerate(), **vad_settings) if vad_settings is not None else None
+        texts = list(_decode_windows(wf, recognizer, frame_duration, window_blocks, first_window=first_window, last_window=last_window, gate=gate))
+
+    # Pool workers are ended without running exit handlers, so each segment's numbers are written out here
+    telemetry.flush()
+
+    if gate is None:
+        return (texts, 0, 0)
+    return (texts, gate.skipped_samples, gate.total_samples)
+
+
+def _find_segments(p_wav_file, p_frame_duration, p_window_blocks, p_num_segments):
+    """ Splits the windows of p_wav_file into about p_num_segments (first window, last window) ranges
+        Each split is moved to the quietest window boundary near its target so words are less likely to be cut between workers
+    """
+
+    sample_rate = p_wav_file.getframerate()
+    search_frames = int(sample_rate * SILENCE_SEARCH_DURATION)
+
+    # Window k (k >= 1) starts after block k * p_window_blocks, the same counting as _decode_windows()
+    num_windows = (p_wav_file.getnframes() // p_frame_duration) // p_window_blocks
+    windows_per_segment = max(1, num_windows // p_num_segments)
+    search_windows = max(1, windows_per_segment // 4)
+
+    segments = []
+    first_window = 0
+    while first_window + windows_per_segment < num_windows:
+
+        target = first_window + windows_per_segment
+        best_window = target
+        best_energy = -1
+        for candidate in range(max(first_window + 1, target - search_windows), min(num_windows, target + search_windows + 1)):
+            boundary = (candidate * p_window_blocks + 1) * p_frame_duration
+            p_wav_file.setpos(max(0, boundary - search_frames))
+            samples = numpy.frombuffer(p_wav_file.readframes(2 * search_frames), dtype=numpy.int16)
+            # Sum of squares is enough to compare loudness, no need for a true RMS
+            energy = int(numpy.dot(samples.astype(numpy.int64), samples))
+            if best_energy == -1 or energy < best_energy:
+                best_window = candidate
+                best_energy = energy
+
+        segments.append((first_window, best_window))
+        first_window = best_window
+
+    segments.append((first_window, None))
+    return segments
+
+
+def open_recording(p_path, *, start=0.0, end=None, follow=False):
+    """ Opens the wav file or segmented recording manifest (see segments.py) at p_path for reading from start seconds up to end seconds
+        follow=True reads a manifest's segments as they are recorded (see segments.SegmentedReader)
+    """
+
+    if segments.is_manifest(p_path):
+        return segments.SegmentedReader(p_path, start=start, end=end, follow=follow)
+    return wav_reader.WavReader(p_path, start=start, end=end)
+
+
+def _check_output_paths(p_output_path, p_caller):
+    """ Returns p_output_path as a list of paths (a single path or a list of paths can be passed), or None if any of them has an unsupported file type """
+
+    output_paths = [p_output_path] if isinstance(p_output_path, str) else list(p_output_path)
+    for x in output_paths:
+        if outputs.get_writer(x) is None:
+            sys.stderr.write(f"Invalid transcription file type (in transcriber.{p_caller}()):  .{x.split('.')[-1]}\n")
+            return None
+    return output_paths
+
+
+def _open_writers(p_output_paths, p_metadata, p_exit_stack, p_checkpoint=None):
+    """ Opens every output file on p_exit_stack and returns a writer for each
+        If a checkpoint (see _read_checkpoint()) is passed the files are cut back to what was written when it was made and added to from there
+    """
+
+    if p_checkpoint is None:
+        return [outputs.get_writer(x)(p_exit_stack.enter_context(open(x, 'wt')), p_metadata) for x in p_output_paths]
+
+    writers = []
+    for x in p_output_paths:
+        size, count = p_checkpoint['outputs'][x]
+        # Anything after the checkpoint (a partly written entry, or the footer) goes, the windows it came from are decoded again
+        with open(x, 'r+b') as output_file:
+            output_file.truncate(size)
+        writer = outputs.get_writer(x)(p_exit_stack.enter_context(open(x, 'at')), p_metadata)
+        writer.resume(count)
+        writers.append(writer)
+    return writers
+
+
+def _checkpoint_settings(p_wav_path, p_output_paths, p_follow, **p_settings):
+    """ Everything a checkpoint is only good for, a checkpoint made with different settings is ignored """
+
+    stat = os.stat(p_wav_path) if not p_follow else None
+    # A followed recording is still growing, so it's only recognized by name
+    return dict(p_settings, wav_path=os.path.abspath(p_wav_path), outputs=list(p_output_paths), fingerprint=[stat.st_size, int(stat.st_mtime)] if stat else None)
+
+
+def _read_checkpoint(p_checkpoint_path, p_settings):
+    """ Returns the checkpoint at p_checkpoint_path if it was made with p_settings and its output files are all still there, otherwise None """
+
+    try:
+        with open(p_checkpoint_path, 'rt') as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (OSError, ValueError):
+        return None
+
+    if checkpoint.get('settings') != p_settings:
+        return None
+    for x in p_settings['outputs']:
+        # An output shorter than the checkpoint says was never fully written to disk
+        if not os.path.exists(x) or os.path.getsize(x) < checkpoint['outputs'][x][0]:
+            return None
+    return checkpoint
+
+
+def _write_checkpoint(p_checkpoint_path, p_settings, p_windows, p_frame, p_writers, p_output_paths):
+    """ Flushes every writer and saves p_windows (windows written so far) and p_frame (the frame the next window starts at) with each output's size and entry count """
+
+    output_sizes = {}
+    for x, writer in zip(p_output_paths, p_writers):
+        writer.flush()
+        output_sizes[x] = [writer.file_pointer.tell(), writer.count]
+
+    # Written to a temporary file first so a crash while saving leaves the last checkpoint as it was
+    with open(p_checkpoint_path + '.tmp', 'wt') as checkpoint_file:
+        json.dump({'settings': p_settings, 'windows': p_windows, 'frame': p_frame, 'outputs': output_sizes}, checkpoint_file)
+    os.replace(p_checkpoint_path + '.tmp', p_checkpoint_path)
+
+
+def from_wav(p_wav_path, p_output_path, p_vosk_model_path, *, block_duration=0.25, timestamp_duration=10, workers=1, model=None, vad_settings=None, timings=None, start=0.0, end=None, follow=False, resume=False, texts=None):
+    """ Receives a wav filepath string and use kaldi with a vosk model specified by p_vosk_model
+        p_output_path can be a list of output paths, every output is written from the same recognition pass
+        If workers is greater than 1 the file is split into segments that are decoded in a pool of worker processes, each loading its own model
+        An already loaded vosk.Model can be passed as model to skip loading p_vosk_model_path (only used when workers is 1)
+        If vad_settings is a dict (of vad.SpeechGate keyword arguments, {} for the defaults) blocks without speech are not decoded
+        model can also be a concurrent.futures.Future of a model (see load_model_in_background()), it is waited on when the model is needed
+        If a dict is passed as timings, the time.perf_counter() time the first transcript line was written is put in it as 'first_line'
+        Only the audio from start seconds up to end seconds (None for the end of the file) is transcribed, the file is memory mapped so the range is read without reading what comes before it
+        p_wav_path can also be the manifest of a segmented recording (see segments.py), its segments are transcribed as one recording
+        With follow=True a manifest's segments are transcribed as soon as each is closed, until the recording is stopped (workers is ignored)
+        Progress is checkpointed every CHECKPOINT_INTERVAL seconds, resume=True picks up an interrupted transcription with the same settings from its last checkpoint
+        If a list is passed as texts the text of every window is added to it (ex. for refine())
+    """
+
+    # A followed recording's manifest may not have been created yet
+    if not os.path.exists(p_wav_path) and not follow:
         sys.stderr.write(f"Wav file not found (in transcriber.from_wav()):  {p_wav_path}\n")
         return -1
+
+    # Get file types to determine output file formats
+    output_paths = _check_output_paths(p_output_path, 'from_wav')
+    if output_paths is None:
+        return -2
     
 
-    with wave.open(p_wav_path, 'rb') as wf:
+    try:
+        wf = open_recording(p_wav_path, start=start, end=end, follow=follow)
+    except (OSError, ValueError, KeyError, wave.Error) as error:
+        sys.stderr.write(f"Unable to read wav file (in transcriber.from_wav()):  {p_wav_path}:  {error}\n")
+        return -1
+
+    with wf:
 
         sample_rate = wf.getframerate()
         frame_duration = int(sample_rate * block_duration)
+        window_blocks = int(timestamp_duration/block_duration)
 
         
-        # wav_datetime is timestamp for the start of the recording (file creation time - duration of recording)
+        # wav_datetime is timestamp for the start of the recording (file creation time - duration of recording, or the manifest's start time)
         # time_elapsed is used to keep track of seconds since start of recording
         # NOTE: Putting only the used hours, mins, and seconds in their own variables will prob be faster than using datetime methods but doubt it would make a noticeable difference
-        wav_datetime = os.path.getctime(p_wav_path)
-        wav_datetime = datetime.datetime.fromtimestamp(wav_datetime - (wf.getnframes() // sample_rate))
-        time_elapsed = datetime.datetime(1,1,1)
+        wav_datetime = datetime.datetime.fromtimestamp(wf.start_time)
+        metadata = {'audio_file_name': p_wav_path, 'creation_timestamp': wav_datetime}
+        # Both move to the start of the range so the timestamps match the whole file's
+        range_offset = datetime.timedelta(seconds=wf.start_seconds())
+        wav_datetime = wav_datetime + range_offset
+        time_elapsed = datetime.datetime(1,1,1) + range_offset
 
-            
-        # Get file type to determine output file format
-        file_type = p_output_path.split('.')[-1]
-        if file_type not in outputs.type_outputs:
-            sys.stderr.write(f"Invalid transcription file type (in transcriber.from_wav()):  .{file_type}\n")
-            return -2
-        header = f"Transcription of {p_wav_path}. Created on {wav_datetime.strftime("%D %H:%M:%S")}."
-        output_func = outputs.type_outputs[file_type]
 
+        # The checkpoint is kept next to the first output and removed once the transcription is finished
+        checkpoint_path = output_paths[0] + CHECKPOINT_SUFFIX
+        checkpoint_settings = _checkpoint_settings(p_wav_path, output_paths, follow, start=start, end=end, block_duration=block_duration, timestamp_duration=timestamp_duration)
+        checkpoint = _read_checkpoint(checkpoint_path, checkpoint_settings) if resume else None
+        # Windows already in the output files, decoding starts at the first window after them
+        windows = 0
+        if checkpoint is not None:
+            windows = checkpoint['windows']
+            wav_datetime = wav_datetime + windows * datetime.timedelta(seconds=timestamp_duration)
+            time_elapsed = time_elapsed + windows * datetime.timedelta(seconds=timestamp_duration)
+            print(f"Resuming transcription of {p_wav_path} from {windows * timestamp_duration} seconds in")
 
-        with open(p_output_path, 'wt') as output_file:
-            
-            recognizer = vosk.KaldiRecognizer(vosk.Model(p_vosk_model_path), sample_rate)
-            
-            # Begin transcription and writing to output file
-            count = 0
-            stop_flag = False
-            first_through = True
+        with contextlib.ExitStack() as output_files:
+
+            writers = _open_writers(output_paths, metadata, output_files, checkpoint)
+
+            # [samples skipped, samples checked] by the VAD, summed over every segment in parallel mode
+            vad_counts = [0, 0]
+
+            if windows > 0 and not follow and (windows * window_blocks + 1) * frame_duration > wf.getnframes():
+                # The checkpoint was made after the last window, only the footers are missing
+                pool = None
+                gate = None
+                window_texts = iter(())
+            elif workers > 1 and not follow:
+                # Segments come back from the pool in order, each as the list of its window texts
+                # Segments that were finished before the checkpoint are dropped, the one it falls in starts at the checkpoint
+                segment_jobs = [(p_wav_path, start, end, max(first, windows), last, frame_duration, window_blocks, vad_settings)
+                                for first, last in _find_segments(wf, frame_duration, window_blocks, workers * 4) if last is None or last > windows]
+                pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(p_vosk_model_path,))
+
+                def parallel_texts():
+                    for segment_texts, skipped, checked in pool.imap(_decode_segment, segment_jobs):
+                        vad_counts[0] += skipped
+                        vad_counts[1] += checked
+                        yield from segment_texts
+
+                window_texts = parallel_texts()
+                gate = None
+            else:
+                pool = None
+                if isinstance(model, concurrent.futures.Future):
+                    model = model.result()
+                recognizer = _make_recognizer(model if model is not None else load_model(p_vosk_model_path), sample_rate)
+                gate = vad.SpeechGate(sample_rate, **vad_settings) if vad_settings is not None else None
+                window_texts = _decode_windows(wf, recognizer, frame_duration, window_blocks, first_window=windows, gate=gate)
             
-            while not stop_flag:
+            # Begin transcription and writing to output files
+            delta = datetime.timedelta(seconds=timestamp_duration)
+            output_timer = telemetry.stage('output.write')
+            first_line = True
+            last_checkpoint = time.perf_counter()
+            for text_string in window_texts:
+
+                with output_timer:
+                    for writer in writers:
+                        writer.write(wav_datetime, time_elapsed, timestamp_duration, text_string)
+                if first_line:
+                    # The first line goes straight to the files so it shows up as soon as possible, the rest are buffered
+                    for writer in writers:
+                        writer.flush()
+                    if timings is not None:
+                        timings['first_line'] = time.perf_counter()
+                    first_line = False
+
+                # Increment datetime objects by timestamp_duration seconds
+                wav_datetime = wav_datetime + delta
+                time_elapsed = time_elapsed + delta
+                windows += 1
+                if texts is not None:
+                    texts.append(text_string)
+
+                # Window boundaries are the only places decoding can restart from and get the same text
+                if time.perf_counter() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    with output_timer:
+                        _write_checkpoint(checkpoint_path, checkpoint_settings, windows, (windows * window_blocks + 1) * frame_duration + round(wf.start_seconds() * sample_rate), writers, output_paths)
+                    last_checkpoint = time.perf_counter()
+
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+            with output_timer:
+                for writer in writers:
+                    writer.finish()
+            telemetry.flush()
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+
+            if gate is not None:
+                print(gate.report())
+            elif vad_settings is not None:
+                print(vad.report(vad_counts[0], vad_counts[1], sample_rate))
+
+    # Finished transcripts are searchable right away (if archive_index.configure() was called)
+    archive_index.update(output_paths)
+    return 1
+
+
+def _lower_priority():
+    """ Gives this process the lowest CPU priority, niceness REFINE_NICENESS on POSIX and priority class REFINE_PRIORITY_CLASS on Windows """
+
+    if hasattr(os, 'nice'):
+        os.nice(REFINE_NICENESS)
+    elif sys.platform == 'win32':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        if not kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), REFINE_PRIORITY_CLASS):
+            sys.stderr.write(f"Unable to lower the priority of the refining process (in transcriber._lower_priority()):  {ctypes.WinError()}\n")
+
+
+def _cpu_busy(p_max_load):
+    """ True if the other processes are keeping more than p_max_load of every CPU busy (always False where there is no load average, ex. Windows) """
+
+    if not hasattr(os, 'getloadavg'):
+        return False
+    # The 1 is this process
+    return os.getloadavg()[0] - 1 > (os.cpu_count() or 1) * p_max_load
+
+
+def _rewrite_outputs(p_output_paths, p_metadata, p_wav_datetime, p_time_elapsed, p_timestamp_duration, p_texts):
+    """ Writes every output again from scratch with p_texts (one per window), each file is replaced in one step so it is never seen half written """
+
+    delta = datetime.timedelta(seconds=p_timestamp_duration)
+    for x in p_output_paths:
+        with open(x + '.tmp', 'wt') as output_file:
+            writer = outputs.get_writer(x)(output_file, p_metadata)
+            for window, text_string in enumerate(p_texts):
+                writer.write(p_wav_datetime + window * delta, p_time_elapsed + window * delta, p_timestamp_duration, text_string)
+            writer.finish()
+        os.replace(x + '.tmp', x)
+
+
+def refine(p_wav_path, p_output_path, p_vosk_model_path, p_texts, *, block_duration=0.25, timestamp_duration=10, vad_settings=None, start=0.0, end=None, max_load=REFINE_MAX_LOAD):
+    """ Second transcription pass with a slower, more accurate model, meant to run in a background process after from_wav() has written a quick transcript
+        p_texts is the text of every window from the quick pass (see from_wav()'s texts option), each one is replaced as the model at p_vosk_model_path finishes that window
+        and the outputs at p_output_path are rewritten with the improved windows every REFINE_REWRITE_INTERVAL seconds, so they can be used the whole time
+        The process runs at the lowest priority and pauses while the rest of the system keeps more than max_load of the CPUs busy
+        The other options must be the same as the quick pass so the windows line up
+    """
+
+    _lower_priority()
+
+    output_paths = _check_output_paths(p_output_path, 'refine')
+    if output_paths is None:
+        return -2
+
+    try:
+        wf = open_recording(p_wav_path, start=start, end=end)
+    except (OSError, ValueError, KeyError, wave.Error) as error:
+        sys.stderr.write(f"Unable to read wav file (in transcriber.refine()):  {p_wav_path}:  {error}\n")
+        return -1
+
+    with wf:
+
+        sample_rate = wf.getframerate()
+        frame_duration = int(sample_rate * block_duration)
+        window_blocks = int(timestamp_duration/block_duration)
+
+        # Same timestamps and header as from_wav() wrote
+        wav_datetime = datetime.datetime.fromtimestamp(wf.start_time)
+        metadata = {'audio_file_name': p_wav_path, 'creation_timestamp': wav_datetime}
+        range_offset = datetime.timedelta(seconds=wf.start_seconds())
+        wav_datetime = wav_datetime + range_offset
+        time_elapsed = datetime.datetime(1,1,1) + range_offset
+
+        texts = list(p_texts)
+        recognizer = _make_recognizer(load_model(p_vosk_model_path), sample_rate)
+        gate = vad.SpeechGate(sample_rate, **vad_settings) if vad_settings is not None else None
+
+        last_rewrite = time.perf_counter()
+        refined = 0
+        try:
+            for window, text_string in enumerate(_decode_windows(wf, recognizer, frame_duration, window_blocks, gate=gate)):
+
+                if window < len(texts):
+                    texts[window] = text_string
+                else:
+                    texts.append(text_string)
+                refined = window + 1
+                telemetry.gauge('refine.progress', refined / len(texts))
+                telemetry.tick()
+
+                if time.perf_counter() - last_rewrite >= REFINE_REWRITE_INTERVAL:
+                    _rewrite_outputs(output_paths, metadata, wav_datetime, time_elapsed, timestamp_duration, texts)
+                    print(f"Refined {refined} of {len(texts)} windows ({refined / len(texts):.0%})")
+                    last_rewrite = time.perf_counter()
+
+                # Waiting here between windows holds the decoder where it is, it carries on from the same spot once the CPU frees up
+                if _cpu_busy(max_load):
+                    print(f"Refining paused while the CPU is busy")
+                    while _cpu_busy(max_load):
+                        time.sleep(REFINE_PAUSE_INTERVAL)
+                    print(f"Refining resumed")
+        except KeyboardInterrupt:
+            # Stopping early keeps whatever has been improved so far
+            print(f"Refining stopped after {refined} of {len(texts)} windows")
+
+        _rewrite_outputs(output_paths, metadata, wav_datetime, time_elapsed, timestamp_duration, texts)
+    telemetry.flush()
+    archive_index.update(output_paths)
+    if refined == len(texts):
+        print(f"Refined all {len(texts)} windows")
+
+    return 1
+
+
+def _write_hits(p_writers, p_hits, p_wav_datetime, p_time_elapsed):
+    """ Writes each (phrase, start, end, confidence) keyword hit from a keywords.Spotter, placed from p_wav_datetime and p_time_elapsed (the start of the audio the spotter was fed) """
+
+    for phrase, start, end, confidence in p_hits:
+        offset = datetime.timedelta(seconds=start)
+        for writer in p_writers:
+            writer.write(p_wav_datetime + offset, p_time_elapsed + offset, round(end - start, 2), phrase, None, confidence)
+
+
+def spot_keywords(p_wav_path, p_output_path, p_vosk_model_path, p_phrases, *, block_duration=0.25, model=None, vad_settings=None, timings=None, start=0.0, end=None, min_confidence=keywords.MIN_CONFIDENCE):
+    """ Finds when the phrases in p_phrases were said in the recording at p_wav_path and writes only those hits (time, phrase and confidence) to p_output_path
+        The recognizer only knows the phrases (see keywords.py), so this is several times faster than transcribing everything with from_wav()
+        Hits the recognizer is less sure of than min_confidence (0 to 1) are left out
+        p_output_path, model, vad_settings, timings, start and end are the same as from_wav(), and p_wav_path can be a segmented recording's manifest the same way
+    """
+
+    if not os.path.exists(p_wav_path):
+        sys.stderr.write(f"Wav file not found (in transcriber.spot_keywords()):  {p_wav_path}\n")
+        return -1
+
+    output_paths = _check_output_paths(p_output_path, 'spot_keywords')
+    if output_paths is None:
+        return -2
+
+    try:
+        wf = open_recording(p_wav_path, start=start, end=end)
+    except (OSError, ValueError, KeyError, wave.Error) as error:
+        sys.stderr.write(f"Unable to read wav file (in transcriber.spot_keywords()):  {p_wav_path}:  {error}\n")
+        return -1
+
+    with wf:
+
+        sample_rate = wf.getframerate()
+        frame_duration = int(sample_rate * block_duration)
+
+        # Same timestamps as from_wav()
+        wav_datetime = datetime.datetime.fromtimestamp(wf.start_time)
+        metadata = {'audio_file_name': p_wav_path, 'creation_timestamp': wav_datetime, 'keywords': list(p_phrases)}
+        range_offset = datetime.timedelta(seconds=wf.start_seconds())
+        wav_datetime = wav_datetime + range_offset
+        time_elapsed = datetime.datetime(1,1,1) + range_offset
+
+        if isinstance(model, concurrent.futures.Future):
+            model = model.result()
+        recognizer = _make_recognizer(model if model is not None else load_model(p_vosk_model_path), sample_rate, keywords.grammar(p_phrases))
+        spotter = keywords.Spotter(recognizer, p_phrases, sample_rate, min_confidence=min_confidence)
+        gate = vad.SpeechGate(sample_rate, **vad_settings) if vad_settings is not None else None
+
+        accept_timer = telemetry.stage('recognize.accept')
+        output_timer = telemetry.stage('output.write')
+        block_seconds = frame_duration / sample_rate
+
+        with contextlib.ExitStack() as output_files:
+
+            writers = _open_writers(output_paths, metadata, output_files)
+
+            while True:
 
                 data = wf.readframes(frame_duration)
                 if len(data) == 0:
-                    # This is setting count to -1 to trigger a final write to file before breaking out of while
-                    count = -1
-                    stop_flag = True
-
-                recognizer.AcceptWaveform(data)
-
-                # If num of seconds elapsed since last timestamp update is equal to timestamp_duration,
-                # Then write new timestamp to file + recognizer output and increment the time objs by 5s
-                if (count % int(timestamp_duration/block_duration) == 0 and not count==0 ) or count == -1:
-                    
-                    # Using python iterator slice functionality for better time since the returned JSON isn't complex
-                    text_string = f"{recognizer.Result()[14:-3]}"
-
-                    if first_through:
-                        output_func(output_file, wav_datetime, time_elapsed, timestamp_duration, text_string, header_string = header)
-                        first_through = False
+                    break
+
+                with accept_timer:
+                    if gate is None:
+                        hits = spotter.feed(_waveform(data))
+                    else:
+                        hits = []
+                        # Skipped silence still counts towards the hit times
+                        for is_speech, block in gate.feed(data):
+                            if is_speech:
+                                hits.extend(spotter.feed(_waveform(block)))
+                            else:
+                                spotter.skip(vad.SpeechGate.block_length(block))
+                telemetry.add('recognize.audio_seconds', block_seconds)
+                telemetry.tick()
+
+                if hits:
+                    with output_timer:
+                        _write_hits(writers, hits, wav_datetime, time_elapsed)
+                    if timings is not None and 'first_line' not in timings:
+                        timings['first_line'] = time.perf_counter()
+
+            if gate is not None:
+                gate.flush()
+            with output_timer:
+                _write_hits(writers, spotter.finish(), wav_datetime, time_elapsed)
+                for writer in writers:
+                    writer.finish()
+            if timings is not None and 'first_line' not in timings:
+                timings['first_line'] = time.perf_counter()
+
+    telemetry.flush()
+    print(f"{spotter.hits} keyword hits found in {p_wav_path}")
+    if gate is not None:
+        print(gate.report())
+
+    return 1
+
+
+def from_sources(p_sources, p_output_path, p_vosk_model_path, *, audio_file_name=None, block_duration=0.25, timestamp_duration=10, model=None, vad_settings=None, timings=None):
+    """ Transcribes each input of a recording on its own and writes their text labelled by input, in time order
+        p_sources is a list of (label, wav path) pairs, one per input (see the source_paths option of record_audio.record()), the wav files must all start at the same time
+        Each input is decoded by its own recognizer in its own process. Where processes can be forked the model is loaded once here and shared by every process, otherwise each one loads its own
+        model can be an already loaded vosk.Model or a Future of one, the same as from_wav() (only used where processes are forked)
+        audio_file_name is the name put in the output headers (default is the first input's wav path)
+    """
+
+    for _, x in p_sources:
+        if not os.path.exists(x):
+            sys.stderr.write(f"Wav file not found (in transcriber.from_sources()):  {x}\n")
+            return -1
+
+    output_paths = _check_output_paths(p_output_path, 'from_sources')
+    if output_paths is None:
+        return -2
+
+    try:
+        with open_recording(p_sources[0][1]) as wf:
+            sample_rate = wf.getframerate()
+            wav_datetime = datetime.datetime.fromtimestamp(wf.start_time)
+    except (OSError, ValueError, wave.Error) as error:
+        sys.stderr.write(f"Unable to read wav file (in transcriber.from_sources()):  {p_sources[0][1]}:  {error}\n")
+        return -1
+
+    frame_duration = int(sample_rate * block_duration)
+    window_blocks = int(timestamp_duration/block_duration)
+    time_elapsed = datetime.datetime(1,1,1)
+    metadata = {'audio_file_name': audio_file_name or p_sources[0][1], 'creation_timestamp': wav_datetime}
+
+    # Forked workers get the model that is loaded here for free (copy on write), so it is in memory once no matter how many inputs there are
+    global _worker_model
+    if 'fork' in multiprocessing.get_all_start_methods():
+        if isinstance(model, concurrent.futures.Future):
+            model = model.result()
+        _worker_model = model if model is not None else load_model(p_vosk_model_path)
+        pool = multiprocessing.get_context('fork').Pool(len(p_sources))
+        # The workers have their copy, this process doesn't need to hold on to it
+        _worker_model = None
+    else:
+        pool = multiprocessing.Pool(len(p_sources), initializer=_init_worker, initargs=(p_vosk_model_path,))
+
+    # Every input is one whole-file segment
+    with pool:
+        results = pool.map(_decode_segment, [(x, 0.0, None, 0, None, frame_duration, window_blocks, vad_settings) for _, x in p_sources])
+
+    with contextlib.ExitStack() as output_files:
+
+        writers = _open_writers(output_paths, metadata, output_files)
+        delta = datetime.timedelta(seconds=timestamp_duration)
+        output_timer = telemetry.stage('output.write')
+
+        for window in range(max(len(texts) for texts, _, _ in results)):
+
+            # Inputs that heard nothing in this window are left out, if none of them heard anything one unlabelled empty entry keeps the timestamps going
+            entries = [(label, texts[window]) for (label, _), (texts, _, _) in zip(p_sources, results) if window < len(texts) and texts[window]]
+            if not entries:
+                entries = [(None, '')]
+
+            with output_timer:
+                for label, text_string in entries:
+                    for writer in writers:
+                        writer.write(wav_datetime, time_elapsed, timestamp_duration, text_string, label)
+
+            wav_datetime = wav_datetime + delta
+            time_elapsed = time_elapsed + delta
+
+        with output_timer:
+            for writer in writers:
+                writer.finish()
+    if timings is not None:
+        timings['first_line'] = time.perf_counter()
+    telemetry.flush()
+    archive_index.update(output_paths)
+
+    if vad_settings is not None:
+        for (label, _), (_, skipped, checked) in zip(p_sources, results):
+            print(f"{label}: {vad.report(skipped, checked, sample_rate)}")
+
+    return 1
+
+
+def _receive_live(p_pipe_in):
+    """ Next message from record_audio.prepare_audio(), the end of the recording (an empty message) if it exited without sending one """
+
+    try:
+        return p_pipe_in.recv_bytes()
+    except EOFError:
+        return b''
+
+
+def from_stream(p_pipe_in, p_wav_path, p_output_path, p_vosk_model_path, *, sample_rate=16000, timestamp_duration=10, phrases=None, min_confidence=keywords.MIN_CONFIDENCE):
+    """ Transcribes 16 bit mono audio received via p_pipe_in while it is still being recorded
+        p_wav_path is only used for the header, the audio itself comes from record_audio.prepare_audio()
+        p_output_path can be a list of output paths, every output is written as the recording goes
+        If a list of phrases is passed only keyword hits of those phrases are written, the same as spot_keywords()
+        Messages are LIVE_AUDIO followed by audio bytes, or LIVE_SILENCE followed by the number of samples skipped by the VAD (8 byte little endian)
+        An empty bytes message on p_pipe_in marks the end of the recording
+    """
+
+    # Get file types to determine output file formats
+    output_paths = _check_output_paths(p_output_path, 'from_stream')
+    if output_paths is None:
+        return -2
+
+    # Loading the model is the slow part, it is done before any audio arrives
+    recognizer = _make_recognizer(load_model(p_vosk_model_path), sample_rate, keywords.grammar(phrases) if phrases else None)
+    spotter = keywords.Spotter(recognizer, phrases, sample_rate, min_confidence=min_confidence) if phrases else None
+    metadata = {'audio_file_name': p_wav_path}
+    if spotter is not None:
+        metadata['keywords'] = list(phrases)
+
+    # Each window holds timestamp_duration seconds of 16 bit samples
+    window_bytes = int(sample_rate * timestamp_duration) * 2
+    window_filled = 0
+    delta = datetime.timedelta(seconds=timestamp_duration)
+
+    accept_timer = telemetry.stage('recognize.accept')
+    result_timer = telemetry.stage('recognize.result')
+    output_timer = telemetry.stage('output.write')
+    # Seconds of audio received so far, how far it is behind the wall clock is how late the transcript is
+    audio_seconds = 0.0
+
+    with contextlib.ExitStack() as output_files:
+
+        data = _receive_live(p_pipe_in)
+        writers = None
+
+        while len(data) != 0:
+
+            # Skipped silence still moves the timestamps along, it just isn't decoded
+            if data[:1] == LIVE_SILENCE:
+                audio = None
+                remaining = int.from_bytes(data[1:], 'little') * 2
+            else:
+                audio = data[1:]
+                remaining = len(audio)
+
+            if writers is None:
+                # wav_datetime is the timestamp for the start of the recording (arrival time of the first block - duration of the block)
+                wav_datetime = datetime.datetime.now() - datetime.timedelta(seconds=remaining / 2 / sample_rate)
+                time_elapsed = datetime.datetime(1,1,1)
+                writers = _open_writers(output_paths, dict(metadata, creation_timestamp=wav_datetime), output_files)
+                recording_start = time.monotonic() - remaining / 2 / sample_rate
+
+            audio_seconds += remaining / 2 / sample_rate
+            telemetry.add('recognize.audio_seconds', remaining / 2 / sample_rate)
+
+            if spotter is not None:
+                # Hits aren't tied to windows, each one is written as soon as the utterance it is in is finished
+                with accept_timer:
+                    if audio is None:
+                        spotter.skip(remaining // 2)
+                        hits = []
                     else:
-                        output_func(output_file, wav_datetime, time_elapsed, timestamp_duration, text_string)
+                        hits = spotter.feed(audio)
+                if hits:
+                    with output_timer:
+                        _write_hits(writers, hits, wav_datetime, time_elapsed)
+                        for writer in writers:
+                            writer.flush()
+                remaining = 0
+
+            # Blocks are split at window boundaries so each timestamp covers exactly timestamp_duration seconds of audio
+            while remaining != 0:
+                block_length = min(remaining, window_bytes - window_filled)
+                if audio is not None:
+                    with accept_timer:
+                        recognizer.AcceptWaveform(audio[len(audio) - remaining:len(audio) - remaining + block_length])
+                remaining -= block_length
+                window_filled += block_length
+
+                if window_filled == window_bytes:
+
+                    with result_timer:
+                        text_string = f"{recognizer.Result()[14:-3]}"
+
+                    # Flushed right away so the transcript can be followed while recording
+                    with output_timer:
+                        for writer in writers:
+                            writer.write(wav_datetime, time_elapsed, timestamp_duration, text_string)
+                            writer.flush()
 
-                    # Increment datetime objects by timestamp_duration seconds``
-                    delta = datetime.timedelta(seconds=timestamp_duration)
                     wav_datetime = wav_datetime + delta
                     time_elapsed = time_elapsed + delta
+                    window_filled = 0
+
+            telemetry.gauge('live.lag_seconds', time.monotonic() - recording_start - audio_seconds)
+            telemetry.tick()
+            data = _receive_live(p_pipe_in)
 
-                count += 1
+        if writers is None:
+            # Nothing was recorded
+            wav_datetime = datetime.datetime.now()
+            time_elapsed = datetime.datetime(1,1,1)
+            writers = _open_writers(output_paths, dict(metadata, creation_timestamp=wav_datetime), output_files)
 
-            # Perform final call to output_func
-            footer = "\n\nEnd of transcription. Have a good day."
-            output_func(output_file, wav_datetime, time_elapsed, 0, '', footer_string=footer)
+        if spotter is not None:
+            with output_timer:
+                _write_hits(writers, spotter.finish(), wav_datetime, time_elapsed)
+                for writer in writers:
+                    writer.finish()
+        else:
+            # Write whatever is left in the last (partial) window
+            with result_timer:
+                text_string = f"{recognizer.FinalResult()[14:-3]}"
+            with output_timer:
+                for writer in writers:
+                    writer.write(wav_datetime, time_elapsed, timestamp_duration, text_string)
+                    writer.finish()
 
+    telemetry.flush()
+    archive_index.update(output_paths)
     return 1
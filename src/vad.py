@@ -0,0 +1,127 @@
+# pylint: disable=line-too-long
+""" Voice activity detection, used to keep silence from being passed to the recognizer """
+# Audio is split into VAD_FRAME_DURATION frames and a frame counts as speech when it is loud enough and, unless
+# it is much louder than the threshold, doesn't have the high zero crossing rate of hiss and fan noise.
+# SpeechGate works on blocks of any size: a block is speech if any of its frames are, speech is held open for
+# the hangover time after the last speech block, and up to the padding time of silence before speech is held
+# back so it can be passed on with the speech instead of being skipped.
+
+import collections
+
+import numpy
+
+VAD_FRAME_DURATION = 0.02
+# Frames quieter than this (in dB relative to full scale) are silence
+ENERGY_THRESHOLD_DB = -45.0
+# Frames with more sign changes per sample than this are treated as noise, unless they are ENERGY_OVERRIDE_DB louder than the threshold
+ZCR_THRESHOLD = 0.35
+ENERGY_OVERRIDE_DB = 15.0
+# Seconds of audio after speech that are still treated as speech
+HANGOVER_DURATION = 0.5
+# Seconds of silence before speech that are passed on with the speech
+PADDING_DURATION = 0.25
+
+
+def speech_frames(p_samples, p_sample_rate=16000, *, energy_threshold=ENERGY_THRESHOLD_DB, zcr_threshold=ZCR_THRESHOLD):
+    """ Returns a boolean array with one entry per VAD_FRAME_DURATION frame of p_samples (16 bit mono), True where the frame is speech """
+
+    frame_size = int(p_sample_rate * VAD_FRAME_DURATION)
+    num_frames = -(-len(p_samples) // frame_size)
+    if num_frames == 0:
+        return numpy.zeros(0, dtype=bool)
+
+    # The last partial frame is padded with zeros
+    frames = numpy.zeros(num_frames * frame_size, dtype=numpy.float32)
+    frames[:len(p_samples)] = p_samples
+    frames = frames.reshape(num_frames, frame_size)
+
+    energy_db = 10 * numpy.log10(numpy.mean(frames * frames, axis=1) / (32768.0 * 32768.0) + 1e-12)
+    zcr = numpy.mean(numpy.signbit(frames[:, 1:]) != numpy.signbit(frames[:, :-1]), axis=1)
+
+    return (energy_db > energy_threshold) & ((zcr < zcr_threshold) | (energy_db > energy_threshold + ENERGY_OVERRIDE_DB))
+
+
+class SpeechGate:
+    """ Stateful VAD for a stream of audio blocks, feed() returns the blocks to decode and the blocks to skip, in order """
+
+    def __init__(self, p_sample_rate=16000, *, energy_threshold=ENERGY_THRESHOLD_DB, zcr_threshold=ZCR_THRESHOLD, hangover=HANGOVER_DURATION, padding=PADDING_DURATION):
+
+        self.sample_rate = p_sample_rate
+        self.energy_threshold = energy_threshold
+        self.zcr_threshold = zcr_threshold
+        self.hangover_samples = int(hangover * p_sample_rate)
+        self.padding_samples = int(padding * p_sample_rate)
+
+        self.hangover_left = 0
+        self.held = collections.deque()
+        self.held_samples = 0
+
+        # Reported once the stream is finished
+        self.total_samples = 0
+        self.skipped_samples = 0
+
+    def feed(self, p_samples):
+        """ Takes the next block of 16 bit mono samples (numpy array or bytes)
+            Returns a list of (is_speech, block) pairs covering every block fed so far that hasn't been returned yet, in order
+        """
+
+        if isinstance(p_samples, (bytes, bytearray, memoryview)):
+            samples = numpy.frombuffer(p_samples, dtype=numpy.int16)
+        else:
+            samples = p_samples
+        self.total_samples += len(samples)
+
+        if speech_frames(samples, self.sample_rate, energy_threshold=self.energy_threshold, zcr_threshold=self.zcr_threshold).any():
+            self.hangover_left = self.hangover_samples
+            is_speech = True
+        elif self.hangover_left > 0:
+            self.hangover_left -= len(samples)
+            is_speech = True
+        else:
+            is_speech = False
+
+        if is_speech:
+            # Silence held back as padding goes out in front of the speech
+            blocks = [(True, x) for x in self.held]
+            blocks.append((True, p_samples))
+            self.held.clear()
+            self.held_samples = 0
+            return blocks
+
+        self.held.append(p_samples)
+        self.held_samples += len(samples)
+        blocks = []
+        while self.held and self.held_samples - self.block_length(self.held[0]) >= self.padding_samples:
+            block = self.held.popleft()
+            self.held_samples -= self.block_length(block)
+            self.skipped_samples += self.block_length(block)
+            blocks.append((False, block))
+        return blocks
+
+    def flush(self):
+        """ Returns whatever is still held back as skipped blocks, call once the stream has ended """
+
+        blocks = [(False, x) for x in self.held]
+        self.skipped_samples += self.held_samples
+        self.held.clear()
+        self.held_samples = 0
+        return blocks
+
+    @staticmethod
+    def block_length(p_block):
+        """ Number of samples in a block that was fed as either bytes or a numpy array """
+
+        return len(p_block) // 2 if isinstance(p_block, (bytes, bytearray, memoryview)) else len(p_block)
+
+    def report(self):
+        """ Returns a one line summary of how much audio was skipped """
+
+        return report(self.skipped_samples, self.total_samples, self.sample_rate)
+
+
+def report(p_skipped_samples, p_total_samples, p_sample_rate=16000):
+    """ Returns a one line summary of how much audio the VAD skipped """
+
+    if p_total_samples == 0:
+        return "VAD skipped no audio"
+    return f"VAD skipped {p_skipped_samples / p_sample_rate:.1f} of {p_total_samples / p_sample_rate:.1f} seconds of audio ({100 * p_skipped_samples / p_total_samples:.0f}%)"
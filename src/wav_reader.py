@@ -0,0 +1,137 @@
+# pylint: disable=line-too-long
+""" Memory mapped reader for PCM wav files, a stand-in for wave.Wave_read that hands out slices of the file instead of copies """
+# readframes() returns memoryview slices of the mapped data chunk, so reading a block costs no allocation or copy.
+# A time range can be passed to open only part of a recording, the reader then acts as if the range was the whole
+# file (positions and frame counts are relative to the start of the range).
+# Data chunks with a bad size (ex. a recording that was never finished) are read up to the end of the file.
+# Anything else wrong with the file raises wave.Error, the same as wave.open() does.
+
+import os
+import mmap
+import wave
+import struct
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavReader:
+    """ Read only view of the PCM frames of the wav file at p_wav_path, from start seconds up to end seconds (None for the end of the file) """
+
+    def __init__(self, p_wav_path, *, start=0.0, end=None):
+
+        with open(p_wav_path, 'rb') as wav_file:
+            if os.fstat(wav_file.fileno()).st_size == 0:
+                raise wave.Error(f"{p_wav_path} is empty")
+            self.mmap = mmap.mmap(wav_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self._parse_chunks(p_wav_path)
+        except wave.Error:
+            self.mmap.close()
+            raise
+        except struct.error as error:
+            self.mmap.close()
+            raise wave.Error(f"{p_wav_path} has a damaged header: {error}") from error
+
+        file_frames = len(self.data) // self.frame_size
+        self.start_frame = min(max(0, round(start * self.sample_rate)), file_frames)
+        self.end_frame = file_frames if end is None else min(max(self.start_frame, round(end * self.sample_rate)), file_frames)
+        self.position = 0
+        # Wall-clock time of the file's first frame, recordings are created when they are stopped so it's the creation time - the duration
+        self.start_time = os.path.getctime(p_wav_path) - int(self.file_duration())
+
+    def file_duration(self):
+        """ Seconds of audio in the whole file, not just the range """
+
+        return len(self.data) // self.frame_size / self.sample_rate
+
+    def start_seconds(self):
+        """ Seconds from the start of the file to the start of the range """
+
+        return self.start_frame / self.sample_rate
+
+    def _parse_chunks(self, p_wav_path):
+        """ Finds the fmt and data chunks, self.data is a memoryview of the data chunk's frames """
+
+        if self.mmap[0:4] != b'RIFF' or self.mmap[8:12] != b'WAVE':
+            raise wave.Error(f"{p_wav_path} is not a RIFF/WAVE file")
+
+        offset = 12
+        fmt = None
+        while offset + 8 <= len(self.mmap):
+            chunk_id = self.mmap[offset:offset + 4]
+            chunk_size = struct.unpack_from('<I', self.mmap, offset + 4)[0]
+            offset += 8
+
+            if chunk_id == b'fmt ':
+                # The PCM fields are the first 16 bytes, a shorter chunk (or one cut off by the end of the file) is damaged
+                if chunk_size < 16 or offset + 16 > len(self.mmap):
+                    raise wave.Error(f"{p_wav_path} has a truncated fmt chunk")
+                fmt = struct.unpack_from('<HHIIHH', self.mmap, offset)
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise wave.Error(f"{p_wav_path} has its data chunk before its fmt chunk")
+                # Sizes past the end of the file come from recordings that were cut off before the header was finished
+                data_size = min(chunk_size, len(self.mmap) - offset)
+                break
+
+            # Chunks are padded to an even length
+            offset += chunk_size + (chunk_size & 1)
+        else:
+            raise wave.Error(f"{p_wav_path} has no data chunk")
+
+        format_tag, self.channels, self.sample_rate, _, _, bits = fmt
+        if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_EXTENSIBLE) or bits % 8 != 0 or bits == 0:
+            raise wave.Error(f"{p_wav_path} is not integer PCM")
+        if self.channels == 0 or self.sample_rate == 0:
+            raise wave.Error(f"{p_wav_path} has no channels or a sample rate of 0")
+        self.sample_width = bits // 8
+        self.frame_size = self.channels * self.sample_width
+        self.data = memoryview(self.mmap)[offset:offset + data_size - data_size % self.frame_size]
+
+    def getnchannels(self):
+        return self.channels
+
+    def getsampwidth(self):
+        return self.sample_width
+
+    def getframerate(self):
+        return self.sample_rate
+
+    def getnframes(self):
+        return self.end_frame - self.start_frame
+
+    def tell(self):
+        return self.position
+
+    def setpos(self, p_position):
+        """ Moves to frame p_position (relative to the start of the range) """
+
+        if p_position < 0 or p_position > self.getnframes():
+            raise wave.Error('position not in range')
+        self.position = p_position
+
+    def readframes(self, p_num_frames):
+        """ Returns up to p_num_frames frames as a memoryview into the file, an empty memoryview at the end of the range """
+
+        end = min(self.position + p_num_frames, self.getnframes())
+        frames = self.data[(self.start_frame + self.position) * self.frame_size:(self.start_frame + end) * self.frame_size]
+        self.position = end
+        return frames
+
+    def close(self):
+        """ Unmaps the file, if slices handed out by readframes() are still alive the mapping is freed once they are """
+
+        self.data.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, p_type, p_value, p_traceback):
+        self.close()
+        return False
@@ -0,0 +1,53 @@
+# pylint: disable=line-too-long
+""" Runs the transcription daemon, which keeps recognition models loaded so transcriptions don't have to load them each time """
+
+import sys
+import argparse
+import configparser
+
+sys.path.append('.\\src\\')
+import daemon
+import archive_index
+
+# Modify the following constants as desired
+DAEMON_PORT = daemon.DEFAULT_PORT
+# Finished transcripts are added to this index for search_archive.py ('' to not index them)
+TRANSCRIPT_INDEX = archive_index.INDEX_FILENAME
+
+
+if __name__ == '__main__':
+    """ da main function """
+
+
+    # Parsing config defaults from default_values.ini into variables
+    config_parser = configparser.ConfigParser()
+    config_parser.read('default_values.ini')
+    defaults = config_parser['DEFAULT_VALUES']
+
+    try:
+        DAEMON_PORT = int(defaults.get('DAEMON_PORT', DAEMON_PORT))
+    except ValueError:
+        print(f'\nInvalid value for DAEMON_PORT in default_values.ini.\n\nPlease make sure DAEMON_PORT in default_values.ini is a number.\nCurrent value: {defaults['DAEMON_PORT']}\n', file=sys.stderr)
+        quit()
+    TRANSCRIPT_INDEX = defaults.get('TRANSCRIPT_INDEX', TRANSCRIPT_INDEX)
+    if TRANSCRIPT_INDEX:
+        archive_index.configure(TRANSCRIPT_INDEX)
+
+    # Parsing CLI arguments and updating config defaults
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-p","--port", type=int, default=DAEMON_PORT,   help=f"Set the localhost port the daemon listens on (default is {DAEMON_PORT})")
+    arg_parser.add_argument("-w","--workers", type=int, default=daemon.DEFAULT_WORKERS,   help=f"Set the number of jobs transcribed at the same time (default is {daemon.DEFAULT_WORKERS})")
+    arg_parser.add_argument("-q","--queue_size", type=int, default=daemon.DEFAULT_QUEUE_SIZE,   help=f"Set the number of jobs that can wait in the queue before new jobs are turned away (default is {daemon.DEFAULT_QUEUE_SIZE})")
+    arg_parser.add_argument("-b","--memory_budget", type=int, default=daemon.DEFAULT_MEMORY_BUDGET_MB,   help=f"Set the memory (in MB) loaded recognition models may use before the least recently used model is unloaded (default is {daemon.DEFAULT_MEMORY_BUDGET_MB})")
+
+    args = arg_parser.parse_args()
+
+
+    server = daemon.TranscriptionDaemon(args.port, workers=args.workers, queue_size=args.queue_size, memory_budget_mb=args.memory_budget)
+    print(f"Transcription daemon listening on 127.0.0.1:{args.port}")
+    print(f"Press Ctrl+C to stop\n")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Stopping daemon...")
+    server.server_close()